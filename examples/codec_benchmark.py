@@ -0,0 +1,100 @@
+""" Reports the encode time and size per frame of the output codecs.
+
+A frame is rendered once and its color image is then encoded with every
+codec configuration, so only the encoding is timed.
+
+    blender --background --python examples/codec_benchmark.py -- --width 1920 --height 1080
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import bpy
+import numpy as np
+
+import shapes3d as shps
+from shapes3d.render import set_image_format
+from shapes3d.worlds import SimpleWorld
+
+# name -> arguments of shps.render.set_image_format
+CODECS = {
+    "png_rgba8_c15": dict(file_format='PNG', color_mode='RGBA', color_depth='8', compression=15),
+    "png_rgb8_c0": dict(file_format='PNG', color_mode='RGB', color_depth='8', compression=0),
+    "png_rgb8_c15": dict(file_format='PNG', color_mode='RGB', color_depth='8', compression=15),
+    "png_rgb8_c90": dict(file_format='PNG', color_mode='RGB', color_depth='8', compression=90),
+    "png_rgb16_c15": dict(file_format='PNG', color_mode='RGB', color_depth='16', compression=15),
+    "webp_lossless": dict(file_format='WEBP', color_mode='RGB', quality=100),
+    "webp_q90": dict(file_format='WEBP', color_mode='RGB', quality=90),
+    "jpeg_q90": dict(file_format='JPEG', color_mode='RGB', quality=90),
+    "exr_half_zip": dict(file_format='OPEN_EXR', color_mode='RGB', color_depth='16', exr_codec='ZIP'),
+    "exr_half_piz": dict(file_format='OPEN_EXR', color_mode='RGB', color_depth='16', exr_codec='PIZ'),
+    "exr_half_dwaa": dict(file_format='OPEN_EXR', color_mode='RGB', color_depth='16', exr_codec='DWAA'),
+}
+
+
+def render_frame(folder, gpu, samples, width, height):
+    env = SimpleWorld(use_gpu=gpu)
+    env.set_renderer(gpu=gpu, samples=samples, image_resolution=(width, height))
+    random.seed(0)
+    np.random.seed(0)
+    for _ in range(4):
+        env.add_sphere()
+        env.add_cuboid()
+        env.add_cylinder()
+        env.add_cone()
+    # The segmentation pass would leave its image in the viewer
+    shps.render.unset_instance_segmentation()
+    env.render(folder, 1, camera_location=(0, -8, 3), camera_rotation=(1.2, 0, 0))
+    return env
+
+
+def benchmark_codecs(folder, repeats):
+    scene = bpy.data.scenes['Scene']
+    # Color image of the last render, also used for the bboxes
+    image = bpy.data.images['Viewer Node']
+    results = {}
+    for name, codec in CODECS.items():
+        if not shps.render.has_file_format(codec["file_format"]):
+            print("Skipping %s, not supported by this blender" % name)
+            continue
+        set_image_format(scene.render.image_settings, **codec)
+        ext = shps.render.FILE_EXTENSIONS[codec["file_format"]]
+        path = os.path.abspath(os.path.join(folder, "codec_" + name + ext))
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            image.save_render(path, scene=scene)
+            times.append(time.perf_counter() - start)
+        results[name] = {"seconds": float(np.median(times)),
+                         "bytes": os.path.getsize(path)}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the encode time and size of codecs")
+    parser.add_argument('-f', '--destination', type=str, default="codec_benchmark",
+                        help="Folder destination for the images and benchmark.json")
+    parser.add_argument('--repeats', type=int, default=5, help="Encodes per codec")
+    parser.add_argument('--gpu', action="store_true", help="Render with the gpu")
+    parser.add_argument('--samples', type=int, default=64, help="Samples per pixel")
+    parser.add_argument('--width', type=int, default=1920, help="Width of the images in px")
+    parser.add_argument('--height', type=int, default=1080, help="Height of the images in px")
+
+    argv = sys.argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.destination, exist_ok=True)
+    env = render_frame(args.destination, args.gpu, args.samples, args.width, args.height)
+    results = benchmark_codecs(args.destination, args.repeats)
+
+    with open(os.path.join(args.destination, "benchmark.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    print("%-16s %12s %12s" % ("codec", "encode ms", "KiB"))
+    for name, result in sorted(results.items(), key=lambda item: item[1]["bytes"]):
+        print("%-16s %12.1f %12.1f" % (name, 1000*result["seconds"], result["bytes"]/1024))
+    env.close()
@@ -6,11 +6,14 @@ import random
 from collections import namedtuple
 from pdb import set_trace
 from PIL import Image
+import shapes3d as shps
 from shapes3d.worlds import SimpleWorld
 import math
 from tqdm import tqdm
 import bpy
+import numpy as np
 import sys
+import time
 
 ENV_DIM = 20
 MAX_NUM_OBJS = 15
@@ -18,13 +21,35 @@ MIN_NUM_OBJS = 7
 FOV = 45
 PLANE_COLOR = [1, 1, 1]
 TYPES = ['sphere', 'cuboid', 'cylinder']
+MIN_CONTENT = 0.05 # Min fraction of the image covered by objects
+MIN_VISIBLE = 0.03 # Min fraction of the image covered by unoccluded objects
+POSE_ATTEMPTS = 3 # Times the missing camera pairs of an environment are sampled
+
+def sample_pairs(env, num_pairs):
+    """Samples pairs of camera poses, sampling the missing ones again up to
+    POSE_ATTEMPTS times. May return fewer than num_pairs."""
+    locations, rotations = env.sample_camera_poses(num_pairs, pairs=True,
+                                                   min_content=MIN_CONTENT,
+                                                   min_visible=MIN_VISIBLE)
+    for _ in range(POSE_ATTEMPTS - 1):
+        if len(locations) >= num_pairs:
+            break
+        locs, rots = env.sample_camera_poses(num_pairs - len(locations), pairs=True,
+                                             min_content=MIN_CONTENT,
+                                             min_visible=MIN_VISIBLE)
+        locations = np.concatenate([locations, locs])
+        rotations = np.concatenate([rotations, rots])
+    return locations, rotations
 
 def generate_dataset(destination_folder,
                      num_total_imgs,
                      num_total_envs,
                      num_eval_envs,
                      width,
-                     height):
+                     height,
+                     metadata_path=None,
+                     frames_per_hour=None,
+                     metrics_path=None):
 
     train, val = [], []
 
@@ -45,10 +70,22 @@ def generate_dataset(destination_folder,
     intrinsic = [" ".join(intrinsic), "fx fy cx cy"]
     save_in_txt(os.path.join(destination_folder, "intrinsic_matrix.txt"), intrinsic, "\n")
 
-    with tqdm(total=num_total_imgs) as pbar:
+    metadata = shps.metadata.MetadataDB(metadata_path) if metadata_path else None
+
+    # Datablocks and memory after every frame and reset, warns on leaks
+    if metrics_path:
+        env.set_metrics(shps.metrics.MetricsRecorder(metrics_path))
+
+    # Adaptive sampling tuned to meet the throughput, settings logged per frame
+    scheduler = None
+    if frames_per_hour:
+        scheduler = shps.scheduler.SamplingScheduler(
+            frames_per_hour, log_path=os.path.join(destination_folder, "sampling.jsonl"))
+
+    num_pairs = num_total_imgs//num_total_envs
+    with tqdm(total=num_pairs*num_total_envs, unit="pair") as pbar:
         for env_num in range(num_total_envs):
             env.reset()
-            epsilon = 0.1
             folder = os.path.join(destination_folder, str(env_num))
             check_folder_or_create(folder)
 
@@ -70,74 +107,29 @@ def generate_dataset(destination_folder,
                 elif obj_type == "cylinder":
                     env.add_cylinder()
 
-            # Choose a random pose and orientation for camera
-            for img_num in range(num_total_imgs//num_total_envs):
-                while True:
-                    ref = random.choice(env._shapes)
-                    x, y, _ = ref._location[:]
-                
-                    range_dis = ENV_DIM/2 - max(abs(x), abs(y))
-
-                    angle = random.uniform(0, 2*math.pi)
-                    distance = random.uniform(4, range_dis - epsilon)
-
-                    dx1 = random.uniform(-1, 1)
-                    dy1 = random.uniform(-1, 1)
-                    dz1 = 0
-                    dyaw1 = 0
-
-                    x1 = x + math.cos(angle)*distance + dx1
-                    y1 = y + math.sin(angle)*distance + dy1
-
-                    if max(abs(x1),abs(y1)) > ENV_DIM/2 - 1:
-                        continue
-
-                    # Check if valid 
-                    if not env.check_collisions(x1, y1, 1):
-                        continue
-                    
-                    # Generate second position
-                    for _ in range(20):
-                        dx2 = random.uniform(-1, 1)
-                        dy2 = random.uniform(-1, 1)
-                        dz2 = 0
-
-                        dyaw2 = random.uniform(-1, 1) * math.pi/8
-
-                        if env.check_collisions(x1 + dx2, y1 + dy2, 1):
-                            break
-                    else:
-                        continue
-                    break
-                
-                # Get base yaw
-                yaw = math.pi/2 + angle
-
-                # render from x1,y2 and from x1+dx2 and y1+dy1
-                tra1 = (x1, y1, 1)
-                tra2 = (x1 + dx2, y1 + dy2, 1)
-                rot1 = (math.pi/2, 0, yaw + dyaw1)
-                rot2 = (math.pi/2, 0, yaw + dyaw2)
-
-                env.render(folder, 2*img_num+1,
-                           camera_location=tra1,
-                           camera_rotation=rot1)
-                env.render(folder, 2*img_num+2,
-                           camera_location=tra2,
-                           camera_rotation=rot2)
-
-                extrinsic1 = [str(i) for i in tra1 + rot1]
-                extrinsic2 = [str(i) for i in tra2 + rot2]
-
-                extrinsic1 = [" ".join(extrinsic1), "rx ry rz tx ty tz"]
-                extrinsic2 = [" ".join(extrinsic2), "rx ry rz tx ty tz"]
-
-                save_in_txt(
-                    os.path.join(folder, "Extrinsic_{:04d}.txt".format(2*img_num+1)),
-                    extrinsic1, "\n")
-                save_in_txt(
-                    os.path.join(folder, "Extrinsic_{:04d}.txt".format(2*img_num+2)),
-                    extrinsic2, "\n")
+            # Choose random pairs of nearby poses looking at the objects
+            locations, rotations = sample_pairs(env, num_pairs)
+            if len(locations) < num_pairs:
+                tqdm.write("Environment %d: only %d of %d camera pairs found" %
+                           (env_num, len(locations), num_pairs))
+                pbar.total -= num_pairs - len(locations)
+                pbar.refresh()
+
+            for img_num, (locs, rots) in enumerate(zip(locations, rotations)):
+                if scheduler is not None:
+                    scheduler.apply()
+                start = time.perf_counter()
+
+                # Both poses of the pair in a single render call, the scene is
+                # added to the metadata once per environment
+                env.render_views(folder, [2*img_num+1, 2*img_num+2],
+                                 camera_locations=[tuple(float(v) for v in loc) for loc in locs],
+                                 camera_rotations=[tuple(float(v) for v in rot) for rot in rots],
+                                 metadata=metadata,
+                                 split="val" if env_num < num_eval_envs else "train")
+
+                if scheduler is not None:
+                    scheduler.update(time.perf_counter() - start, 2*img_num+1, frames=2)
 
                 if env_num < num_eval_envs:
                     val.append((str(env_num), str(2*img_num+1)))
@@ -148,6 +140,8 @@ def generate_dataset(destination_folder,
 
                 pbar.update(1)
 
+    if metadata is not None:
+        metadata.close()
     env.close()
     train = [' '.join(x) for x in train]
     val = [' '.join(x) for x in val]
@@ -185,6 +179,12 @@ if __name__ == '__main__':
                         help="Width in pixels of the images")
     parser.add_argument('--height', type=int, default=300,
                         help="Width in pixels of the images")
+    parser.add_argument('--frames_per_hour', type=float, default=None,
+                        help="Target throughput, enables adaptive sampling with a time budget")
+    parser.add_argument('--metrics', type=str, default=None,
+                        help="jsonl file where to record datablock counts and memory per frame")
+    parser.add_argument('--metadata', type=str, default=None,
+                        help="SQLite file where to index the cameras and bboxes of the frames")
 
     argv = sys.argv
     if " -- " in argv:
@@ -194,4 +194,7 @@ if __name__ == '__main__':
 
     args = parser.parse_args(argv)
 
-    generate_dataset(args.destination, args.num_total_imgs, args.num_total_envs, args.num_eval_envs, width=args.width, height=args.height)
+    generate_dataset(args.destination, args.num_total_imgs, args.num_total_envs, args.num_eval_envs, width=args.width, height=args.height,
+                     metadata_path=args.metadata,
+                     frames_per_hour=args.frames_per_hour,
+                     metrics_path=args.metrics)
@@ -0,0 +1,50 @@
+""" Renders scenes of a scene spec file sampled with shapes3d.specs
+
+Sample the specs without blender:
+    python -c "import shapes3d.specs as s; s.save_scene_specs('specs.npz', s.sample_scenes(1000, num_poses=10))"
+
+Render a range of scenes, e.g. one range per worker:
+    blender --background --python examples/render_scene_specs.py -- -s specs.npz --first 0 --last 100
+"""
+
+import argparse
+import os
+import sys
+
+import shapes3d as shps
+from shapes3d.worlds import SimpleWorld
+
+
+def render_specs(specs_path, destination_folder, first, last):
+    specs = shps.specs.load_scene_specs(specs_path)
+    dims = [float(v) for v in specs["scenes"][0]["world_dims"]]
+    last = min(last, len(specs["scenes"]))
+
+    # Deferred, shapes shared by consecutive scenes are not created again
+    env = SimpleWorld(dims=dims, use_walls=True, use_gpu=True, deferred=True)
+    for index in range(first, last):
+        poses = env.load_scene_spec(specs, index)
+        folder = os.path.join(destination_folder, str(index))
+        os.makedirs(folder, exist_ok=True)
+        for img_num, (location, rotation) in enumerate(poses, 1):
+            env.render(folder, img_num,
+                       camera_location=location,
+                       camera_rotation=rotation)
+    env.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Renders scenes of a scene spec file")
+    parser.add_argument('-s', '--specs', type=str, required=True,
+                        help="Scene spec .npz file")
+    parser.add_argument('-f', '--destination', type=str, default="dataset_specs",
+                        help="Folder destination for the dataset files")
+    parser.add_argument('--first', type=int, default=0, help="First scene to render")
+    parser.add_argument('--last', type=int, default=sys.maxsize,
+                        help="Last scene to render (exclusive)")
+
+    argv = sys.argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv)
+
+    render_specs(args.specs, args.destination, args.first, args.last)
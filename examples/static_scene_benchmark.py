@@ -0,0 +1,89 @@
+""" Compares the per frame time of an orbit around a static scene with and
+without the static scene mode of SimpleWorld.
+
+    blender --background --python examples/static_scene_benchmark.py -- --poses 360 --gpu
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from shapes3d.worlds import SimpleWorld
+
+
+def get_orbit(num_poses, distance=6, height=2):
+    poses = []
+    for i in range(num_poses):
+        angle = 2*math.pi*i/num_poses
+        poses.append(((math.cos(angle)*distance, math.sin(angle)*distance, height),
+                      (math.pi/2 - math.pi/8, 0, math.pi/2 + angle)))
+    return poses
+
+
+def render_orbit(env, folder, poses):
+    times = []
+    for file_id, (location, rotation) in enumerate(poses, 1):
+        start = time.perf_counter()
+        env.render(folder, file_id, camera_location=location, camera_rotation=rotation)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times):
+    times = np.array(times)
+    return {"frames": len(times),
+            "first": float(times[0]),
+            "mean": float(times.mean()),
+            "median": float(np.median(times)),
+            # Without the first frame, which syncs the scene in both modes
+            "mean_warm": float(times[1:].mean()) if len(times) > 1 else float(times[0])}
+
+
+def benchmark(destination_folder, num_poses, gpu, samples, width, height):
+    env = SimpleWorld(use_gpu=gpu)
+    env.set_renderer(gpu=gpu, samples=samples, image_resolution=(width, height))
+    # Same scene in every run
+    random.seed(0)
+    np.random.seed(0)
+    for _ in range(3):
+        env.add_sphere()
+        env.add_cuboid()
+        env.add_cylinder()
+
+    poses = get_orbit(num_poses)
+    results = {}
+    results["default"] = summarize(render_orbit(env, os.path.join(destination_folder, "default"), poses))
+
+    env.set_static_scene()
+    results["static"] = summarize(render_orbit(env, os.path.join(destination_folder, "static"), poses))
+    env.unset_static_scene()
+
+    results["speedup"] = results["default"]["mean_warm"] / results["static"]["mean_warm"]
+    with open(os.path.join(destination_folder, "benchmark.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    env.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the static scene mode on a camera orbit")
+    parser.add_argument('-f', '--destination', type=str, default="static_benchmark",
+                        help="Folder destination for the images and benchmark.json")
+    parser.add_argument('--poses', type=int, default=360, help="Poses of the orbit")
+    parser.add_argument('--gpu', action="store_true", help="Render with the gpu")
+    parser.add_argument('--samples', type=int, default=64, help="Samples per pixel")
+    parser.add_argument('--width', type=int, default=300, help="Width of the images in px")
+    parser.add_argument('--height', type=int, default=300, help="Height of the images in px")
+
+    argv = sys.argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.destination, exist_ok=True)
+    benchmark(args.destination, args.poses, args.gpu, args.samples, args.width, args.height)
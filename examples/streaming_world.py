@@ -0,0 +1,76 @@
+""" Renders a flight over a large world keeping only the shapes near the
+camera in blender.
+
+    blender --background --python examples/streaming_world.py -- --size 1000 --shapes 100000
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from shapes3d.worlds import SimpleWorld
+
+
+def build_world(size, num_shapes, tile_size, max_tiles, max_distance, gpu):
+    env = SimpleWorld(dims=(size, size, 4), use_gpu=gpu, deferred=True)
+    env.set_renderer(gpu=gpu, samples=32, image_resolution=(400, 400))
+    env.set_far(max_distance)
+    # Before adding shapes, so the collision checks only visit nearby tiles
+    env.set_streaming(tile_size=tile_size, max_tiles=max_tiles,
+                      margin=tile_size/4, max_distance=max_distance)
+    random.seed(0)
+    add = [env.add_sphere, env.add_cuboid, env.add_cylinder, env.add_cone]
+    for i in range(num_shapes):
+        add[i % len(add)]()
+    return env
+
+
+def fly(env, folder, size, num_frames):
+    stats = []
+    for file_id in range(1, num_frames + 1):
+        # Straight line across the world, looking forward and down
+        x = -size/2 + size * file_id / (num_frames + 1)
+        location = (x, 0, 6)
+        rotation = (math.pi/2 - math.pi/10, 0, -math.pi/2)
+
+        start = time.perf_counter()
+        env.render(folder, file_id, camera_location=location, camera_rotation=rotation)
+        frame = dict(env.get_stream_stats())
+        frame["seconds"] = time.perf_counter() - start
+        frame["file_id"] = file_id
+        stats.append(frame)
+        print(json.dumps(frame), flush=True)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Renders a flight over a large streamed world")
+    parser.add_argument('-f', '--destination', type=str, default="streaming_world",
+                        help="Folder destination for the images and stats.json")
+    parser.add_argument('--size', type=float, default=1000, help="Side of the world in meters")
+    parser.add_argument('--shapes', type=int, default=100000, help="Number of shapes")
+    parser.add_argument('--frames', type=int, default=50, help="Frames of the flight")
+    parser.add_argument('--tile_size', type=float, default=50, help="Side of the tiles in meters")
+    parser.add_argument('--max_tiles', type=int, default=64, help="Tiles kept in blender")
+    parser.add_argument('--max_distance', type=float, default=150,
+                        help="Farthest distance seen by the camera in meters")
+    parser.add_argument('--gpu', action="store_true", help="Render with the gpu")
+
+    argv = sys.argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.destination, exist_ok=True)
+    env = build_world(args.size, args.shapes, args.tile_size, args.max_tiles,
+                      args.max_distance, args.gpu)
+    stats = fly(env, args.destination, args.size, args.frames)
+    with open(os.path.join(args.destination, "stats.json"), "w") as f:
+        json.dump(stats, f, indent=2)
+    print("Mean seconds per frame %.3f" % np.mean([frame["seconds"] for frame in stats]))
+    env.close()
@@ -1,5 +1,23 @@
-import shapes3d.scene
-import shapes3d.camera
-import shapes3d.render
-import shapes3d.worlds
-import shapes3d.shapes
+import importlib.util
+
+import shapes3d.annotations
+import shapes3d.cache
+import shapes3d.client
+import shapes3d.dataset
+import shapes3d.geometry
+import shapes3d.metadata
+import shapes3d.specs
+import shapes3d.streaming
+
+# Modules using bpy are only available inside blender
+if importlib.util.find_spec("bpy") is not None:
+    import shapes3d.scene
+    import shapes3d.camera
+    import shapes3d.render
+    import shapes3d.metrics
+    import shapes3d.visibility
+    import shapes3d.worlds
+    import shapes3d.shapes
+    import shapes3d.tuning
+    import shapes3d.scheduler
+    import shapes3d.server
@@ -0,0 +1,291 @@
+"""Implements readers and writers of annotations that do not depend on blender."""
+
+import json
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+BACKGROUND_ID = 0
+MAX_INSTANCE_ID = 2**16 - 1
+
+INST_ID_FILE_NAME = "Image_inst_id_"
+INST_ID_TABLE_FILE_NAME = "Inst_id_"
+
+# Shape types of shapes3d.shapes, used as classes
+CLASS_NAMES = ("SPHERE", "CYLINDER", "CONE", "PLANE", "CUBOID", "MESH")
+
+
+def read_instance_ids(path: Union[str, Path], file_id: int) -> Tuple[np.ndarray, dict]:
+    """Reads the instance id map and its table saved by render.set_instance_ids.
+
+    Args:
+        path (str): folder of the frame
+        file_id (int): id of the frame
+
+    Returns:
+        np.ndarray: (H, W) uint16 id map
+        dict: id (int) -> {"name": object name, "type": shape type}
+    """
+    path = Path(path)
+    id_map = np.array(Image.open(path / "{}{:04d}.png".format(INST_ID_FILE_NAME, file_id)))
+    with open(path / "{}{:04d}.json".format(INST_ID_TABLE_FILE_NAME, file_id)) as f:
+        table = {int(k): v for k, v in json.load(f).items()}
+    return id_map.astype(np.uint16), table
+
+
+def get_visible_fractions(id_map: np.ndarray, table: dict) -> Dict[str, float]:
+    """Returns object name -> fraction of the image covered by its visible
+    pixels, for every object of the table of read_instance_ids."""
+    counts = np.bincount(id_map.ravel(), minlength=MAX_INSTANCE_ID + 1)
+    return {entry["name"]: float(counts[i]) / id_map.size for i, entry in table.items()}
+
+
+def decode_instance_map(id_map: np.ndarray,
+                        ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns a boolean mask per instance.
+
+    Args:
+        id_map (np.ndarray): (..., H, W) id map, e.g. a batch of frames
+        ids (np.ndarray): ids to decode. Default: ids present in id_map
+
+    Returns:
+        np.ndarray: (K,) ids
+        np.ndarray: (K, ..., H, W) masks, masks[k] is id_map == ids[k]
+    """
+    if ids is None:
+        ids = np.unique(id_map)
+        ids = ids[ids != BACKGROUND_ID]
+    ids = np.asarray(ids, dtype=id_map.dtype)
+    masks = id_map[None] == ids.reshape((-1,) + (1,)*id_map.ndim)
+    return ids, masks
+
+
+def instance_map_to_labels(id_map: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Returns a label tensor where pixels of ids[k] are k+1 and the rest 0.
+
+    Args:
+        id_map (np.ndarray): (..., H, W) id map
+        ids (np.ndarray): (K,) ids to label
+
+    Returns:
+        np.ndarray: (..., H, W) int32 labels
+    """
+    lut = np.zeros(MAX_INSTANCE_ID + 1, dtype=np.int32)
+    lut[np.asarray(ids)] = np.arange(1, len(ids) + 1, dtype=np.int32)
+    return lut[id_map]
+
+
+class AnnotationSink:
+    """Buffers 2d bounding boxes of many frames and writes them in shards.
+
+    Boxes are kept in columnar arrays and appended to the current shard
+    every flush_every frames, so a dataset produces a handful of files
+    instead of one per frame. A new shard is started every shard_size frames.
+    Image ids restart at 0 in each sink, so existing shards in folder are
+    overwritten.
+
+    Formats:
+        'jsonl': one json line per frame with its boxes.
+        'yolo': one txt per shard with lines
+            'image_id class_id instance_id centre_x centre_y width height',
+            coordinates relative to the image size, and an images index per
+            shard with lines 'image_id width height file_name', so frames
+            without boxes are listed too.
+        'coco': one COCO json per shard, written when the shard is complete.
+
+    Args:
+        folder (str): folder of the shards
+        fmt (str): 'coco', 'yolo' or 'jsonl'
+        class_names (tuple): names of the classes, the class id is the index
+        flush_every (int): frames buffered between writes
+        shard_size (int): frames per shard
+    """
+    FORMATS = {'coco': 'json', 'yolo': 'txt', 'jsonl': 'jsonl'}
+
+    def __init__(self,
+                 folder: Union[str, Path],
+                 fmt: str = 'coco',
+                 class_names: Tuple[str, ...] = CLASS_NAMES,
+                 flush_every: int = 1000,
+                 shard_size: int = 100000):
+        if fmt not in self.FORMATS:
+            raise AttributeError("fmt can only be one of %s" % list(self.FORMATS))
+
+        self._folder = Path(folder)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._fmt = fmt
+        self._class_names = tuple(class_names)
+        self._flush_every = flush_every
+        self._shard_size = shard_size
+
+        self._num_images = 0
+        self._shard = 0
+        self._shard_images = 0
+        # Shards are truncated on their first write, then appended to
+        self._shard_written = False
+        self._num_boxes = 0
+        self._reset_buffers()
+        # COCO shards can only be written once complete, their boxes are
+        # kept in columns until then
+        self._coco_images = []
+        self._coco_columns = []
+
+    @property
+    def class_names(self) -> Tuple[str, ...]:
+        """Names of the classes, the class id is the index."""
+        return self._class_names
+
+    def _reset_buffers(self):
+        self._images = []  # (image_id, file_name, width, height)
+        self._image_ids = []
+        self._instance_ids = []
+        self._class_ids = []
+        self._boxes = []
+
+    def add(self,
+            file_name: str,
+            image_size: Tuple[int, int],
+            instance_ids: np.ndarray,
+            class_ids: np.ndarray,
+            boxes: np.ndarray) -> int:
+        """Adds the boxes of a frame.
+
+        Args:
+            file_name (str): image the boxes belong to
+            image_size (tuple): (width, height) in px
+            instance_ids (np.ndarray): (N,) ids of the instances
+            class_ids (np.ndarray): (N,) index of the class in class_names
+            boxes (np.ndarray): (N, 4) [min_x, min_y, max_x, max_y] in px
+
+        Returns:
+            int: id of the image
+        """
+        image_id = self._num_images
+        self._num_images += 1
+
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self._images.append((image_id, str(file_name), int(image_size[0]), int(image_size[1])))
+        self._image_ids.append(np.full(len(boxes), image_id, dtype=np.int64))
+        self._instance_ids.append(np.asarray(instance_ids, dtype=np.int32).reshape(-1))
+        self._class_ids.append(np.asarray(class_ids, dtype=np.int32).reshape(-1))
+        self._boxes.append(boxes)
+
+        self._shard_images += 1
+        if self._shard_images >= self._shard_size:
+            self.flush()
+            self._close_shard()
+        elif len(self._images) >= self._flush_every:
+            self.flush()
+        return image_id
+
+    def flush(self):
+        """Writes the buffered frames into the current shard."""
+        if not self._images:
+            return
+
+        image_ids = np.concatenate(self._image_ids)
+        instance_ids = np.concatenate(self._instance_ids)
+        class_ids = np.concatenate(self._class_ids)
+        boxes = np.concatenate(self._boxes)
+
+        if self._fmt == 'jsonl':
+            self._write_jsonl(image_ids, instance_ids, class_ids, boxes)
+        elif self._fmt == 'yolo':
+            self._write_yolo(image_ids, instance_ids, class_ids, boxes)
+        else:
+            self._append_coco(image_ids, instance_ids, class_ids, boxes)
+
+        self._shard_written = True
+        self._reset_buffers()
+
+    def close(self):
+        self.flush()
+        self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _shard_path(self, prefix: str = "annotations", ext: str = None) -> Path:
+        ext = self.FORMATS[self._fmt] if ext is None else ext
+        return self._folder / "{}_{:05d}.{}".format(prefix, self._shard, ext)
+
+    def _shard_mode(self) -> str:
+        return "a" if self._shard_written else "w"
+
+    def _close_shard(self):
+        if self._fmt == 'coco' and self._coco_images:
+            categories = [{"id": i, "name": n} for i, n in enumerate(self._class_names)]
+            with open(self._shard_path(), "w") as f:
+                json.dump({"images": [{"id": image_id, "file_name": file_name,
+                                       "width": width, "height": height}
+                                      for image_id, file_name, width, height in self._coco_images],
+                           "annotations": self._coco_annotations(),
+                           "categories": categories}, f)
+            self._coco_images = []
+            self._coco_columns = []
+
+        if self._shard_images:
+            self._shard += 1
+            self._shard_images = 0
+            self._shard_written = False
+
+    def _frame_slices(self, image_ids: np.ndarray):
+        """Yields image tuple and slice of its boxes, image_ids are sorted."""
+        starts = np.searchsorted(image_ids, [image[0] for image in self._images], 'left')
+        ends = np.searchsorted(image_ids, [image[0] for image in self._images], 'right')
+        for image, start, end in zip(self._images, starts, ends):
+            yield image, slice(start, end)
+
+    def _write_jsonl(self, image_ids, instance_ids, class_ids, boxes):
+        lines = []
+        for (image_id, file_name, width, height), s in self._frame_slices(image_ids):
+            lines.append(json.dumps({"image_id": image_id,
+                                     "file_name": file_name,
+                                     "width": width,
+                                     "height": height,
+                                     "instance_ids": instance_ids[s].tolist(),
+                                     "class_ids": class_ids[s].tolist(),
+                                     "boxes": boxes[s].tolist()}))
+        with open(self._shard_path(), self._shard_mode()) as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _write_yolo(self, image_ids, instance_ids, class_ids, boxes):
+        sizes = {image[0]: image[2:] for image in self._images}
+        size = np.array([sizes[i] for i in image_ids], dtype=np.float32).reshape(-1, 2)
+        centre = (boxes[:, :2] + boxes[:, 2:]) / 2 / size
+        extent = (boxes[:, 2:] - boxes[:, :2]) / size
+        table = np.column_stack([image_ids, class_ids, instance_ids, centre, extent])
+        mode = self._shard_mode()
+        with open(self._shard_path(), mode) as f:
+            np.savetxt(f, table, fmt=["%d", "%d", "%d", "%.6f", "%.6f", "%.6f", "%.6f"])
+        with open(self._shard_path("images", "txt"), mode) as f:
+            f.writelines("%d %d %d %s\n" % (image_id, width, height, file_name)
+                         for image_id, file_name, width, height in self._images)
+
+    def _append_coco(self, image_ids, instance_ids, class_ids, boxes):
+        self._coco_images.extend(self._images)
+        self._coco_columns.append((image_ids, instance_ids, class_ids, boxes))
+
+    def _coco_annotations(self) -> list:
+        """Returns the COCO annotations of the columns of the shard."""
+        image_ids, instance_ids, class_ids, boxes = [
+            np.concatenate(column) for column in zip(*self._coco_columns)]
+        extent = boxes[:, 2:] - boxes[:, :2]
+        xywh = np.column_stack([boxes[:, :2], extent]).tolist()
+        areas = (extent[:, 0] * extent[:, 1]).tolist()
+        annotations = [{"id": self._num_boxes + i,
+                        "image_id": image_id,
+                        "category_id": class_id,
+                        "instance_id": instance_id,
+                        "bbox": xywh[i],
+                        "area": areas[i],
+                        "iscrowd": 0}
+                       for i, (image_id, instance_id, class_id) in enumerate(
+                           zip(image_ids.tolist(), instance_ids.tolist(), class_ids.tolist()))]
+        self._num_boxes += len(image_ids)
+        return annotations
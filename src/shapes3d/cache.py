@@ -0,0 +1,107 @@
+"""Implements a content addressed cache of rendered frames.
+
+Frames are stored in a local folder keyed by a hash of everything that
+changes the output: scene, camera, render and output configuration.
+Entries are evicted least recently used first when the cache exceeds its
+size budget.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import List
+
+FRAME_PLACEHOLDER = "####"
+
+
+class RenderCache:
+    """Local cache of rendered files.
+
+    Args:
+        folder (str): folder where the cache is stored
+        max_bytes (int): size budget of the cache in bytes
+    """
+    def __init__(self, folder: str, max_bytes: int = 10 * 2**30):
+        self._folder = Path(folder)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+
+    @staticmethod
+    def key(*states) -> str:
+        """Returns the hash of states. States have to be json serializable
+        or have a deterministic repr."""
+        data = json.dumps(states, sort_keys=True, default=repr)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def has(self, key: str) -> bool:
+        return (self._folder / key).is_dir()
+
+    def restore(self, key: str, path: str, file_id: int) -> bool:
+        """Copies the files of key into path with file_id as frame number.
+
+        Returns:
+            bool: False if key is not in the cache
+        """
+        entry = self._folder / key
+        if not entry.is_dir():
+            return False
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        frame = "{:04d}".format(file_id)
+        for f in entry.iterdir():
+            shutil.copyfile(f, path / f.name.replace(FRAME_PLACEHOLDER, frame))
+
+        # Mark as recently used
+        os.utime(entry)
+        return True
+
+    def store(self, key: str, files: List[str], file_id: int):
+        """Stores rendered files under key and evicts old entries if needed.
+
+        Args:
+            key (str): key of the state the files were rendered with
+            files (list): paths of the files, their names contain file_id
+            file_id (int): frame number of the files
+        """
+        entry = self._folder / key
+        tmp_entry = self._folder / (key + ".tmp")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        tmp_entry.mkdir()
+
+        frame = "{:04d}".format(file_id)
+        for f in files:
+            f = Path(f)
+            shutil.copyfile(f, tmp_entry / f.name.replace(frame, FRAME_PLACEHOLDER))
+
+        shutil.rmtree(entry, ignore_errors=True)
+        tmp_entry.rename(entry)
+        self._evict()
+
+    def size(self) -> int:
+        """Returns the size of the cache in bytes."""
+        return sum(size for _, _, size in self._entries())
+
+    def clear(self):
+        for entry, _, _ in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def _entries(self) -> list:
+        entries = []
+        for entry in self._folder.iterdir():
+            if not entry.is_dir() or entry.suffix == ".tmp":
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((entry, entry.stat().st_mtime, size))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for entry, _, size in entries:
+            if total <= self._max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -2,9 +2,11 @@
 
 import bpy
 import numpy as np
+from typing import Dict, Tuple
 
 CAMERA = 'Camera'
 SCENE = 'Scene'
+RIG_CAMERA = 'Shapes3d_Rig'
 
 def set_focal_length(mm: float):
     """ In milimeters. This overwrites fov """
@@ -21,22 +23,22 @@ def set_far(meters: float):
     bpy.data.objects[CAMERA].data.clip_end = meters
 
 def set_location(tx: float, ty: float, tz: float):
-    """ Location in meters """
-    scene = bpy.data.scenes[SCENE]
-    scene.camera.rotation_mode = 'XYZ'
-    scene.camera.location.x = tx
-    scene.camera.location.y = ty
-    scene.camera.location.z = tz
+    """ Location in meters. With a rig, it moves all the cameras """
+    cam = bpy.data.objects[CAMERA]
+    cam.rotation_mode = 'XYZ'
+    cam.location.x = tx
+    cam.location.y = ty
+    cam.location.z = tz
 
 def set_rotation(rx: float, ry: float, rz: float):
     """
-    Rotation is in Euler angles XYZ in radians
+    Rotation is in Euler angles XYZ in radians. With a rig, it rotates all the cameras
     """
-    scene = bpy.data.scenes[SCENE]
-    scene.camera.rotation_mode = 'XYZ'
-    scene.camera.rotation_euler[0] = rx
-    scene.camera.rotation_euler[1] = ry
-    scene.camera.rotation_euler[2] = rz
+    cam = bpy.data.objects[CAMERA]
+    cam.rotation_mode = 'XYZ'
+    cam.rotation_euler[0] = rx
+    cam.rotation_euler[1] = ry
+    cam.rotation_euler[2] = rz
 
 def get_intrinsic_parameters():
     """Returns intrinsic parameters.
@@ -70,7 +72,7 @@ def get_extrinsic_parameters():
 
     rx = scene.camera.rotation_euler[0]
     ry = scene.camera.rotation_euler[1]
-    rz = scene.camera.rotation_euler[3]
+    rz = scene.camera.rotation_euler[2]
 
     extrinsic = [rx, ry, rz, tx, ty, tz]
     return extrinsic
@@ -104,5 +106,75 @@ def get_intrinsic_matrix():
 
     return K
 
+def set_rig(views: Dict[str, Tuple[Tuple[float, float, float], Tuple[float, float, float]]]):
+    """Renders several views per render call with blender's multi-view.
+
+    A camera per view is parented to the main camera with the given
+    offset, so set_location and set_rotation move the whole rig. The cameras
+    share the intrinsic parameters of the main camera. Output files get
+    the name of the view as suffix, e.g. Image_color_0001_left.png.
+
+    Args:
+        views (dict): name -> (location, rotation) of the view relative to the
+            main camera. Location in meters and rotation in XYZ euler angles in radians.
+            Names 'left' and 'right' reuse blender's default views.
+    """
+    scene = bpy.data.scenes[SCENE]
+    main = bpy.data.objects[CAMERA]
+
+    # Cameras of views with the same name are reused
+    cameras = get_rig_cameras()
+    for name, cam in cameras.items():
+        if name not in views:
+            bpy.data.objects.remove(cam)
+
+    scene.render.use_multiview = True
+    scene.render.views_format = 'MULTIVIEW'
+    for view in scene.render.views:
+        view.use = False
+
+    for name, (location, rotation) in views.items():
+        view = scene.render.views.get(name, None) or scene.render.views.new(name)
+        view.camera_suffix = "_" + name
+        view.file_suffix = "_" + name
+        view.use = True
+
+        cam = cameras.get(name, None)
+        if cam is None:
+            cam = bpy.data.objects.new(RIG_CAMERA + "_" + name, main.data)
+            scene.collection.objects.link(cam)
+            cam.parent = main
+            cam.rotation_mode = 'XYZ'
+        cam.location = location
+        cam.rotation_euler = rotation
+
+    # Blender finds the camera of each view replacing the suffix of the scene camera
+    scene.camera = bpy.data.objects[RIG_CAMERA + "_" + next(iter(views))]
+
+def unset_rig():
+    scene = bpy.data.scenes[SCENE]
+    for cam in get_rig_cameras().values():
+        bpy.data.objects.remove(cam)
+    scene.render.use_multiview = False
+    scene.camera = bpy.data.objects[CAMERA]
+
+def get_rig_cameras() -> dict:
+    """Returns view name -> camera object of the rig."""
+    prefix = RIG_CAMERA + "_"
+    return {ob.name[len(prefix):]: ob for ob in bpy.data.objects
+            if ob.type == 'CAMERA' and ob.name.startswith(prefix)}
+
+def get_rig_extrinsic_parameters() -> dict:
+    """Returns view name -> [tx, ty, tz, rx, ry, rz] world pose of each view.
+
+    t in meters and r in XYZ euler angles in radians.
+    """
+    bpy.context.view_layer.update()
+    extrinsics = {}
+    for name, cam in get_rig_cameras().items():
+        location, rotation, _ = cam.matrix_world.decompose()
+        extrinsics[name] = list(location) + list(rotation.to_euler('XYZ'))
+    return extrinsics
+
 def close():
     bpy.ops.wm.quit_blender()
@@ -0,0 +1,263 @@
+"""Asyncio client of shapes3d render servers, it does not depend on blender.
+
+A RenderPool starts or connects to several servers and sends every job to
+the first idle one. Frames are streamed back as soon as they are written.
+
+Example:
+    async def main():
+        async with await RenderPool.start(4, server_args=["--gpu"]) as pool:
+            jobs = [{"specs": "specs.npz", "index": i, "folder": "out/%d" % i}
+                    for i in range(100)]
+            async for frame in pool.map(jobs):
+                print(frame["files"])
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import itertools
+import json
+import sys
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from shapes3d import dataset
+
+HOST = "127.0.0.1"
+PORT = 5555
+BLENDER = "blender"
+SERVER_EXPR = "import shapes3d.server as s; s.main()"
+# Seconds to wait for a server to start listening
+START_TIMEOUT = 120
+# Max size of a reply line
+LINE_LIMIT = 2**24
+
+
+class RenderServerError(RuntimeError):
+    pass
+
+
+class RenderClient:
+    """Connection to a single render server.
+
+    Jobs of a client are sent one after the other.
+    """
+    def __init__(self, host: str = HOST, port: int = PORT):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._ids = itertools.count()
+        self._lock = asyncio.Lock()
+
+    async def connect(self, timeout: float = START_TIMEOUT):
+        """Connects to the server, retrying until timeout while it starts."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_connection(
+                    self.host, self.port, limit=LINE_LIMIT)
+                return
+            except OSError:
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    async def request(self, job: dict) -> AsyncIterator[dict]:
+        """Sends a job and yields its replies until it is done.
+
+        Raises:
+            RenderServerError: if the server replies with an error
+        """
+        async with self._lock:
+            job = dict(job, id=next(self._ids))
+            self._writer.write((json.dumps(job) + "\n").encode())
+            await self._writer.drain()
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise RenderServerError("Server %s:%d closed the connection" %
+                                            (self.host, self.port))
+                reply = json.loads(line)
+                # Replies left unread by a previous request stopped early
+                if reply.get("id") != job["id"]:
+                    continue
+                if "error" in reply:
+                    raise RenderServerError(reply["error"])
+                if reply.get("done") or reply.get("ok"):
+                    return
+                yield reply
+
+    async def ping(self):
+        async for _ in self.request({"op": "ping"}):
+            pass
+
+    async def shutdown(self):
+        """Closes the server process."""
+        async for _ in self.request({"op": "close"}):
+            pass
+        await self.close()
+
+    async def render(self,
+                     specs: str,
+                     index: int,
+                     folder: str,
+                     poses: Optional[Sequence[Tuple[Sequence[float], Sequence[float]]]] = None,
+                     first_file_id: int = 1) -> AsyncIterator[dict]:
+        """Renders a scene spec and yields {"file_id", "files"} of each frame.
+
+        Args:
+            specs (str): scene spec .npz file, as seen by the server
+            index (int): index of the scene
+            folder (str): folder of the outputs
+            poses (list): (location, rotation) of the frames. Default poses of the spec
+            first_file_id (int): file id of the first frame
+        """
+        job = {"op": "render", "specs": str(specs), "index": int(index),
+               "folder": str(folder), "first_file_id": first_file_id}
+        if poses is not None:
+            job["poses"] = [[[float(v) for v in loc], [float(v) for v in rot]]
+                            for loc, rot in poses]
+        async for reply in self.request(job):
+            yield reply
+
+
+class RenderPool:
+    """Queues jobs to a pool of render servers.
+
+    Args:
+        clients (list): connected clients
+        processes (list): server processes started by the pool, closed with it
+    """
+    def __init__(self, clients: List[RenderClient], processes: Optional[list] = None):
+        self._clients = clients
+        self._processes = processes or []
+        self._idle = asyncio.Queue()
+        for client in clients:
+            self._idle.put_nowait(client)
+
+    @classmethod
+    async def connect(cls, addresses: Sequence[Tuple[str, int]]) -> "RenderPool":
+        """Connects to servers already running."""
+        clients = [RenderClient(host, port) for host, port in addresses]
+        await asyncio.gather(*(client.connect() for client in clients))
+        return cls(clients)
+
+    @classmethod
+    async def start(cls,
+                    num_servers: int,
+                    base_port: int = PORT,
+                    blender: str = BLENDER,
+                    server_args: Sequence[str] = ()) -> "RenderPool":
+        """Starts num_servers blender processes and connects to them.
+
+        Args:
+            num_servers (int): number of servers
+            base_port (int): port of the first server, the next ones follow
+            blender (str): blender executable
+            server_args (list): extra arguments of shapes3d.server.main
+        """
+        processes, addresses = [], []
+        for port in range(base_port, base_port + num_servers):
+            processes.append(await asyncio.create_subprocess_exec(
+                blender, "--background", "--python-expr", SERVER_EXPR,
+                "--", "--port", str(port), *server_args,
+                stdout=sys.stderr))
+            addresses.append((HOST, port))
+        pool = await cls.connect(addresses)
+        pool._processes = processes
+        return pool
+
+    async def render(self, job: dict) -> List[dict]:
+        """Renders a job in the first idle server and returns its frames.
+
+        For the keys of the job see RenderClient.render
+        """
+        client = await self._idle.get()
+        try:
+            return [frame async for frame in client.render(**job)]
+        finally:
+            self._idle.put_nowait(client)
+
+    async def map(self, jobs: Sequence[dict]) -> AsyncIterator[dict]:
+        """Renders all jobs in parallel and yields frames as they finish.
+
+        Each frame gets the index of its job in "job".
+        """
+        frames = asyncio.Queue()
+        done = object()
+
+        async def run(index, job):
+            client = await self._idle.get()
+            try:
+                async for frame in client.render(**job):
+                    await frames.put(dict(frame, job=index))
+            finally:
+                self._idle.put_nowait(client)
+
+        tasks = [asyncio.ensure_future(run(i, job)) for i, job in enumerate(jobs)]
+
+        async def run_all():
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # The other jobs are not needed once one fails
+                for task in tasks:
+                    task.cancel()
+                raise
+            finally:
+                await frames.put(done)
+
+        task = asyncio.ensure_future(run_all())
+        try:
+            while True:
+                frame = await frames.get()
+                if frame is done:
+                    break
+                yield frame
+        finally:
+            if not task.done():
+                task.cancel()
+                for run_task in tasks:
+                    run_task.cancel()
+                await asyncio.gather(task, *tasks, return_exceptions=True)
+        # Raises the errors of the jobs
+        await task
+
+    async def close(self):
+        """Closes the connections and the servers started by the pool."""
+        if self._processes:
+            await asyncio.gather(*(client.shutdown() for client in self._clients))
+            await asyncio.gather(*(process.wait() for process in self._processes))
+        else:
+            await asyncio.gather(*(client.close() for client in self._clients))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def load_frame(files: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Reads the files of a frame reply into arrays keyed by file name.
+
+    Depth EXRs need the OpenEXR package.
+    """
+    arrays = {}
+    for f in files:
+        if dataset.is_exr(f):
+            arrays[f] = dataset.read_depth(f)
+        elif f.endswith(".json"):
+            continue
+        else:
+            arrays[f] = dataset.read_image(f)
+    return arrays
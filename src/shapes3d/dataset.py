@@ -0,0 +1,173 @@
+"""Implements readers of generated datasets that do not depend on blender.
+
+A dataset is a folder with intrinsic_matrix.txt and one sub folder per
+environment with the files of each frame, as written by
+examples/dataset_generator.py.
+"""
+
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from shapes3d.annotations import INST_ID_FILE_NAME
+from shapes3d.annotations import INST_ID_TABLE_FILE_NAME
+
+try:
+    import OpenEXR
+    import Imath
+except ImportError:
+    OpenEXR = None
+
+COLOR_FILE_NAME = "Image_color_"
+DEPTH_FILE_NAME = "Image_depth_"
+INST_SEG_FILE_NAME = "Image_inst_seg_"
+BBOX_FILE_NAME = "Bbox_"
+EXTRINSIC_FILE_NAME = "Extrinsic_"
+INTRINSIC_FILE_NAME = "intrinsic_matrix.txt"
+
+# Blender writes the background at this depth
+MAX_DEPTH = 1e9
+EXR_MAGIC = b"\x76\x2f\x31\x01"
+# Extensions of the color and instance segmentation images, see render.set_image_format
+IMAGE_EXTENSIONS = (".png", ".jpeg", ".jpg", ".webp")
+
+_COLOR_RE = re.compile(r"^%s(\d+)\.(png|jpeg|jpg|webp)$" % COLOR_FILE_NAME)
+
+
+def find_frames(root: Union[str, Path]) -> List[Tuple[Path, int]]:
+    """Returns (folder, file_id) of every color image under root, sorted."""
+    frames = []
+    for f in Path(root).rglob(COLOR_FILE_NAME + "*"):
+        match = _COLOR_RE.match(f.name)
+        if match:
+            frames.append((f.parent, int(match.group(1))))
+    return sorted(frames)
+
+
+def get_frame_files(folder: Union[str, Path], file_id: int) -> Dict[str, Optional[Path]]:
+    """Returns the path of each file of a frame or None if it does not exist.
+
+    Keys: color, depth (exr), depth_png, inst_seg, inst_id, inst_id_table,
+    bbox and extrinsic.
+    """
+    folder = Path(folder)
+    frame = "{:04d}".format(file_id)
+    candidates = {
+        "color": [folder / (COLOR_FILE_NAME + frame + ext) for ext in IMAGE_EXTENSIONS],
+        "depth": [folder / (DEPTH_FILE_NAME + frame + ".exr")],
+        "depth_png": [folder / (DEPTH_FILE_NAME + frame + ".png")],
+        "inst_seg": [folder / (INST_SEG_FILE_NAME + frame + ext) for ext in IMAGE_EXTENSIONS],
+        "inst_id": [folder / (INST_ID_FILE_NAME + frame + ".png")],
+        "inst_id_table": [folder / (INST_ID_TABLE_FILE_NAME + frame + ".json")],
+        "bbox": [folder / (BBOX_FILE_NAME + str(file_id) + ".txt")],
+        "extrinsic": [folder / (EXTRINSIC_FILE_NAME + frame + ".txt")],
+    }
+    files = {}
+    for kind, paths in candidates.items():
+        files[kind] = next((p for p in paths if p.exists()), None)
+    return files
+
+
+def read_image(path: Union[str, Path]) -> np.ndarray:
+    with Image.open(path) as im:
+        return np.array(im)
+
+
+def has_exr_support() -> bool:
+    return OpenEXR is not None
+
+
+def is_exr(path: Union[str, Path]) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) == EXR_MAGIC
+
+
+def read_depth(path: Union[str, Path]) -> np.ndarray:
+    """Reads a depth EXR into a (H, W) float32 array.
+
+    Requires the OpenEXR package. Blender writes the depth in every
+    channel, the first of 'R', 'V', 'Z' or 'Y' found is used.
+    """
+    if OpenEXR is None:
+        raise ImportError("Reading depth maps requires the OpenEXR package")
+
+    exr = OpenEXR.InputFile(str(path))
+    try:
+        header = exr.header()
+        window = header["dataWindow"]
+        width = window.max.x - window.min.x + 1
+        height = window.max.y - window.min.y + 1
+        channel = next(c for c in ("R", "V", "Z", "Y") if c in header["channels"])
+        data = exr.channel(channel, Imath.PixelType(Imath.PixelType.FLOAT))
+    finally:
+        exr.close()
+    return np.frombuffer(data, dtype=np.float32).reshape(height, width)
+
+
+def read_extrinsic(path: Union[str, Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the camera pose of a frame.
+
+    The first line holds 'tx ty tz rx ry rz', location in meters and XYZ
+    euler rotation in radians.
+
+    Returns:
+        np.ndarray: (3,) location
+        np.ndarray: (3,) rotation
+    """
+    with open(path) as f:
+        values = np.array(f.readline().split(), dtype=np.float64)
+    return values[:3], values[3:6]
+
+
+def read_intrinsic_matrix(root: Union[str, Path],
+                          width: int,
+                          height: int,
+                          sensor_width: float = 36) -> np.ndarray:
+    """Returns the 3x3 intrinsic matrix of a dataset as in camera.get_intrinsic_matrix.
+
+    intrinsic_matrix.txt holds camera.get_intrinsic_parameters, whose focal
+    length is the lens in mm divided by 1e4.
+
+    Args:
+        root (str): folder of the dataset
+        width (int): width of the images in px
+        height (int): height of the images in px
+        sensor_width (float): sensor width of the camera in mm. Blender's default
+    """
+    with open(Path(root) / INTRINSIC_FILE_NAME) as f:
+        fx, _, cx, cy = [float(v) for v in f.readline().split()]
+    lens = fx * 10 * 1000
+    sensor_height = sensor_width * height / width
+    return np.array([[-lens / sensor_width * width, 0, cx],
+                     [0, lens / sensor_height * height, cy],
+                     [0, 0, 1]])
+
+
+def read_bboxes(path: Union[str, Path]) -> Tuple[List[str], np.ndarray, bool]:
+    """Reads a Bbox_<id>.txt written by render.get_2d_bounding_boxes.
+
+    Returns:
+        list: object names
+        np.ndarray: (N, 4) centre x, centre y, width, height
+        bool: True if values are relative to the image size (YOLO format)
+    """
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    relative = bool(lines) and "px" not in lines[0] and "min_x" not in lines[0]
+    names, values = [], []
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 5:
+            continue
+        try:
+            values.append([float(t) for t in tokens[-4:]])
+        except ValueError:
+            # Header line
+            continue
+        # Old files have the header and first box in the same line
+        names.append(tokens[-5].split("max_y")[-1])
+    return names, np.array(values, dtype=np.float64).reshape(-1, 4), relative
@@ -0,0 +1,214 @@
+"""Computes dense correspondences and optical flow between rendered views
+of static scenes without blender.
+
+Each pixel of the first view is back-projected with its depth, moved to
+the second camera with both poses and projected again. As the scenes are
+static this gives the exact flow without rendering the vector pass.
+Pixels are valid if they land inside the second image and, when its depth
+is passed, are not occluded there.
+
+Usage:
+    python -m shapes3d.flow dataset_generated -o flows
+"""
+
+import argparse
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from shapes3d import dataset
+from shapes3d.geometry import pose_to_matrix
+from shapes3d.pointcloud import get_ray_grid
+
+FLOW_FILE_NAME = "Flow_"
+# Relative depth by which the second view may see a surface in front of the point
+OCCLUSION_TOLERANCE = 0.01
+
+
+def compute_flow(depth1: np.ndarray,
+                 K: np.ndarray,
+                 camera_to_world1: np.ndarray,
+                 camera_to_world2: np.ndarray,
+                 depth2: Optional[np.ndarray] = None,
+                 max_depth: float = dataset.MAX_DEPTH,
+                 tolerance: float = OCCLUSION_TOLERANCE) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the flow from view 1 to view 2 of a batch of pairs.
+
+    Args:
+        depth1 (np.ndarray): (B, H, W) or (H, W) depth of the first views
+        K (np.ndarray): 3x3 intrinsic matrix as in camera.get_intrinsic_matrix
+        camera_to_world1 (np.ndarray): (B, 4, 4) or (4, 4) poses of the first views
+        camera_to_world2 (np.ndarray): (B, 4, 4) or (4, 4) poses of the second views
+        depth2 (np.ndarray): depth of the second views. If passed, pixels
+            occluded in the second view are not valid
+        max_depth (float): pixels at this depth or further are not valid
+        tolerance (float): relative depth margin of the occlusion test
+
+    Returns:
+        np.ndarray: (B, H, W, 2) float32 flow in px, the pixel (u, v) of the
+            first view is at (u, v) + flow in the second view
+        np.ndarray: (B, H, W) bool valid mask
+    """
+    depth1 = np.asarray(depth1, dtype=np.float32)
+    if depth1.ndim == 2:
+        depth1 = depth1[None]
+    batch, height, width = depth1.shape
+    rays = get_ray_grid(K, width, height)
+
+    # Transform from camera 1 to camera 2
+    matrix1 = np.asarray(camera_to_world1, dtype=np.float64).reshape(-1, 4, 4)
+    matrix2 = np.asarray(camera_to_world2, dtype=np.float64).reshape(-1, 4, 4)
+    relative = (np.linalg.inv(matrix2) @ matrix1).astype(np.float32)
+    relative = np.broadcast_to(relative, (batch, 4, 4))
+
+    valid = np.isfinite(depth1) & (depth1 > 0) & (depth1 < max_depth)
+    points = rays[None] * np.where(valid, depth1, 1)[..., None]
+    points = np.einsum("bij,bhwj->bhwi", relative[:, :3, :3], points) \
+        + relative[:, None, None, :3, 3]
+
+    z = points[..., 2]
+    in_front = z < 0
+    z = np.where(in_front, z, -1)
+    u2 = K[0, 0] * points[..., 0] / z + K[0, 2]
+    v2 = K[1, 1] * points[..., 1] / z + K[1, 2]
+
+    u1 = np.arange(width, dtype=np.float32) + 0.5
+    v1 = np.arange(height, dtype=np.float32) + 0.5
+    flow = np.stack([u2 - u1[None, None, :], v2 - v1[None, :, None]], axis=-1)
+
+    valid &= in_front & (u2 >= 0) & (u2 < width) & (v2 >= 0) & (v2 < height)
+
+    if depth2 is not None:
+        depth2 = np.asarray(depth2, dtype=np.float32).reshape(-1, height, width)
+        depth2 = np.broadcast_to(depth2, (batch, height, width))
+        # Occluded if the second view sees something in front of the point
+        # at all the pixel centres around it, tolerant to grazing surfaces
+        seen = np.zeros_like(z)
+        index = np.arange(batch)[:, None, None]
+        for du in (-0.5, 0.5):
+            for dv in (-0.5, 0.5):
+                cols = np.clip(u2 + du, 0, width - 1).astype(np.int64)
+                rows = np.clip(v2 + dv, 0, height - 1).astype(np.int64)
+                seen = np.maximum(seen, depth2[index, rows, cols])
+        valid &= seen >= -z * (1 - tolerance)
+
+    flow[~valid] = 0
+    return flow.astype(np.float32, copy=False), valid
+
+
+def iter_pair_flows(root: Union[str, Path],
+                    folder: Union[str, Path],
+                    pairs: List[Tuple[int, int]],
+                    batch_size: int = 8,
+                    occlusion: bool = True,
+                    sensor_width: float = 36) -> Iterator[Tuple[Tuple[int, int], np.ndarray, np.ndarray]]:
+    """Yields the flow of each pair of file ids of an environment folder.
+
+    Pairs are computed in batches. Pairs without depth EXR or Extrinsic
+    files are skipped.
+
+    Yields:
+        tuple: (file id 1, file id 2)
+        np.ndarray: (H, W, 2) flow
+        np.ndarray: (H, W) valid mask
+    """
+    frames = {}
+
+    def read(file_id):
+        if file_id not in frames:
+            files = dataset.get_frame_files(folder, file_id)
+            if files["depth"] is None or files["extrinsic"] is None:
+                frames[file_id] = None
+            else:
+                location, rotation = dataset.read_extrinsic(files["extrinsic"])
+                frames[file_id] = (dataset.read_depth(files["depth"]),
+                                   pose_to_matrix(location, rotation))
+        return frames[file_id]
+
+    K = None
+    for start in range(0, len(pairs), batch_size):
+        batch = [pair for pair in pairs[start:start + batch_size]
+                 if read(pair[0]) is not None and read(pair[1]) is not None]
+        if batch:
+            depth1 = np.stack([frames[a][0] for a, _ in batch])
+            depth2 = np.stack([frames[b][0] for _, b in batch])
+            if K is None:
+                height, width = depth1.shape[1:]
+                K = dataset.read_intrinsic_matrix(root, width, height, sensor_width)
+            flows, masks = compute_flow(depth1, K,
+                                        np.stack([frames[a][1] for a, _ in batch]),
+                                        np.stack([frames[b][1] for _, b in batch]),
+                                        depth2=depth2 if occlusion else None)
+            yield from zip(batch, flows, masks)
+
+        # Keep only the frames of the pairs to come
+        upcoming = {i for pair in pairs[start + batch_size:] for i in pair}
+        for file_id in list(frames):
+            if file_id not in upcoming:
+                del frames[file_id]
+
+
+def get_generator_pairs(folder: Union[str, Path]) -> List[Tuple[int, int]]:
+    """Returns the pairs (2k+1, 2k+2) of dataset_generator.py in both directions."""
+    ids = {file_id for frame_folder, file_id in dataset.find_frames(folder)
+           if frame_folder == Path(folder)}
+    pairs = []
+    for file_id in sorted(ids):
+        if file_id % 2 == 1 and file_id + 1 in ids:
+            pairs += [(file_id, file_id + 1), (file_id + 1, file_id)]
+    return pairs
+
+
+def save_flow(path: Union[str, Path], flow: np.ndarray, mask: np.ndarray, dtype=np.float16):
+    """Saves flow and mask into a npz file, float16 keeps sub pixel precision
+    for flows up to a few hundred pixels."""
+    np.savez(path, flow=flow.astype(dtype), mask=mask)
+
+
+def convert_dataset(root: Union[str, Path],
+                    output: Union[str, Path],
+                    dtype=np.float16,
+                    **kwargs) -> int:
+    """Saves Flow_<id 1>_<id 2>.npz of the generator pairs of every environment.
+
+    Args:
+        root (str): folder of the dataset
+        output (str): folder where to save a sub folder per environment
+        dtype: dtype of the saved flow
+        kwargs: see iter_pair_flows
+
+    Returns:
+        int: number of saved flows
+    """
+    root, output = Path(root), Path(output)
+    folders = sorted({folder for folder, _ in dataset.find_frames(root)})
+    count = 0
+    for folder in folders:
+        out = output / folder.relative_to(root)
+        out.mkdir(parents=True, exist_ok=True)
+        for (a, b), flow, mask in iter_pair_flows(root, folder, get_generator_pairs(folder), **kwargs):
+            save_flow(out / "{}{:04d}_{:04d}.npz".format(FLOW_FILE_NAME, a, b), flow, mask, dtype)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Computes the flow of the image pairs of a dataset")
+    parser.add_argument("root", type=str, help="Folder of the dataset")
+    parser.add_argument("-o", "--output", type=str, default="flows",
+                        help="Folder where to save the flows")
+    parser.add_argument("-b", "--batch_size", type=int, default=8,
+                        help="Pairs computed at once")
+    parser.add_argument("--no_occlusion", action="store_true",
+                        help="Do not mask pixels occluded in the second view")
+    args = parser.parse_args()
+
+    count = convert_dataset(args.root, args.output,
+                            batch_size=args.batch_size,
+                            occlusion=not args.no_occlusion)
+    print("Saved {} flows".format(count))
+
+
+if __name__ == '__main__':
+    main()
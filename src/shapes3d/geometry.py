@@ -0,0 +1,240 @@
+"""Implements geometric helpers that do not depend on blender.
+
+Camera space follows blender's convention: x to the right, y up and the
+camera looking towards -z. Pixel coordinates follow the intrinsic matrix
+returned by shapes3d.camera.get_intrinsic_matrix.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def circle_ratio_extent(centres: np.ndarray,
+                        radii: np.ndarray,
+                        axes: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the exact extent of x/z and y/z of spheres or circles.
+
+    A plane through the camera centre is tangent to a sphere of radius r
+    when its distance to the centre is r. For a circle with normal a the
+    same holds with r scaled by sin of the angle between the plane normal
+    and a. Both cases reduce to a quadratic in the ratio t = x/z (or y/z).
+
+    Args:
+        centres (np.ndarray): (N, 3) centres in camera coordinates
+        radii (np.ndarray): (N,) radii in meters
+        axes (np.ndarray): (N, 3) unit normals of circles. If None, the
+            inputs are spheres.
+
+    Returns:
+        x_ratios (np.ndarray): (N, 2) min and max of x/z
+        y_ratios (np.ndarray): (N, 2) min and max of y/z
+        Rows of shapes not fully in front of the camera are NaN.
+    """
+    centres = np.atleast_2d(np.asarray(centres, dtype=np.float64))
+    radii = np.atleast_1d(np.asarray(radii, dtype=np.float64))
+    if axes is None:
+        axes = np.zeros_like(centres)
+    else:
+        axes = np.atleast_2d(np.asarray(axes, dtype=np.float64))
+
+    r2 = radii**2
+    cz = centres[:, 2]
+    az = axes[:, 2]
+
+    # The furthest point from the image plane has to be behind the camera
+    z_extent = radii * np.sqrt(np.clip(1 - az**2, 0, 1))
+    in_front = cz + z_extent < 0
+
+    out = []
+    for i in range(2):
+        ci = centres[:, i]
+        ai = axes[:, i]
+        a = cz**2 - r2 * (1 - az**2)
+        b = -2 * (ci * cz + r2 * ai * az)
+        c = ci**2 - r2 * (1 - ai**2)
+        disc = np.sqrt(np.clip(b**2 - 4 * a * c, 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.stack([(-b - disc) / (2 * a), (-b + disc) / (2 * a)], axis=1)
+        ratios.sort(axis=1)
+        ratios[~in_front] = np.nan
+        out.append(ratios)
+
+    return out[0], out[1]
+
+
+def ratio_extent_to_pixels(K: np.ndarray,
+                           x_ratios: np.ndarray,
+                           y_ratios: np.ndarray) -> np.ndarray:
+    """Maps x/z and y/z extents into (N, 4) pixel boxes [min_x, max_x, min_y, max_y]."""
+    u = K[0, 0] * x_ratios + K[0, 2]
+    v = K[1, 1] * y_ratios + K[1, 2]
+    return np.stack([u.min(axis=1), u.max(axis=1),
+                     v.min(axis=1), v.max(axis=1)], axis=1)
+
+
+def project_points(K: np.ndarray, points: np.ndarray) -> Optional[np.ndarray]:
+    """Projects (N, 3) camera coordinates into (N, 2) pixels.
+
+    Returns None if any point is not in front of the camera, as the
+    projection of its convex hull would be unbounded.
+    """
+    points = np.asarray(points)
+    if np.any(points[:, 2] >= 0):
+        return None
+    uvw = points @ K.T
+    return uvw[:, :2] / uvw[:, 2:]
+
+
+def euler_to_matrix(rotation: np.ndarray) -> np.ndarray:
+    """Returns (..., 3, 3) rotation matrices of (..., 3) XYZ euler angles in radians.
+
+    Same convention as blender's rotation_mode 'XYZ': R = Rz @ Ry @ Rx.
+    """
+    rotation = np.asarray(rotation, dtype=np.float64)
+    cx, cy, cz = np.moveaxis(np.cos(rotation), -1, 0)
+    sx, sy, sz = np.moveaxis(np.sin(rotation), -1, 0)
+    R = np.stack([
+        np.stack([cy*cz, sx*sy*cz - cx*sz, cx*sy*cz + sx*sz], axis=-1),
+        np.stack([cy*sz, sx*sy*sz + cx*cz, cx*sy*sz - sx*cz], axis=-1),
+        np.stack([-sy, sx*cy, cx*cy], axis=-1),
+    ], axis=-2)
+    return R
+
+
+def pose_to_matrix(location: np.ndarray, rotation: np.ndarray) -> np.ndarray:
+    """Returns (..., 4, 4) camera to world matrices of (..., 3) locations
+    and XYZ euler rotations."""
+    location = np.asarray(location, dtype=np.float64)
+    R = euler_to_matrix(rotation)
+    T = np.zeros(R.shape[:-2] + (4, 4))
+    T[..., :3, :3] = R
+    T[..., :3, 3] = location
+    T[..., 3, 3] = 1
+    return T
+
+
+def frustum_side_normals(K: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Returns (4, 3) unit normals of the side planes of the frustum in camera
+    coordinates, pointing inwards. The planes go through the camera centre."""
+    corners = -np.linalg.solve(K, np.array([[0, width, width, 0],
+                                            [0, 0, height, height],
+                                            [1, 1, 1, 1]])).T
+    normals = np.cross(corners, np.roll(corners, -1, axis=0))
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    normals *= np.sign(normals @ -np.linalg.solve(K, [width/2, height/2, 1]))[:, None]
+    return normals
+
+
+def sphere_visibility(K: np.ndarray,
+                      camera_to_world: np.ndarray,
+                      centres: np.ndarray,
+                      radii: np.ndarray,
+                      width: int,
+                      height: int,
+                      grid: int = 32) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Frustum culling of bounding spheres for a batch of camera poses.
+
+    Spheres crossing the camera plane are assumed to cover the whole frame
+    if they are not outside any side plane of the frustum.
+
+    Args:
+        K (np.ndarray): 3x3 intrinsic matrix
+        camera_to_world (np.ndarray): (P, 4, 4) camera poses
+        centres (np.ndarray): (M, 3) world coordinates of the spheres
+        radii (np.ndarray): (M,) radii of the spheres
+        width (int): image width in px
+        height (int): image height in px
+        grid (int): cells per side of the grid used to compute the covered
+            fraction of the image
+
+    Returns:
+        visible (np.ndarray): (P, M) bool, sphere inside the view frustum
+        fractions (np.ndarray): (P, M) fraction of the image covered by the
+            projected bbox of each sphere
+        coverage (np.ndarray): (P,) fraction of the image covered by any sphere
+    """
+    camera_to_world = np.asarray(camera_to_world, dtype=np.float64).reshape(-1, 4, 4)
+    centres = np.asarray(centres, dtype=np.float64).reshape(-1, 3)
+    radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+    num_poses, num_spheres = len(camera_to_world), len(centres)
+
+    world_to_camera = np.linalg.inv(camera_to_world)
+    cam = (np.einsum('pij,mj->pmi', world_to_camera[:, :3, :3], centres)
+           + world_to_camera[:, None, :3, 3])
+
+    x_ratios, y_ratios = circle_ratio_extent(cam.reshape(-1, 3),
+                                             np.tile(radii, num_poses))
+    boxes = ratio_extent_to_pixels(K, x_ratios, y_ratios).reshape(num_poses, num_spheres, 4)
+
+    # Spheres crossing the camera plane, visible if they are not outside
+    # any of the side planes of the frustum
+    crossing = (cam[..., 2] < radii) & np.isnan(boxes[..., 0])
+    normals = frustum_side_normals(K, width, height)
+    inside = np.all(cam @ normals.T > -radii[:, None], axis=-1)
+    boxes[crossing & inside] = [0, width, 0, height]
+
+    boxes[..., :2] = np.clip(boxes[..., :2], 0, width)
+    boxes[..., 2:] = np.clip(boxes[..., 2:], 0, height)
+    boxes = np.nan_to_num(boxes)
+    extent_x = boxes[..., 1] - boxes[..., 0]
+    extent_y = boxes[..., 3] - boxes[..., 2]
+    visible = (extent_x > 0) & (extent_y > 0)
+    fractions = extent_x * extent_y / (width * height)
+
+    cells_x = (np.arange(grid) + 0.5) * width / grid
+    cells_y = (np.arange(grid) + 0.5) * height / grid
+    in_x = (boxes[..., :1] <= cells_x) & (cells_x <= boxes[..., 1:2])
+    in_y = (boxes[..., 2:3] <= cells_y) & (cells_y <= boxes[..., 3:4])
+    covered = np.any(in_y[..., :, None] & in_x[..., None, :], axis=1)
+    coverage = covered.reshape(num_poses, -1).mean(axis=1)
+
+    return visible, fractions, coverage
+
+
+def boxes_in_frustum(K: np.ndarray,
+                     camera_to_world: np.ndarray,
+                     width: int,
+                     height: int,
+                     near: float,
+                     far: float,
+                     mins: np.ndarray,
+                     maxs: np.ndarray) -> np.ndarray:
+    """Frustum culling of axis aligned boxes for a batch of camera poses.
+
+    A box is culled if it is fully outside one of the six planes of the
+    frustum. It is conservative, a few boxes near the edges of the frustum
+    are kept although they are outside.
+
+    Args:
+        K (np.ndarray): 3x3 intrinsic matrix
+        camera_to_world (np.ndarray): (P, 4, 4) camera poses
+        width (int): image width in px
+        height (int): image height in px
+        near (float): distance of the near plane in meters
+        far (float): distance of the far plane in meters
+        mins (np.ndarray): (N, 3) min world coordinates of the boxes
+        maxs (np.ndarray): (N, 3) max world coordinates of the boxes
+
+    Returns:
+        np.ndarray: (P, N) bool, box may be inside the view frustum
+    """
+    camera_to_world = np.asarray(camera_to_world, dtype=np.float64).reshape(-1, 4, 4)
+    mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+    maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+
+    # Planes n.x + d >= 0 inside, in camera coordinates
+    normals = np.concatenate([frustum_side_normals(K, width, height),
+                              [[0, 0, -1], [0, 0, 1]]])
+    offsets = np.array([0, 0, 0, 0, -near, far], dtype=np.float64)
+
+    # n_w = R n_c and d_w = d_c - n_w.t
+    R = camera_to_world[:, :3, :3]
+    t = camera_to_world[:, :3, 3]
+    world_normals = np.einsum('pij,kj->pki', R, normals)
+    world_offsets = offsets - np.einsum('pki,pi->pk', world_normals, t)
+
+    # Corner of each box furthest along each normal
+    furthest = np.where(world_normals[:, :, None, :] >= 0, maxs, mins)
+    distances = np.einsum('pkni,pki->pkn', furthest, world_normals) + world_offsets[..., None]
+    return np.all(distances >= 0, axis=1)
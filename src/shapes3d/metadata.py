@@ -0,0 +1,365 @@
+"""Implements an SQLite index of the metadata of generated datasets.
+
+Intrinsics, poses, scene descriptions and per object boxes of every frame
+are kept in a single database, so training subsets can be selected without
+reading the dataset files. It does not depend on blender.
+
+Example:
+    with MetadataDB("dataset_generated/metadata.sqlite") as db:
+        frames = db.query_frames(object_type="SPHERE", min_box_fraction=0.05, split="train")
+"""
+
+import json
+import re
+import sqlite3
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from shapes3d import dataset
+from shapes3d.annotations import CLASS_NAMES, get_visible_fractions, read_instance_ids
+
+METADATA_FILE_NAME = "metadata.sqlite"
+
+_NAME_RE = re.compile(r"^Shapes3D[_-]([A-Z]+)_")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    environment TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    split TEXT,
+    width INTEGER,
+    height INTEGER,
+    fx REAL, fy REAL, cx REAL, cy REAL,
+    tx REAL, ty REAL, tz REAL,
+    rx REAL, ry REAL, rz REAL,
+    coverage REAL,
+    PRIMARY KEY (environment, file_id)
+);
+CREATE TABLE IF NOT EXISTS objects (
+    environment TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT,
+    instance_id INTEGER,
+    min_x REAL, min_y REAL, max_x REAL, max_y REAL,
+    box_fraction REAL,
+    visible_fraction REAL,
+    PRIMARY KEY (environment, file_id, name)
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    environment TEXT PRIMARY KEY,
+    spec TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_type_box_fraction ON objects (type, box_fraction);
+CREATE INDEX IF NOT EXISTS frames_split ON frames (split);
+"""
+
+FRAME_COLUMNS = ("environment", "file_id", "split", "width", "height",
+                 "fx", "fy", "cx", "cy", "tx", "ty", "tz", "rx", "ry", "rz", "coverage")
+OBJECT_COLUMNS = ("environment", "file_id", "name", "type", "instance_id",
+                  "min_x", "min_y", "max_x", "max_y", "box_fraction", "visible_fraction")
+
+
+def _insert(table: str, columns: Sequence[str]) -> str:
+    return "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+        table, ", ".join(columns), ", ".join("?"*len(columns)))
+
+
+class MetadataDB:
+    """SQLite database of frames, objects and scenes.
+
+    Rows are buffered and inserted in a single transaction every batch_size
+    rows, on flush and on close. Frames added again replace the previous
+    rows and the objects of a frame replace all its previous objects, so
+    they are added in a single call.
+
+    Args:
+        path (str): database file, created if it does not exist
+        batch_size (int): rows buffered before inserting them
+    """
+    def __init__(self, path: Union[str, Path], batch_size: int = 1000):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self._path))
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(objects)")]
+        if "visible_fraction" not in columns:
+            self._conn.close()
+            raise RuntimeError("%s was created by an older version, index the dataset "
+                               "again into a new file" % self._path)
+        self._batch_size = batch_size
+        self._frames = []
+        self._objects = []
+        # Frames whose previous objects are deleted on flush
+        self._object_frames = set()
+        self._scenes = {}
+
+    def add_frame(self,
+                  environment: str,
+                  file_id: int,
+                  width: int,
+                  height: int,
+                  K: np.ndarray,
+                  location: Sequence[float],
+                  rotation: Sequence[float],
+                  split: Optional[str] = None,
+                  coverage: Optional[float] = None):
+        """Adds a frame.
+
+        Args:
+            environment (str): name of the environment, e.g. its folder
+            file_id (int): id of the frame
+            width (int): width of the image in px
+            height (int): height of the image in px
+            K (np.ndarray): 3x3 intrinsic matrix as in camera.get_intrinsic_matrix
+            location (list): (tx, ty, tz) of the camera in meters
+            rotation (list): (rx, ry, rz) XYZ euler rotation of the camera in radians
+            split (str): e.g. 'train' or 'val'
+            coverage (float): fraction of the image covered by shapes
+        """
+        self._frames.append((str(environment), int(file_id), split, int(width), int(height),
+                             float(K[0][0]), float(K[1][1]), float(K[0][2]), float(K[1][2]),
+                             *[None if v is None else float(v) for v in location],
+                             *[None if v is None else float(v) for v in rotation],
+                             None if coverage is None else float(coverage)))
+        self._maybe_flush()
+
+    def add_objects(self,
+                    environment: str,
+                    file_id: int,
+                    names: Sequence[str],
+                    types: Sequence[str],
+                    boxes: np.ndarray,
+                    box_fractions: Optional[Sequence[float]] = None,
+                    instance_ids: Optional[Sequence[int]] = None,
+                    visible_fractions: Optional[Sequence[float]] = None):
+        """Adds the objects of a frame, replacing its previous ones.
+
+        Args:
+            names (list): object names
+            types (list): shape types, e.g. 'SPHERE'
+            boxes (np.ndarray): (N, 4) [min_x, min_y, max_x, max_y] in px
+            box_fractions (list): fraction of the image covered by the box of
+                each object. Its visible pixels may be fewer. Default None
+            instance_ids (list): instance id of each object
+            visible_fractions (list): fraction of the image covered by the
+                visible pixels of each object, e.g. from its instance id map.
+                Default None
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if box_fractions is None:
+            box_fractions = [None]*len(boxes)
+        if instance_ids is None:
+            instance_ids = [None]*len(boxes)
+        if visible_fractions is None:
+            visible_fractions = [None]*len(boxes)
+        self._object_frames.add((str(environment), int(file_id)))
+        for name, shape_type, box, fraction, instance_id, visible in zip(
+                names, types, boxes.tolist(), box_fractions, instance_ids, visible_fractions):
+            self._objects.append((str(environment), int(file_id), name, shape_type,
+                                  None if instance_id is None else int(instance_id),
+                                  *box, None if fraction is None else float(fraction),
+                                  None if visible is None else float(visible)))
+        self._maybe_flush()
+
+    def add_boxes(self,
+                  environment: str,
+                  file_id: int,
+                  names: Sequence[str],
+                  types: Sequence[str],
+                  boxes: np.ndarray,
+                  width: int,
+                  height: int,
+                  instance_ids: Optional[Sequence[int]] = None,
+                  visible_fractions: Optional[Sequence[float]] = None):
+        """Adds objects with the fraction of the image covered by their boxes."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        box_fractions = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) / (width*height)
+        self.add_objects(environment, file_id, names, types, boxes,
+                         box_fractions.tolist(), instance_ids, visible_fractions)
+
+    def add_scene(self, environment: str, spec: dict):
+        """Adds the json serializable description of the scene of an environment."""
+        self._scenes[str(environment)] = json.dumps(spec)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._frames) + len(self._objects) + len(self._scenes) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """Inserts the buffered rows in a single transaction."""
+        if not (self._frames or self._objects or self._object_frames or self._scenes):
+            return
+        with self._conn:
+            self._conn.executemany("DELETE FROM objects WHERE environment = ? AND file_id = ?",
+                                   self._object_frames)
+            self._conn.executemany(_insert("frames", FRAME_COLUMNS), self._frames)
+            self._conn.executemany(_insert("objects", OBJECT_COLUMNS), self._objects)
+            self._conn.executemany(_insert("scenes", ("environment", "spec")),
+                                   self._scenes.items())
+        self._frames, self._objects, self._scenes = [], [], {}
+        self._object_frames = set()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        """Runs a query on the flushed rows and returns all its rows."""
+        self.flush()
+        return self._conn.execute(sql, params).fetchall()
+
+    def query_frames(self,
+                     object_type: Optional[str] = None,
+                     min_box_fraction: float = 0,
+                     min_visible_fraction: float = 0,
+                     min_objects: int = 1,
+                     split: Optional[str] = None,
+                     environment: Optional[str] = None) -> List[Tuple[str, int]]:
+        """Returns (environment, file_id) of the frames matching all filters.
+
+        Args:
+            object_type (str): frames with objects of this type, e.g. 'SPHERE'
+            min_box_fraction (float): the boxes of the objects cover at least
+                this fraction of the image. Occluded objects may be counted
+            min_visible_fraction (float): the visible pixels of the objects cover
+                at least this fraction of the image. Objects without visible
+                fraction, rendered without instance ids, never match
+            min_objects (int): number of such objects needed, if object_type
+                or a min fraction are passed
+            split (str): only frames of this split
+            environment (str): only frames of this environment
+        """
+        conditions, params = [], []
+        if min_box_fraction > 0:
+            conditions.append("o.box_fraction >= ?")
+            params.append(min_box_fraction)
+        if min_visible_fraction > 0:
+            conditions.append("o.visible_fraction >= ?")
+            params.append(min_visible_fraction)
+        if object_type is not None:
+            conditions.append("o.type = ?")
+            params.append(object_type)
+
+        where = []
+        if split is not None:
+            where.append("f.split = ?")
+            params.append(split)
+        if environment is not None:
+            where.append("f.environment = ?")
+            params.append(environment)
+
+        filter_objects = bool(conditions)
+        if not filter_objects:
+            sql = "SELECT f.environment, f.file_id FROM frames f"
+        else:
+            sql = ("SELECT f.environment, f.file_id FROM frames f "
+                   "JOIN objects o ON o.environment = f.environment AND o.file_id = f.file_id "
+                   "AND " + " AND ".join(conditions))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if filter_objects:
+            sql += " GROUP BY f.environment, f.file_id HAVING COUNT(*) >= ?"
+            params.append(min_objects)
+        sql += " ORDER BY f.environment, f.file_id"
+        return self.execute(sql, params)
+
+    def get_frame(self, environment: str, file_id: int) -> Optional[dict]:
+        rows = self.execute("SELECT * FROM frames WHERE environment = ? AND file_id = ?",
+                            (str(environment), int(file_id)))
+        return dict(zip(FRAME_COLUMNS, rows[0])) if rows else None
+
+    def get_objects(self, environment: str, file_id: int) -> List[dict]:
+        rows = self.execute("SELECT * FROM objects WHERE environment = ? AND file_id = ?",
+                            (str(environment), int(file_id)))
+        return [dict(zip(OBJECT_COLUMNS, row)) for row in rows]
+
+    def get_scene(self, environment: str) -> Optional[dict]:
+        rows = self.execute("SELECT spec FROM scenes WHERE environment = ?", (str(environment),))
+        return json.loads(rows[0][0]) if rows else None
+
+
+def _read_split(root: Path) -> dict:
+    """Returns (environment, file_id) -> split of train.txt and val.txt."""
+    splits = {}
+    for split in ("train", "val"):
+        path = root / (split + ".txt")
+        if not path.exists():
+            continue
+        with open(path) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) == 2:
+                    splits[(tokens[0], int(tokens[1]))] = split
+    return splits
+
+
+def get_type_from_name(name: str) -> str:
+    """Returns the shape type from the name of a shapes3d object without blender,
+    as shapes.get_shape_type."""
+    match = _NAME_RE.match(name)
+    if match and match.group(1) in CLASS_NAMES:
+        return match.group(1)
+    return CLASS_NAMES[-1]
+
+
+def index_dataset(root: Union[str, Path],
+                  path: Optional[Union[str, Path]] = None,
+                  sensor_width: float = 36) -> Path:
+    """Indexes an existing dataset from its txt files.
+
+    Only the first color image of each environment is opened to get the
+    image size. Box fractions are the areas of the boxes of the objects,
+    visible fractions are read from the instance id maps if any.
+
+    Args:
+        root (str): folder of the dataset
+        path (str): database file. Default <root>/metadata.sqlite
+        sensor_width (float): sensor width of the camera in mm
+
+    Returns:
+        Path: database file
+    """
+    root = Path(root)
+    path = Path(path) if path else root / METADATA_FILE_NAME
+    splits = _read_split(root)
+    sizes = {}
+    with MetadataDB(path) as db:
+        for folder, file_id in dataset.find_frames(root):
+            environment = folder.relative_to(root).as_posix()
+            files = dataset.get_frame_files(folder, file_id)
+            if folder not in sizes:
+                height, width = dataset.read_image(files["color"]).shape[:2]
+                sizes[folder] = (width, height, dataset.read_intrinsic_matrix(
+                    root, width, height, sensor_width))
+            width, height, K = sizes[folder]
+
+            location = rotation = (None,)*3
+            if files["extrinsic"] is not None:
+                location, rotation = dataset.read_extrinsic(files["extrinsic"])
+            db.add_frame(environment, file_id, width, height, K, location, rotation,
+                         split=splits.get((environment, file_id)))
+
+            if files["bbox"] is not None:
+                names, boxes, relative = dataset.read_bboxes(files["bbox"])
+                if relative:
+                    boxes = boxes * [width, height, width, height]
+                corners = np.column_stack([boxes[:, :2] - boxes[:, 2:]/2,
+                                           boxes[:, :2] + boxes[:, 2:]/2])
+                visible = None
+                if files["inst_id"] is not None and files["inst_id_table"] is not None:
+                    fractions = get_visible_fractions(*read_instance_ids(folder, file_id))
+                    visible = [fractions.get(name, 0.0) for name in names]
+                db.add_boxes(environment, file_id, names,
+                             [get_type_from_name(name) for name in names],
+                             corners, width, height, visible_fractions=visible)
+    return path
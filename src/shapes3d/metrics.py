@@ -0,0 +1,133 @@
+"""Records the growth of blender datablocks and memory over long runs.
+
+After every frame and environment reset the number of datablocks of the
+main bpy.data collections, the orphans among them, the resident memory of
+the process and an estimate of the undo steps left by UndoChanges are
+appended to a jsonl file. The growth between consecutive environments is
+checked against thresholds, a leak shows up as a warning after a few
+environments.
+
+Example:
+    metrics = MetricsRecorder("out/metrics.jsonl")
+    env.set_metrics(metrics)
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import bpy
+
+from shapes3d.utils import UndoChanges
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+COLLECTIONS = ("objects", "meshes", "materials", "images", "node_groups")
+# Max growth of each collection from one environment to the next
+MAX_GROWTH = {"objects": 0, "meshes": 0, "materials": 0, "images": 0, "node_groups": 0}
+MAX_RSS_GROWTH_MB = 64
+FRAME = "frame"
+ENVIRONMENT = "environment"
+
+
+class DatablockGrowthWarning(ResourceWarning):
+    pass
+
+
+def get_rss_mb() -> float:
+    """Returns the resident memory of the process in MB.
+
+    Uses psutil if installed, else /proc on Linux and the peak resident
+    memory elsewhere.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes in macOS, KB in Linux
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def get_datablock_counts() -> Dict[str, int]:
+    """Returns the number of datablocks and of orphans, without users, of
+    each collection in COLLECTIONS."""
+    counts = {}
+    for name in COLLECTIONS:
+        collection = getattr(bpy.data, name)
+        counts[name] = len(collection)
+        counts["orphan_" + name] = sum(1 for block in collection if block.users == 0)
+    return counts
+
+
+class MetricsRecorder:
+    """Appends datablock counts, memory and estimated undo steps to a jsonl file.
+
+    Args:
+        path (str): jsonl file, created if it does not exist
+        max_growth (dict): collection -> max growth per environment before
+            warning. Default MAX_GROWTH
+        max_rss_growth_mb (float): max growth of the resident memory per
+            environment in MB before warning
+    """
+    def __init__(self,
+                 path: Union[str, Path],
+                 max_growth: Optional[Dict[str, int]] = None,
+                 max_rss_growth_mb: float = MAX_RSS_GROWTH_MB):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._max_growth = dict(MAX_GROWTH, **(max_growth or {}))
+        self._max_rss_growth_mb = max_rss_growth_mb
+        self._start = time.perf_counter()
+        self._last_environment = None
+        self._environments = 0
+
+    def record(self, event: str, **info) -> dict:
+        """Appends the current metrics with the event name and info.
+
+        Returns:
+            dict: the appended row
+        """
+        row = dict(info,
+                   event=event,
+                   seconds=time.perf_counter() - self._start,
+                   rss_mb=get_rss_mb(),
+                   undo_steps_estimate=UndoChanges.get_undo_steps_estimate(),
+                   **get_datablock_counts())
+        with open(self._path, "a") as f:
+            f.write(json.dumps(row) + "\n")
+        return row
+
+    def record_frame(self, file_id: Optional[int] = None) -> dict:
+        return self.record(FRAME, file_id=file_id, environment=self._environments)
+
+    def record_environment(self) -> dict:
+        """Records the metrics after an environment reset and warns if they
+        grew more than the thresholds since the previous one."""
+        row = self.record(ENVIRONMENT, environment=self._environments)
+        if self._last_environment is not None:
+            self._check_growth(self._last_environment, row)
+        self._last_environment = row
+        self._environments += 1
+        return row
+
+    def _check_growth(self, previous: dict, current: dict):
+        growth = {name: current[name] - previous[name] for name in self._max_growth}
+        exceeded = {name: value for name, value in growth.items()
+                    if value > self._max_growth[name]}
+        rss_growth = current["rss_mb"] - previous["rss_mb"]
+        if rss_growth > self._max_rss_growth_mb:
+            exceeded["rss_mb"] = round(rss_growth, 1)
+        if exceeded:
+            warnings.warn("Growth per environment %d exceeds the thresholds: %s" %
+                          (current["environment"], exceeded), DatablockGrowthWarning)
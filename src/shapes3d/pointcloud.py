@@ -0,0 +1,276 @@
+"""Back-projects the depth maps of generated datasets into point clouds
+without blender.
+
+Frames of an environment are read in batches and back-projected at once
+with a ray grid cached per intrinsic matrix and resolution. Points are
+transformed to world coordinates with the Extrinsic files and can be
+downsampled into a voxel grid while streaming, so memory stays bounded by
+the number of occupied voxels.
+
+Usage:
+    python -m shapes3d.pointcloud dataset_generated -o clouds --voxel 0.05 --format ply
+"""
+
+import argparse
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from shapes3d import dataset
+from shapes3d.geometry import pose_to_matrix
+
+NPY_FORMAT = "npy"
+PLY_FORMAT = "ply"
+FORMATS = (NPY_FORMAT, PLY_FORMAT)
+PLY_HEADER = ("ply\n"
+              "format binary_little_endian 1.0\n"
+              "element vertex {:d}\n"
+              "property float x\n"
+              "property float y\n"
+              "property float z\n"
+              "end_header\n")
+
+
+@lru_cache(maxsize=16)
+def _ray_grid(K: tuple, width: int, height: int) -> np.ndarray:
+    K = np.array(K).reshape(3, 3)
+    u = np.arange(width, dtype=np.float64) + 0.5
+    v = np.arange(height, dtype=np.float64) + 0.5
+    rays = np.empty((height, width, 3), dtype=np.float32)
+    # Inverse of u = K00 x/z + K02 and v = K11 y/z + K12 with z = -depth
+    rays[..., 0] = -(u[None, :] - K[0, 2]) / K[0, 0]
+    rays[..., 1] = -(v[:, None] - K[1, 2]) / K[1, 1]
+    rays[..., 2] = -1
+    rays.setflags(write=False)
+    return rays
+
+
+def get_ray_grid(K: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Returns (height, width, 3) camera coordinates of each pixel centre at depth 1.
+
+    Grids are cached, a dataset needs a single one per resolution.
+    """
+    return _ray_grid(tuple(np.asarray(K, dtype=np.float64).ravel()), width, height)
+
+
+def depth_to_points(depth: np.ndarray,
+                    K: np.ndarray,
+                    camera_to_world: Optional[np.ndarray] = None,
+                    max_depth: float = dataset.MAX_DEPTH,
+                    stride: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Back-projects a batch of depth maps.
+
+    Args:
+        depth (np.ndarray): (B, H, W) or (H, W) distance along the camera axis
+        K (np.ndarray): 3x3 intrinsic matrix as in camera.get_intrinsic_matrix
+        camera_to_world (np.ndarray): (B, 4, 4) or (4, 4) poses. If None,
+            points stay in camera coordinates
+        max_depth (float): pixels at this depth or further are dropped
+        stride (int): uses one of every stride pixels in each direction
+
+    Returns:
+        np.ndarray: (N, 3) float32 points
+        np.ndarray: (N,) index of the depth map of each point
+    """
+    depth = np.asarray(depth, dtype=np.float32)
+    if depth.ndim == 2:
+        depth = depth[None]
+    height, width = depth.shape[1:]
+    rays = get_ray_grid(K, width, height)[::stride, ::stride]
+    depth = depth[:, ::stride, ::stride]
+
+    valid = np.isfinite(depth) & (depth > 0) & (depth < max_depth)
+    owner, rows, cols = np.nonzero(valid)
+    points = rays[rows, cols] * depth[owner, rows, cols][:, None]
+
+    if camera_to_world is not None:
+        matrix = np.asarray(camera_to_world, dtype=np.float32).reshape(-1, 4, 4)
+        points = np.einsum("nij,nj->ni", matrix[owner, :3, :3], points) + matrix[owner, :3, 3]
+    return points.astype(np.float32, copy=False), owner
+
+
+def voxel_downsample(points: np.ndarray, voxel_size: float) -> np.ndarray:
+    """Returns the mean of the points in each occupied voxel."""
+    _, sums, counts = _voxelize(points, voxel_size)
+    return (sums / counts[:, None]).astype(np.float32)
+
+
+def _voxelize(points: np.ndarray,
+              voxel_size: float,
+              sums: Optional[np.ndarray] = None,
+              counts: Optional[np.ndarray] = None,
+              keys: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merges points into voxel (keys, sums, counts), optionally extending
+    an existing set."""
+    new_keys = np.floor(points / voxel_size).astype(np.int64)
+    new_sums = points.astype(np.float64)
+    new_counts = np.ones(len(points), dtype=np.int64)
+    if keys is not None:
+        new_keys = np.concatenate([keys, new_keys])
+        new_sums = np.concatenate([sums, new_sums])
+        new_counts = np.concatenate([counts, new_counts])
+
+    keys, inverse = np.unique(new_keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    sums = np.zeros((len(keys), 3), dtype=np.float64)
+    np.add.at(sums, inverse, new_sums)
+    counts = np.bincount(inverse, weights=new_counts, minlength=len(keys)).astype(np.int64)
+    return keys, sums, counts
+
+
+def iter_depth_batches(folder: Union[str, Path],
+                       file_ids: Optional[List[int]] = None,
+                       batch_size: int = 16) -> Iterator[Tuple[List[int], np.ndarray, np.ndarray]]:
+    """Yields batches of depth maps and poses of an environment folder.
+
+    Frames without depth EXR or Extrinsic file are skipped.
+
+    Yields:
+        list: file ids of the batch
+        np.ndarray: (B, H, W) depth maps
+        np.ndarray: (B, 4, 4) camera to world matrices
+    """
+    if file_ids is None:
+        file_ids = [file_id for frame_folder, file_id in dataset.find_frames(folder)
+                    if frame_folder == Path(folder)]
+
+    batch, depths, locations, rotations = [], [], [], []
+    for file_id in file_ids:
+        files = dataset.get_frame_files(folder, file_id)
+        if files["depth"] is None or files["extrinsic"] is None:
+            continue
+        location, rotation = dataset.read_extrinsic(files["extrinsic"])
+        batch.append(file_id)
+        depths.append(dataset.read_depth(files["depth"]))
+        locations.append(location)
+        rotations.append(rotation)
+        if len(batch) == batch_size:
+            yield batch, np.stack(depths), pose_to_matrix(np.array(locations), np.array(rotations))
+            batch, depths, locations, rotations = [], [], [], []
+    if batch:
+        yield batch, np.stack(depths), pose_to_matrix(np.array(locations), np.array(rotations))
+
+
+def build_point_cloud(root: Union[str, Path],
+                      folder: Union[str, Path],
+                      voxel_size: Optional[float] = None,
+                      batch_size: int = 16,
+                      stride: int = 1,
+                      max_depth: float = dataset.MAX_DEPTH,
+                      sensor_width: float = 36) -> np.ndarray:
+    """Returns the world point cloud of all frames of an environment.
+
+    Args:
+        root (str): folder of the dataset, with intrinsic_matrix.txt
+        folder (str): folder of the environment
+        voxel_size (float): if passed, points are averaged per voxel of this
+            size in meters after every batch
+        batch_size (int): depth maps back-projected at once
+        stride (int): uses one of every stride pixels in each direction
+        max_depth (float): pixels at this depth or further are dropped
+        sensor_width (float): sensor width of the camera in mm
+
+    Returns:
+        np.ndarray: (N, 3) float32 points
+    """
+    K = None
+    chunks = []
+    keys = sums = counts = None
+    for _, depths, matrices in iter_depth_batches(folder, batch_size=batch_size):
+        if K is None:
+            height, width = depths.shape[1:]
+            K = dataset.read_intrinsic_matrix(root, width, height, sensor_width)
+        points, _ = depth_to_points(depths, K, matrices, max_depth=max_depth, stride=stride)
+        if voxel_size:
+            keys, sums, counts = _voxelize(points, voxel_size, sums, counts, keys)
+        else:
+            chunks.append(points)
+
+    if voxel_size:
+        if keys is None:
+            return np.zeros((0, 3), dtype=np.float32)
+        return (sums / counts[:, None]).astype(np.float32)
+    if not chunks:
+        return np.zeros((0, 3), dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+def save_npy(path: Union[str, Path], points: np.ndarray, dtype=np.float32):
+    """Saves (N, 3) points, dtype np.float16 halves the size."""
+    np.save(path, np.asarray(points, dtype=dtype))
+
+
+def save_ply(path: Union[str, Path], points: np.ndarray):
+    """Saves (N, 3) points as a binary little endian PLY with float32 coordinates."""
+    points = np.ascontiguousarray(points, dtype="<f4")
+    with open(path, "wb") as f:
+        f.write(PLY_HEADER.format(len(points)).encode("ascii"))
+        f.write(points.tobytes())
+
+
+def convert_dataset(root: Union[str, Path],
+                    output: Union[str, Path],
+                    file_format: str = NPY_FORMAT,
+                    dtype=np.float32,
+                    **kwargs) -> List[Path]:
+    """Saves the point cloud of every environment of a dataset.
+
+    Args:
+        root (str): folder of the dataset
+        output (str): folder where to save <environment>.npy or .ply
+        file_format (str): 'npy' or 'ply'
+        dtype: dtype of the npy files, np.float32 or np.float16
+        kwargs: see build_point_cloud
+
+    Returns:
+        list: saved files
+    """
+    if file_format not in FORMATS:
+        raise AttributeError("file_format must be one of {}".format(FORMATS))
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    folders = sorted({folder for folder, _ in dataset.find_frames(root)})
+    files = []
+    for folder in folders:
+        points = build_point_cloud(root, folder, **kwargs)
+        path = output / "{}.{}".format(folder.relative_to(root).as_posix().replace("/", "_"),
+                                       file_format)
+        if file_format == PLY_FORMAT:
+            save_ply(path, points)
+        else:
+            save_npy(path, points, dtype)
+        files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts the depth maps of a dataset into point clouds")
+    parser.add_argument("root", type=str, help="Folder of the dataset")
+    parser.add_argument("-o", "--output", type=str, default="point_clouds",
+                        help="Folder where to save a point cloud per environment")
+    parser.add_argument("-v", "--voxel", type=float, default=None,
+                        help="Voxel size in meters to downsample the points")
+    parser.add_argument("-b", "--batch_size", type=int, default=16,
+                        help="Depth maps back-projected at once")
+    parser.add_argument("-s", "--stride", type=int, default=1,
+                        help="Uses one of every stride pixels in each direction")
+    parser.add_argument("--format", type=str, default=NPY_FORMAT, choices=FORMATS)
+    parser.add_argument("--half", action="store_true",
+                        help="Saves npy files as float16")
+    args = parser.parse_args()
+
+    files = convert_dataset(args.root, args.output,
+                            file_format=args.format,
+                            dtype=np.float16 if args.half else np.float32,
+                            voxel_size=args.voxel,
+                            batch_size=args.batch_size,
+                            stride=args.stride)
+    for f in files:
+        print(f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Quality assurance of generated datasets without blender.
+
+Checks in parallel that the files of every frame exist and decode,
+computes depth ranges and per object pixel statistics and optionally
+draws the bounding boxes over the color images.
+
+Usage:
+    python -m shapes3d.qa dataset_generated --overlays qa_overlays --report qa.json
+"""
+
+import argparse
+import json
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from shapes3d import dataset
+from shapes3d.annotations import BACKGROUND_ID
+
+BBOX_IMAGE_FILE_NAME = "Image_bbox_"
+BBOX_COLOR = (255, 0, 0)
+MAX_REPORTED_ERRORS = 100
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray):
+    """Returns the concatenation of arange(start, stop) for each pair and
+    the index of the pair of each element."""
+    lengths = np.clip(stops - starts, 0, None)
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return starts[owner] + offsets, owner
+
+
+def draw_bboxes(im: np.ndarray, boxes: np.ndarray, color=BBOX_COLOR) -> np.ndarray:
+    """Draws (N, 4) [min_x, min_y, max_x, max_y] px boxes on a copy of im.
+
+    All edges are drawn with a single fancy indexing assignment per side.
+    """
+    im = np.array(im)
+    if im.ndim == 2:
+        im = np.repeat(im[..., None], 3, axis=2)
+    height, width = im.shape[:2]
+    boxes = np.round(np.asarray(boxes, dtype=np.float64)).astype(np.int64).reshape(-1, 4)
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width - 1)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height - 1)
+    min_x, min_y, max_x, max_y = boxes.T
+
+    color = np.array(color + (255,)*(im.shape[2] - len(color)), dtype=im.dtype)
+    xs, owner = _ranges(min_x, max_x + 1)
+    im[min_y[owner], xs] = color
+    im[max_y[owner], xs] = color
+    ys, owner = _ranges(min_y, max_y + 1)
+    im[ys, min_x[owner]] = color
+    im[ys, max_x[owner]] = color
+    return im
+
+
+def _to_corners(boxes: np.ndarray, relative: bool, width: int, height: int) -> np.ndarray:
+    if relative:
+        boxes = boxes * [width, height, width, height]
+    return np.column_stack([boxes[:, :2] - boxes[:, 2:]/2, boxes[:, :2] + boxes[:, 2:]/2])
+
+
+def _object_pixels(files: dict) -> Optional[np.ndarray]:
+    """Returns the pixel count of each object from the id map.
+
+    The colors of the segmentation are filtered at the edges of the objects,
+    so they are not used, a frame without id map has no object statistics.
+    """
+    if files["inst_id"] is None:
+        return None
+    id_map = dataset.read_image(files["inst_id"]).astype(np.int64)
+    counts = np.bincount(id_map.ravel())
+    counts[BACKGROUND_ID] = 0
+    return counts[counts > 0]
+
+
+def check_frame(folder: Path, file_id: int, expected: tuple,
+                overlay_dir: Optional[Path] = None,
+                root: Optional[Path] = None) -> dict:
+    """Checks a frame and returns its statistics.
+
+    Depth EXRs are only decoded with OpenEXR installed, else depth_checked
+    is False and only their header is checked.
+
+    Args:
+        folder (Path): folder of the frame
+        file_id (int): id of the frame
+        expected (tuple): kinds of files every frame must have
+        overlay_dir (Path): if passed, saves the color image with bboxes there
+        root (Path): folder of the dataset, overlays keep the folders of the
+            frames relative to it. Default only the name of folder is kept
+
+    Returns:
+        dict: with frame, missing and corrupt files and statistics
+    """
+    files = dataset.get_frame_files(folder, file_id)
+    result = {"frame": "{}/{:04d}".format(folder, file_id),
+              "missing": [kind for kind in expected if files[kind] is None],
+              "corrupt": []}
+
+    color = None
+    for kind in ("color", "depth_png", "inst_seg", "inst_id"):
+        if files[kind] is None:
+            continue
+        try:
+            im = dataset.read_image(files[kind])
+        except Exception:
+            result["corrupt"].append(kind)
+            continue
+        if kind == "color":
+            color = im
+            result["height"], result["width"] = im.shape[:2]
+
+    if files["depth"] is not None:
+        result["depth_checked"] = dataset.has_exr_support()
+        try:
+            if dataset.has_exr_support():
+                depth = dataset.read_depth(files["depth"])
+                valid = np.isfinite(depth) & (depth < dataset.MAX_DEPTH)
+                if valid.any():
+                    result["depth_range"] = (float(depth[valid].min()), float(depth[valid].max()))
+                result["depth_valid_fraction"] = float(valid.mean())
+            elif not dataset.is_exr(files["depth"]):
+                raise ValueError
+        except Exception:
+            result["corrupt"].append("depth")
+
+    try:
+        pixels = _object_pixels(files)
+    except Exception:
+        pixels = None
+    if pixels is not None and color is not None:
+        result["object_fractions"] = (pixels / (color.shape[0]*color.shape[1])).tolist()
+
+    for kind in ("bbox", "extrinsic"):
+        if files[kind] is None:
+            continue
+        try:
+            if kind == "bbox":
+                _, boxes, relative = dataset.read_bboxes(files[kind])
+                result["num_bboxes"] = len(boxes)
+            else:
+                dataset.read_extrinsic(files[kind])
+        except Exception:
+            result["corrupt"].append(kind)
+
+    if overlay_dir is not None and color is not None and "num_bboxes" in result:
+        height, width = color.shape[:2]
+        im = draw_bboxes(color, _to_corners(boxes, relative, width, height))
+        relative = Path(folder).relative_to(root) if root is not None else Path(folder).name
+        out = Path(overlay_dir) / relative
+        out.mkdir(parents=True, exist_ok=True)
+        Image.fromarray(im).save(out / "{}{:04d}.png".format(BBOX_IMAGE_FILE_NAME, file_id))
+
+    return result
+
+
+def _check_frame(args):
+    return check_frame(*args)
+
+
+def run_qa(root: Union[str, Path],
+           processes: Optional[int] = None,
+           overlay_dir: Optional[Union[str, Path]] = None,
+           chunksize: int = 64) -> dict:
+    """Checks every frame of a dataset with a process pool.
+
+    A kind of file (color, depth, ...) is expected in every frame if the
+    first frame of any environment has it.
+
+    Args:
+        root (str): folder of the dataset
+        processes (int): number of processes. Default number of cpus
+        overlay_dir (str): if passed, saves color images with bboxes there
+        chunksize (int): frames sent to a process at once
+
+    Returns:
+        dict: summary report
+    """
+    frames = dataset.find_frames(root)
+    expected = set()
+    first_frames = {}
+    for folder, file_id in frames:
+        first_frames.setdefault(folder, file_id)
+    for folder, file_id in first_frames.items():
+        files = dataset.get_frame_files(folder, file_id)
+        expected.update(kind for kind, path in files.items() if path is not None)
+    expected = tuple(sorted(expected))
+
+    if "depth" in expected and not dataset.has_exr_support():
+        warnings.warn("OpenEXR is not installed, depth EXRs are not decoded")
+
+    jobs = [(folder, file_id, expected, overlay_dir, Path(root)) for folder, file_id in frames]
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(_check_frame, jobs, chunksize=chunksize))
+
+    return summarize(results, expected)
+
+
+def summarize(results: list, expected: tuple) -> dict:
+    """Aggregates the results of check_frame into a report."""
+    missing = {kind: 0 for kind in expected}
+    corrupt = {}
+    errors = []
+    depth_min, depth_max = np.inf, -np.inf
+    depth_unchecked = 0
+    fractions, objects_per_frame, bboxes_per_frame = [], [], []
+
+    for r in results:
+        for kind in r["missing"]:
+            missing[kind] += 1
+        for kind in r["corrupt"]:
+            corrupt[kind] = corrupt.get(kind, 0) + 1
+        if (r["missing"] or r["corrupt"]) and len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(r)
+        if r.get("depth_checked") is False:
+            depth_unchecked += 1
+        if "depth_range" in r:
+            depth_min = min(depth_min, r["depth_range"][0])
+            depth_max = max(depth_max, r["depth_range"][1])
+        if "object_fractions" in r:
+            fractions.extend(r["object_fractions"])
+            objects_per_frame.append(len(r["object_fractions"]))
+        if "num_bboxes" in r:
+            bboxes_per_frame.append(r["num_bboxes"])
+
+    def stats(values):
+        if not values:
+            return None
+        values = np.asarray(values, dtype=np.float64)
+        return {"min": float(values.min()), "mean": float(values.mean()),
+                "median": float(np.median(values)), "max": float(values.max())}
+
+    return {
+        "num_frames": len(results),
+        "num_valid_frames": sum(not r["missing"] and not r["corrupt"] for r in results),
+        "expected_files": list(expected),
+        "missing": missing,
+        "corrupt": corrupt,
+        "depth_range": [depth_min, depth_max] if np.isfinite(depth_min) else None,
+        "depth_unchecked": depth_unchecked,
+        "object_fraction": stats(fractions),
+        "objects_per_frame": stats(objects_per_frame),
+        "bboxes_per_frame": stats(bboxes_per_frame),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks a dataset generated with shapes3d")
+    parser.add_argument("root", type=str, help="Folder of the dataset")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="Number of processes. Default number of cpus")
+    parser.add_argument("-o", "--overlays", type=str, default=None,
+                        help="Folder where to save color images with bboxes")
+    parser.add_argument("-r", "--report", type=str, default=None,
+                        help="Json file where to save the report")
+    args = parser.parse_args()
+
+    report = run_qa(args.root, processes=args.processes, overlay_dir=args.overlays)
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
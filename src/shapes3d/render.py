@@ -5,19 +5,40 @@ in single functions, as well as grouping common functions used
 in blender repetitively regarding rendering.
 """
 
+import hashlib
+import json
+
 import bpy
+import bmesh
 import numpy as np
 from pathlib import Path
 from PIL import Image
+from typing import Dict
 from typing import Tuple
 from typing import List
 from typing import Optional
+from typing import Sequence
 
+from shapes3d.cache import RenderCache
 from shapes3d.utils import UndoChanges
 from shapes3d.camera import get_intrinsic_matrix
+from shapes3d.camera import get_rig_cameras
+from shapes3d.geometry import circle_ratio_extent
+from shapes3d.geometry import project_points
+from shapes3d.geometry import ratio_extent_to_pixels
+from shapes3d.annotations import AnnotationSink
+from shapes3d.metadata import MetadataDB
+from shapes3d.annotations import INST_ID_FILE_NAME
+from shapes3d.annotations import INST_ID_TABLE_FILE_NAME
+from shapes3d.annotations import MAX_INSTANCE_ID
+from shapes3d.annotations import get_visible_fractions
+from shapes3d.annotations import read_instance_ids
+from shapes3d.shapes import PRIMITIVE_PROPERTY
+from shapes3d.shapes import get_shape_type
 
 SCENE = 'Scene'
 CAMERA = 'Camera'
+VIEW_LAYER = 'View Layer'
 
 OUTPUT_NODE_TYPE = 'CompositorNodeOutputFile'
 IMAGE_NODE_TYPE = 'CompositorNodeRLayers'
@@ -25,6 +46,7 @@ OBJECT_INFO_NODE_TYPE = 'ShaderNodeObjectInfo'
 COLOR_RAMP_NODE_TYPE = 'ShaderNodeValToRGB'
 EMISSION_NODE_TYPE = 'ShaderNodeEmission'
 MAT_OUTPUT_NODE_TYPE = 'ShaderNodeOutputMaterial'
+MATH_NODE_TYPE = 'CompositorNodeMath'
 COLOR_VIEW_LAYER_TYPE = 'CompositorNodeViewer'
 
 COLOR_IMG_NODE = 'Shapes3d_Color_img_image_node'
@@ -33,6 +55,8 @@ OUTPUT_Z_NODE_PNG = 'Shapes3d_Output_z_node_png'
 OUTPUT_COLOR_NODE = 'Shapes3d_Output_color_node'
 OUTPUT_INST_SEG_NODE = 'Shapes3d_Output_inst_seg_node'
 COLOR_VIEW_LAYER = 'Shapes3d_View_node'
+OUTPUT_INST_ID_NODE = 'Shapes3d_Output_inst_id_node'
+INST_ID_NORM_NODE = 'Shapes3d_Inst_id_norm_node'
 Z_NORM_NODE = 'Shapes3d_Z_norm_node'
 
 SEGMENTATION_MAT = "Shapes3d_Segmentation_material"
@@ -43,14 +67,26 @@ COLOR_FILE_NAME = "Image_color_"
 BBOX_FILE_NAME = "Bbox_"
 BBOX_IMAGE_FILE_NAME = "Image_bbox_"
 INST_SEG_FILE_NAME = "Image_inst_seg_"
+INTRINSIC_FILE_NAME = "Intrinsic_"
 
 EXR_FILE_TYPE = 'OPEN_EXR'
 PNG_FILE_TYPE = 'PNG'
 JPEG_FILE_TYPE = 'JPEG'
+WEBP_FILE_TYPE = 'WEBP'
+FILE_EXTENSIONS = {PNG_FILE_TYPE: ".png", JPEG_FILE_TYPE: ".jpg",
+                   WEBP_FILE_TYPE: ".webp", EXR_FILE_TYPE: ".exr"}
+EXR_CODECS = ('NONE', 'PXR24', 'ZIP', 'PIZ', 'RLE', 'ZIPS', 'B44', 'B44A', 'DWAA', 'DWAB')
 
 CYCLES = 'CYCLES'
 EVEE = 'BLENDER_EEVEE'
 
+# Convex hulls of meshes without primitive, keyed by mesh datablock
+_HULL_CACHE = {}
+# World space vertices and hulls of objects, see _get_world_points
+_GEOMETRY_CACHE = {}
+VERTICES = 'VERTICES'
+HULL = 'HULL'
+
 def unset_color():
     color_scene = bpy.data.scenes[SCENE]
     bpy.context.window.scene = color_scene
@@ -60,10 +96,67 @@ def unset_color():
     if OUTPUT_COLOR_NODE in tree.nodes.keys():
         tree.nodes.remove(tree.nodes[OUTPUT_COLOR_NODE])
 
-def set_color(activate: bool=True, file_format: str='PNG',
-              alpha: bool=True, denoise: bool=True):
+def has_file_format(file_format: str) -> bool:
+    """Returns if blender can write file_format, e.g. WEBP needs blender 3.4+."""
+    return file_format in bpy.types.ImageFormatSettings.bl_rna.properties['file_format'].enum_items
+
+def set_image_format(image_format: bpy.types.ImageFormatSettings,
+                     file_format: str=PNG_FILE_TYPE,
+                     color_mode: Optional[str]=None,
+                     color_depth: Optional[str]=None,
+                     compression: Optional[int]=None,
+                     quality: Optional[int]=None,
+                     exr_codec: Optional[str]=None):
+    """Sets the codec of the format of an output node or of the render.
+
+    Args:
+        image_format (ImageFormatSettings): e.g. node.format or
+            scene.render.image_settings
+        file_format (str): 'PNG', 'JPEG', 'WEBP' (blender 3.4+) or 'OPEN_EXR'
+        color_mode (str): 'BW', 'RGB' or 'RGBA'. JPEG has no alpha
+        color_depth (str): '8' or '16' for PNG, '16' (half) or '32' for EXR
+        compression (int): PNG zlib compression in [0, 100]. 0 is the fastest
+            to encode and the largest
+        quality (int): JPEG and WEBP quality in [0, 100]. WEBP at 100 is lossless
+        exr_codec (str): one of EXR_CODECS, e.g. 'ZIP', 'PIZ' or 'DWAA' (lossy)
     """
-    File format in [PNG, JPEG], alpha only for PNG
+    if file_format not in FILE_EXTENSIONS:
+        raise AttributeError("File format %s not in %s" % (file_format, list(FILE_EXTENSIONS)))
+    if not has_file_format(file_format):
+        raise RuntimeError("Blender %s can not write %s images" % (bpy.app.version_string, file_format))
+    if file_format == JPEG_FILE_TYPE and color_mode == 'RGBA':
+        color_mode = 'RGB'
+
+    image_format.file_format = file_format
+    if color_mode is not None:
+        image_format.color_mode = color_mode
+    if color_depth is not None:
+        image_format.color_depth = color_depth
+    if compression is not None:
+        image_format.compression = compression
+    if quality is not None:
+        image_format.quality = quality
+    if exr_codec is not None:
+        if exr_codec not in EXR_CODECS:
+            raise AttributeError("EXR codec %s not in %s" % (exr_codec, EXR_CODECS))
+        image_format.exr_codec = exr_codec
+
+def set_color(activate: bool=True, file_format: str='PNG',
+              alpha: bool=True, denoise: bool=True,
+              color_depth: str='8',
+              compression: Optional[int]=None,
+              quality: Optional[int]=None,
+              exr_codec: Optional[str]=None):
+    """Saves the color image per frame.
+
+    Args:
+        file_format (str): 'PNG', 'JPEG', 'WEBP' (blender 3.4+) or 'OPEN_EXR'
+        alpha (bool): RGBA with a transparent background. Not for JPEG
+        denoise (bool): Use the denoiser of the view layer
+        color_depth (str): '8' or '16' bits for PNG, '16' or '32' for EXR
+        compression (int): PNG compression in [0, 100]. Default blender's 15
+        quality (int): JPEG and WEBP quality in [0, 100], 100 is lossless WEBP
+        exr_codec (str): EXR codec, see EXR_CODECS
     """
     scene = bpy.data.scenes[SCENE]
     bpy.context.window.scene = scene
@@ -93,20 +186,35 @@ def set_color(activate: bool=True, file_format: str='PNG',
         viewer_node.name = COLOR_VIEW_LAYER
     links.new(img_node.outputs['Image'], viewer_node.inputs[0])
 
-    if file_format == 'PNG':
-        output_color_node.format.file_format = PNG_FILE_TYPE 
-        if alpha:
-            output_color_node.format.color_mode = 'RGBA'
-            bpy.context.scene.render.film_transparent = True
-        else:
-            output_color_node.format.color_mode = 'RGB'
-    else:
-        output_color_node.format.file_format = JPEG_FILE_TYPE 
+    alpha = alpha and file_format != JPEG_FILE_TYPE
+    if file_format == EXR_FILE_TYPE and color_depth == '8':
+        color_depth = '16'
+    bpy.context.scene.render.film_transparent = alpha
+    set_image_format(output_color_node.format, file_format,
+                     color_mode='RGBA' if alpha else 'RGB',
+                     color_depth=color_depth,
+                     compression=compression,
+                     quality=quality,
+                     exr_codec=exr_codec)
 
     links.new(img_node.outputs['Image'],
               output_color_node.inputs['Image'])
 
-def set_instance_segmentation(file_format: str='PNG'):
+def set_instance_segmentation(file_format: str='PNG',
+                              compression: Optional[int]=None):
+    """Saves a color per instance image per frame.
+
+    Args:
+        file_format (str): 'PNG' or 'WEBP' (blender 3.4+). WEBP is written at
+            quality 100, which blender encodes lossless. Lossy codecs would mix
+            the colors of the instances
+        compression (int): PNG compression in [0, 100]. Default blender's 15
+    """
+    if file_format not in (PNG_FILE_TYPE, WEBP_FILE_TYPE):
+        raise AttributeError("Instance segmentation needs a lossless format, PNG or WEBP")
+    if not has_file_format(file_format):
+        raise RuntimeError("Blender %s can not write %s images" % (bpy.app.version_string, file_format))
+
     scene = bpy.data.scenes[SCENE]
     scene = bpy.context.scene
 
@@ -175,15 +283,106 @@ def set_instance_segmentation(file_format: str='PNG'):
     output_color_node.file_slots[0].path = INST_SEG_FILE_NAME
     output_color_node.mute = True
 
-    if file_format == 'PNG':
-        output_color_node.format.file_format = PNG_FILE_TYPE 
-        output_color_node.format.color_mode = 'RGB'
-    else:
-        output_color_node.format.file_format = JPEG_FILE_TYPE 
+    set_image_format(output_color_node.format, file_format,
+                     color_mode='RGB',
+                     color_depth='8' if file_format == PNG_FILE_TYPE else None,
+                     compression=compression,
+                     quality=100 if file_format == WEBP_FILE_TYPE else None)
 
     links.new(img_node.outputs['Image'],
               output_color_node.inputs['Image'])
         
+def set_instance_ids():
+    """Saves exact instance ids as a uint16 single channel png per frame.
+
+    Every mesh gets a pass index (0 is the background) when rendering and
+    a json table per frame maps each id to the object name and shape type.
+    Use shapes3d.annotations to decode them.
+
+    Ids are only exact without view transform. Blender versions with per
+    output color management (format.color_management, not in 2.82) override
+    it in the output. Older ones need the scene view transform set to 'Raw',
+    else RuntimeError is raised instead of writing corrupted ids.
+    """
+    scene = bpy.data.scenes[SCENE]
+    has_override = 'color_management' in bpy.types.ImageFormatSettings.bl_rna.properties
+    if not has_override and scene.view_settings.view_transform != 'Raw':
+        raise RuntimeError("Instance ids need the scene view transform 'Raw' in blender %s, "
+                           "it has no per output color management" % bpy.app.version_string)
+
+    bpy.context.window.scene = scene
+    scene.use_nodes = True
+    scene.view_layers['View Layer'].use_pass_object_index = True
+    tree = scene.node_tree
+
+    links = tree.links
+    if COLOR_IMG_NODE in tree.nodes.keys():
+        img_node = tree.nodes[COLOR_IMG_NODE]
+    else:
+        img_node = tree.nodes.new(IMAGE_NODE_TYPE)
+        img_node.name = COLOR_IMG_NODE 
+
+    # 16 bits png maps [0, 1] to [0, 65535]
+    if INST_ID_NORM_NODE in tree.nodes.keys():
+        norm_node = tree.nodes[INST_ID_NORM_NODE]
+    else:
+        norm_node = tree.nodes.new(MATH_NODE_TYPE)
+        norm_node.name = INST_ID_NORM_NODE
+    norm_node.operation = 'DIVIDE'
+    norm_node.inputs[1].default_value = MAX_INSTANCE_ID
+
+    if OUTPUT_INST_ID_NODE in tree.nodes.keys():
+        output_node = tree.nodes[OUTPUT_INST_ID_NODE]
+    else:
+        output_node = tree.nodes.new(OUTPUT_NODE_TYPE)
+        output_node.name = OUTPUT_INST_ID_NODE
+    output_node.file_slots[0].path = INST_ID_FILE_NAME
+    output_node.format.file_format = PNG_FILE_TYPE
+    output_node.format.color_mode = 'BW'
+    output_node.format.color_depth = '16'
+    # Ids have to be written without view transform
+    if has_override:
+        output_node.format.color_management = 'OVERRIDE'
+        output_node.format.view_settings.view_transform = 'Raw'
+
+    links.new(img_node.outputs['IndexOB'], norm_node.inputs[0])
+    links.new(norm_node.outputs['Value'], output_node.inputs['Image'])
+
+def unset_instance_ids():
+    scene = bpy.data.scenes[SCENE]
+    tree = scene.node_tree
+    for name in [OUTPUT_INST_ID_NODE, INST_ID_NORM_NODE]:
+        if name in tree.nodes.keys():
+            tree.nodes.remove(tree.nodes[name])
+
+def assign_instance_ids() -> dict:
+    """Sets the pass index of every mesh in the scene sorted by name.
+
+    Returns:
+        dict: id -> {"name": object name, "type": shape type}
+    """
+    table = {}
+    meshes = _get_sorted_meshes()
+    if len(meshes) > MAX_INSTANCE_ID:
+        raise RuntimeError("Only %d instances are supported" % MAX_INSTANCE_ID)
+
+    for i, ob in enumerate(meshes, 1):
+        # Writing the same value still tags the object as changed
+        if ob.pass_index != i:
+            ob.pass_index = i
+        table[i] = {"name": ob.name, "type": get_shape_type(ob.name)}
+    return table
+
+def _get_sorted_meshes() -> list:
+    return sorted((ob for ob in bpy.data.scenes[SCENE].objects if ob.type == 'MESH'),
+                  key=lambda ob: ob.name)
+
+def save_instance_id_table(table: dict, path: str, file_id: int):
+    path = Path(bpy.path.abspath(path))
+    file_path = path / "{}{:04d}.json".format(INST_ID_TABLE_FILE_NAME, file_id)
+    with open(file_path, "w") as f:
+        json.dump(table, f)
+
 def unset_instance_segmentation():
     if has_instance_segmentation_map():
         bpy.data.materials.remove(bpy.data.materials[SEGMENTATION_MAT])
@@ -201,7 +400,20 @@ def uset_depth_map():
     if Z_NORM_NODE in tree.nodes.keys():
         tree.nodes.remove(tree.nodes[Z_NORM_NODE])
 
-def set_depth_map(include_png: bool = False):
+def set_depth_map(include_png: bool = False,
+                  exr_codec: Optional[str] = None,
+                  exr_color_depth: str = '32',
+                  png_color_depth: str = '8',
+                  png_compression: Optional[int] = None):
+    """Saves the depth in meters as EXR per frame.
+
+    Args:
+        include_png (bool): Also save the depth normalized per frame as png
+        exr_codec (str): EXR codec, see EXR_CODECS. Default blender's ZIP
+        exr_color_depth (str): '32' float or '16' half float
+        png_color_depth (str): '8' or '16' bits of the png
+        png_compression (int): PNG compression in [0, 100]. Default blender's 15
+    """
     color_scene = bpy.data.scenes[SCENE]
     bpy.context.window.scene = color_scene
     color_scene.use_nodes = True
@@ -222,7 +434,9 @@ def set_depth_map(include_png: bool = False):
     else:
         output_node = tree.nodes.new(OUTPUT_NODE_TYPE)
         output_node.name = OUTPUT_Z_NODE
-    output_node.format.file_format = EXR_FILE_TYPE
+    set_image_format(output_node.format, EXR_FILE_TYPE,
+                     color_depth=exr_color_depth,
+                     exr_codec=exr_codec)
     output_node.file_slots[0].path = DEPTH_FILE_NAME
 
     links.new(img_node.outputs['Depth'],
@@ -235,9 +449,11 @@ def set_depth_map(include_png: bool = False):
         else:
             output_png_node = tree.nodes.new(OUTPUT_NODE_TYPE)
             output_png_node.name = OUTPUT_Z_NODE_PNG
-        output_png_node.format.file_format = PNG_FILE_TYPE
+        set_image_format(output_png_node.format, PNG_FILE_TYPE,
+                         color_mode="BW",
+                         color_depth=png_color_depth,
+                         compression=png_compression)
         output_png_node.file_slots[0].path = DEPTH_PNG_FILE_NAME
-        output_png_node.format.color_mode = "BW"
 
 
         # Normalizer
@@ -257,7 +473,8 @@ def get_2d_bounding_boxes(save_txt: Optional[bool]=False,
                           file_id: Optional[int]=None,
                           bbox_format: Optional[str]='YOLO_ABS',
                           quick: bool=False,
-                          clip_to_frame: Optional[bool]=True) -> list:
+                          clip_to_frame: Optional[bool]=True,
+                          analytic: bool=False) -> list:
     """Returns the bounding box of the objects.
 
     Returns the bounding boxes of the objects in the scene and if 
@@ -277,6 +494,10 @@ def get_2d_bounding_boxes(save_txt: Optional[bool]=False,
         quick (bool): approximates the 2d bounding box using
             the 3d bounding box. It is not recommended to use quick option.
             It heavily depends on the rotation and 3D shape of the object.
+        analytic (bool): computes the bounding box of shapes3d shapes from their
+            parameters (spheres, cylinders and cones exactly, cuboids and planes
+            from their corners) and of any other mesh from its cached convex hull.
+            Falls back to all vertices if an object crosses the camera plane.
         
     Returns: List(name, centre x, centre y, width, height)
         name: of mesh
@@ -290,45 +511,33 @@ def get_2d_bounding_boxes(save_txt: Optional[bool]=False,
 
     to_cam = np.array(cam.matrix_world.inverted().normalized())
 
-    # Get output img
-    im_width = scene.render.resolution_x
-    im_height = scene.render.resolution_y
+    # Get output img, cropped to the render region if any
+    region = get_render_region()
+    if region is None:
+        im_width = scene.render.resolution_x
+        im_height = scene.render.resolution_y
+    else:
+        im_width = region[2] - region[0]
+        im_height = region[3] - region[1]
+
+    # Perspective transformation
+    K = get_region_intrinsic_matrix()
 
     for ob in bpy.data.objects:
         if ob.type != 'MESH':
             continue 
 
-        if quick:
-            verts = ob.bound_box
-            verts = np.array([list(v) + [1,] for v in verts]).T
-        else:
-            verts = ob.data.vertices
-            verts = np.array([list(v.co) + [1,] for v in verts]).T
-
-        # Get transformations
-        to_ob = np.array(ob.matrix_world.normalized())
-
-        # Move corners to ob and to cam view
-        verts = to_ob @ verts # to ob
-        verts = to_cam @ verts # to cam
-
-        # Perspective transformation
-        K = get_intrinsic_matrix()
+        box = _get_analytic_bbox(ob, to_cam, K) if analytic else None
+        if box is None:
+            box = _get_vertices_bbox(ob, to_cam, K, quick, clip_to_frame,
+                                     im_width, im_height)
+        elif clip_to_frame:
+            box = _clip_bbox(box, im_width, im_height)
 
-        verts = K @ verts[:3]
-        verts /= verts[2]
-
-        if clip_to_frame:
-            filt = (0 < verts[0]) & (verts[0] < im_width-1) & (0 < verts[1]) & (verts[1] < im_height-1)
-            verts = verts[:, filt]
-
-        if len(verts) == 0 or verts.size == 0:
-            continue 
+        if box is None:
+            continue
 
-        min_x = int(round(verts[0].min(), 0))
-        max_x = int(round(verts[0].max(), 0))
-        min_y = int(round(verts[1].min(), 0))
-        max_y = int(round(verts[1].max(), 0))
+        min_x, max_x, min_y, max_y = [int(round(v, 0)) for v in box]
 
         if max_x - min_x < 1 or max_y - min_y < 1:
             continue
@@ -363,9 +572,9 @@ def get_2d_bounding_boxes(save_txt: Optional[bool]=False,
 
         with open(file_path, "w") as f:
             if bbox_format == 'YOLO_ABS':
-                f.write("object_name, min_x, min_y, max_x, max_y")
+                f.write("object_name centre_x_px centre_y_px width_px height_px\n")
             elif bbox_format == 'YOLO':
-                f.write("object name, centre x, centre y, width, height")
+                f.write("object_name centre_x centre_y width height\n")
             for bbox in bboxes:
                 bbox = [str(el) for el in bbox]
                 f.write(" ".join(bbox))
@@ -373,6 +582,157 @@ def get_2d_bounding_boxes(save_txt: Optional[bool]=False,
 
     return bboxes
 
+def _get_vertices_bbox(ob: bpy.types.Object,
+                       to_cam: np.ndarray,
+                       K: np.ndarray,
+                       quick: bool,
+                       clip_to_frame: bool,
+                       im_width: int,
+                       im_height: int) -> Optional[Tuple[float, float, float, float]]:
+    """Returns (min_x, max_x, min_y, max_y) projecting the vertices of the object."""
+    if quick:
+        verts = np.array([list(v) for v in ob.bound_box])
+        to_ob = np.array(ob.matrix_world)
+        verts = verts @ to_ob[:3, :3].T + to_ob[:3, 3]
+    else:
+        verts = _get_world_points(ob, VERTICES)
+
+    # Only the camera dependent part is computed per frame
+    verts = verts @ to_cam[:3, :3].T + to_cam[:3, 3] # to cam
+
+    verts = K @ verts.T
+    verts /= verts[2]
+
+    if clip_to_frame:
+        filt = (0 < verts[0]) & (verts[0] < im_width-1) & (0 < verts[1]) & (verts[1] < im_height-1)
+        verts = verts[:, filt]
+
+    if len(verts) == 0 or verts.size == 0:
+        return None
+
+    return verts[0].min(), verts[0].max(), verts[1].min(), verts[1].max()
+
+def _get_analytic_bbox(ob: bpy.types.Object,
+                       to_cam: np.ndarray,
+                       K: np.ndarray) -> Optional[Tuple[float, float, float, float]]:
+    """Returns (min_x, max_x, min_y, max_y) from the primitive of the object.
+
+    Returns None if the object is not fully in front of the camera.
+    """
+    to_view = to_cam @ np.array(ob.matrix_world)
+    linear = to_view[:3, :3]
+    primitive = ob.get(PRIMITIVE_PROPERTY)
+
+    if not primitive:
+        points = _get_world_points(ob, HULL)
+        uv = project_points(K, points @ to_cam[:3, :3].T + to_cam[:3, 3])
+        if uv is None:
+            return None
+        return uv[:, 0].min(), uv[:, 0].max(), uv[:, 1].min(), uv[:, 1].max()
+    elif primitive["type"] == "BOX":
+        z = primitive["size_z"] / 2
+        points = np.array([(x, y, sz*z) for x in (-0.5, 0.5)
+                                        for y in (-0.5, 0.5)
+                                        for sz in (-1, 1)])
+    elif primitive["type"] == "SPHERE":
+        radius = primitive["radius"] * np.linalg.norm(linear, axis=0).max()
+        x_ratios, y_ratios = circle_ratio_extent(to_view[None, :3, 3], [radius])
+        if np.isnan(x_ratios).any():
+            return None
+        return tuple(ratio_extent_to_pixels(K, x_ratios, y_ratios)[0])
+    elif primitive["type"] == "FRUSTUM":
+        # Silhouette of cylinders and cones is bounded by their two rims
+        half = primitive["height"] / 2
+        centres = (to_view @ np.array([[0, 0, -half, 1], [0, 0, half, 1]]).T).T[:, :3]
+        axis = linear[:, 2] / np.linalg.norm(linear[:, 2])
+        radii = np.array([primitive["radius1"], primitive["radius2"]])
+        radii = radii * np.linalg.norm(linear[:, 0])
+        x_ratios, y_ratios = circle_ratio_extent(centres, radii, np.stack([axis, axis]))
+        if np.isnan(x_ratios).any():
+            return None
+        boxes = ratio_extent_to_pixels(K, x_ratios, y_ratios)
+        return (boxes[:, 0].min(), boxes[:, 1].max(),
+                boxes[:, 2].min(), boxes[:, 3].max())
+    else:
+        raise AttributeError("Unknown primitive %s" % primitive["type"])
+
+    points = points @ linear.T + to_view[:3, 3]
+    uv = project_points(K, points)
+    if uv is None:
+        return None
+    return uv[:, 0].min(), uv[:, 0].max(), uv[:, 1].min(), uv[:, 1].max()
+
+def _get_hull_vertices(mesh: bpy.types.Mesh) -> np.ndarray:
+    """Returns (N, 3) vertices of the convex hull of the mesh in object coordinates.
+
+    Hulls are cached per mesh datablock and recomputed if the number of
+    vertices of the mesh changes.
+    """
+    key = mesh.as_pointer()
+    num_verts = len(mesh.vertices)
+    cached = _HULL_CACHE.get(key, None)
+    if cached is None or cached[0] != num_verts:
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        hull = bmesh.ops.convex_hull(bm, input=bm.verts)
+        verts = [el.co[:] for el in hull["geom"] if isinstance(el, bmesh.types.BMVert)]
+        if not verts:
+            # Flat meshes have no hull
+            verts = [v.co[:] for v in bm.verts]
+        bm.free()
+        cached = (num_verts, np.array(verts, dtype=np.float64).reshape(-1, 3))
+        _HULL_CACHE[key] = cached
+    return cached[1]
+
+def _get_world_points(ob: bpy.types.Object, kind: str) -> np.ndarray:
+    """Returns (N, 3) float32 world space vertices or hull vertices of the object.
+
+    Objects of a world do not move while the camera does, so points are
+    cached per object and only computed again if its transform, mesh
+    datablock or number of vertices change. Call clear_geometry_caches after
+    editing the vertices of a mesh in place.
+    """
+    mesh = ob.data
+    matrix = np.array(ob.matrix_world, dtype=np.float64)
+    key = (ob.as_pointer(), kind)
+    state = (mesh.as_pointer(), len(mesh.vertices))
+    cached = _GEOMETRY_CACHE.get(key, None)
+    if cached is not None and cached[0] == state and np.array_equal(cached[1], matrix):
+        return cached[2]
+
+    if kind == HULL:
+        points = _get_hull_vertices(mesh)
+    else:
+        points = np.empty(len(mesh.vertices)*3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", points)
+        points = points.reshape(-1, 3)
+    points = np.ascontiguousarray(points @ matrix[:3, :3].T + matrix[:3, 3], dtype=np.float32)
+    _GEOMETRY_CACHE[key] = (state, matrix, points)
+    return points
+
+def get_world_vertices(ob: bpy.types.Object) -> np.ndarray:
+    """Returns the cached (N, 3) float32 world space vertices of a mesh object."""
+    return _get_world_points(ob, VERTICES)
+
+def clear_geometry_caches():
+    """Clears the cached hulls and world space points of meshes.
+
+    Needed when a new .blend file is loaded, as pointers are reused, or
+    after editing mesh vertices in place.
+    """
+    _HULL_CACHE.clear()
+    _GEOMETRY_CACHE.clear()
+
+def _clip_bbox(box: Tuple[float, float, float, float],
+               im_width: int,
+               im_height: int) -> Optional[Tuple[float, float, float, float]]:
+    """Clips (min_x, max_x, min_y, max_y) to the frame or None if it is outside."""
+    min_x, max_x, min_y, max_y = box
+    if max_x <= 0 or min_x >= im_width-1 or max_y <= 0 or min_y >= im_height-1:
+        return None
+    return (max(min_x, 0), min(max_x, im_width-1),
+            max(min_y, 0), min(max_y, im_height-1))
+
 def plot_2d_bboxes(bboxes: List[List],
                    path: str,
                    file_id: Optional[int]=None,
@@ -464,6 +824,86 @@ def set_image_resolution(width_px: int, height_px: int):
     bpy.data.scenes[SCENE].render.resolution_x = width_px
     bpy.data.scenes[SCENE].render.resolution_y = height_px
 
+def set_render_region(box: Sequence[float], margin: float=0) -> Tuple[int, int, int, int]:
+    """Renders only a region of the image, the outputs are cropped to it.
+
+    Args:
+        box (list): [min_x, min_y, max_x, max_y] in px of the full image,
+            e.g. a box of get_2d_bounding_boxes
+        margin (float): px added to each side of the box
+
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y) px region, clipped to the image
+            and rounded to whole pixels
+    """
+    scene = bpy.data.scenes[SCENE]
+    width = scene.render.resolution_x
+    height = scene.render.resolution_y
+    min_x = int(np.clip(np.floor(box[0] - margin), 0, width - 1))
+    min_y = int(np.clip(np.floor(box[1] - margin), 0, height - 1))
+    max_x = int(np.clip(np.ceil(box[2] + margin), min_x + 1, width))
+    max_y = int(np.clip(np.ceil(box[3] + margin), min_y + 1, height))
+
+    # Blender's border is relative to the image and its y goes upwards
+    scene.render.border_min_x = min_x / width
+    scene.render.border_max_x = max_x / width
+    scene.render.border_min_y = 1 - max_y / height
+    scene.render.border_max_y = 1 - min_y / height
+    scene.render.use_border = True
+    scene.render.use_crop_to_border = True
+    return min_x, min_y, max_x, max_y
+
+def unset_render_region():
+    bpy.data.scenes[SCENE].render.use_border = False
+
+def get_render_region() -> Optional[Tuple[int, int, int, int]]:
+    """Returns the (min_x, min_y, max_x, max_y) px region set with
+    set_render_region or None if the full image is rendered."""
+    scene = bpy.data.scenes[SCENE]
+    if not scene.render.use_border or not scene.render.use_crop_to_border:
+        return None
+    width = scene.render.resolution_x
+    height = scene.render.resolution_y
+    return (int(round(scene.render.border_min_x * width)),
+            int(round((1 - scene.render.border_max_y) * height)),
+            int(round(scene.render.border_max_x * width)),
+            int(round((1 - scene.render.border_min_y) * height)))
+
+def get_region_intrinsic_matrix() -> np.ndarray:
+    """Returns the intrinsic matrix of the rendered images, moving the
+    principal point to the origin of the render region if any."""
+    K = get_intrinsic_matrix()
+    region = get_render_region()
+    if region is not None:
+        K[0, 2] -= region[0]
+        K[1, 2] -= region[1]
+    return K
+
+def save_region_intrinsic_matrix(path: str, file_id: int):
+    """Saves the 3x3 intrinsic matrix of the region into Intrinsic_<file_id>.txt."""
+    path = Path(bpy.path.abspath(path))
+    np.savetxt(path / "{}{:04d}.txt".format(INTRINSIC_FILE_NAME, file_id),
+               get_region_intrinsic_matrix())
+
+def get_object_rois(analytic: bool=True) -> Dict[str, List[float]]:
+    """Returns object name -> [min_x, min_y, max_x, max_y] px box in the full
+    image of the visible objects, projecting every object once."""
+    region = get_render_region()
+    unset_render_region()
+    try:
+        bboxes = get_2d_bounding_boxes(analytic=analytic)
+    finally:
+        if region is not None:
+            set_render_region(region)
+    return {name: [cx - w/2, cy - h/2, cx + w/2, cy + h/2]
+            for name, cx, cy, w, h in bboxes}
+
+def get_object_roi(name: str, analytic: bool=True) -> Optional[List[float]]:
+    """Returns the [min_x, min_y, max_x, max_y] px box of an object in the
+    full image or None if it is not visible. Use get_object_rois for
+    several objects."""
+    return get_object_rois(analytic).get(name)
+
 def remove_nodes(scene: bpy.types.Scene):
     tree = scene.node_tree
     for n in tree.nodes:
@@ -499,6 +939,9 @@ def set_image_path(path: Optional[str]=None, file_id: Optional[int]=None):
     if has_instance_segmentation_map():
         tree.nodes[OUTPUT_INST_SEG_NODE].base_path = path
 
+    if has_instance_ids():
+        tree.nodes[OUTPUT_INST_ID_NODE].base_path = path
+
 def has_color()-> bool:
     return _has_node(SCENE, OUTPUT_COLOR_NODE)
 
@@ -508,16 +951,91 @@ def has_depth_map()-> bool:
 def has_norm_depth_map()-> bool:
     return _has_node(SCENE, OUTPUT_Z_NODE_PNG)
 
+def has_instance_ids()-> bool:
+    return _has_node(SCENE, OUTPUT_INST_ID_NODE)
+
 def has_instance_segmentation_map()-> bool:
     return SEGMENTATION_MAT in bpy.data.materials.keys()
 
+def set_persistent_data():
+    """Keeps the synced scene, BVH and shaders of Cycles between renders.
+
+    Only worth it when the scene does not change between frames, e.g. a
+    camera moving around a static scene. The segmentation pass then uses a
+    material override of the view layer instead of undoing its changes,
+    which would invalidate the persistent data every frame.
+    """
+    bpy.data.scenes[SCENE].render.use_persistent_data = True
+
+def unset_persistent_data():
+    bpy.data.scenes[SCENE].render.use_persistent_data = False
+
+def has_persistent_data() -> bool:
+    return bpy.data.scenes[SCENE].render.use_persistent_data
+
+def _get_material_values(material: bpy.types.Material) -> list:
+    """Returns the unlinked input values of the nodes of a material."""
+    if not material.use_nodes:
+        return [list(material.diffuse_color)]
+    values = []
+    for node in sorted(material.node_tree.nodes, key=lambda node: node.name):
+        for socket in node.inputs:
+            if socket.is_linked or not hasattr(socket, 'default_value'):
+                continue
+            value = socket.default_value
+            values.append(list(value) if hasattr(value, '__len__') else value)
+    return values
+
+def get_scene_fingerprint(content: bool=False) -> str:
+    """Returns a hash of everything in the scene but the cameras.
+
+    It covers the objects, their transforms, meshes, materials and pass
+    indices, and the world. Two equal fingerprints mean the renders only
+    differ by the camera.
+
+    Args:
+        content (bool): hash the vertices of the meshes and the node values
+            of the materials instead of the mesh datablocks and material
+            names. Slower, but equal scenes of different blender sessions get
+            the same hash, e.g. for RenderCache keys
+    """
+    scene = bpy.data.scenes[SCENE]
+    sha = hashlib.sha1()
+    for ob in sorted(scene.objects, key=lambda ob: ob.name):
+        if ob.type == 'CAMERA':
+            continue
+        item = [ob.name, ob.type, ob.hide_render, ob.pass_index,
+                [list(row) for row in ob.matrix_world],
+                [slot.material.name if slot.material else None
+                 for slot in ob.material_slots]]
+        if content:
+            item += [_get_material_values(slot.material)
+                     for slot in ob.material_slots if slot.material]
+        if ob.type == 'MESH' and content:
+            co = np.empty(len(ob.data.vertices)*3, dtype=np.float32)
+            ob.data.vertices.foreach_get("co", co)
+            item += [len(ob.data.polygons), hashlib.sha1(co.tobytes()).hexdigest()]
+        elif ob.type == 'MESH':
+            item += [ob.data.as_pointer(), len(ob.data.vertices), len(ob.data.polygons)]
+        elif ob.type == 'LIGHT':
+            item += [ob.data.type, ob.data.energy, list(ob.data.color)]
+        sha.update(repr(item).encode())
+    if scene.world is not None and scene.world.use_nodes:
+        background = scene.world.node_tree.nodes.get("Background", None)
+        if background is not None:
+            sha.update(repr(list(background.inputs[0].default_value)).encode())
+    return sha.hexdigest()
+
 def set_render_config(render: Optional[str]=None,
                       gpu: Optional[bool]=False,
                       image_resolution: Optional[Tuple[int, int]] = None,
                       max_bounces: Optional[int] = None,
                       tile_dim: Optional[Tuple[int, int]] = None,
                       samples: Optional[int] = None,
-                      headless: Optional[bool] = False):
+                      headless: Optional[bool] = False,
+                      threads: Optional[int] = None,
+                      adaptive_threshold: Optional[float] = None,
+                      time_limit: Optional[float] = None):
     """Sets the configuration for rendering in one function
 
     Args:
@@ -526,10 +1044,17 @@ def set_render_config(render: Optional[str]=None,
             render='Cycles' if render = None and gpu = True.
         image_resoluion (tuple): (width_px, height_px) tuple of ints in pixels
         max_bounces (int): Number of max bouces of ray (Cycles only)
-        tile_dim (int): (x,y) tuple of ints in pixels
+        tile_dim (int): (x,y) tuple of ints in pixels. Blender 3.0+ has square
+            tiles, tile_dim[0] sets their size, see has_tile_size
         samples (int): Number of samples in int (Cycles only)
         headless (bool): Configure blender to work headless (e.g. in a server). For
             now only supports CUDA GPUs.
+        threads (int): Number of CPU threads. If None, blender detects them.
+        adaptive_threshold (float): Noise threshold of Cycles adaptive sampling,
+            pixels stop sampling once they reach it. 0 disables adaptive sampling.
+            samples is then the max number of samples (Cycles only, blender 2.83+)
+        time_limit (float): Max seconds of path tracing per frame, 0 for no limit
+            (Cycles only, blender 3.0+)
     """
     if gpu and not render:
         render = CYCLES
@@ -565,17 +1090,57 @@ def set_render_config(render: Optional[str]=None,
     if max_bounces:
         bpy.context.scene.cycles.max_bounces = max_bounces
 
-    if tile_dim:
+    if tile_dim and has_tile_size():
+        bpy.context.scene.cycles.tile_size = tile_dim[0]
+    elif tile_dim:
         bpy.context.scene.render.tile_x = tile_dim[0]
         bpy.context.scene.render.tile_y = tile_dim[1]
 
+    if threads:
+        bpy.context.scene.render.threads_mode = 'FIXED'
+        bpy.context.scene.render.threads = threads
+
+    if adaptive_threshold is not None:
+        if not has_adaptive_sampling():
+            raise AttributeError("Adaptive sampling needs blender 2.83+, not %s" %
+                                 bpy.app.version_string)
+        bpy.context.scene.cycles.use_adaptive_sampling = adaptive_threshold > 0
+        if adaptive_threshold > 0:
+            bpy.context.scene.cycles.adaptive_threshold = adaptive_threshold
+
+    if time_limit is not None:
+        if not has_time_limit():
+            raise AttributeError("Render time limit needs blender 3.0+, not %s" %
+                                 bpy.app.version_string)
+        bpy.context.scene.cycles.time_limit = time_limit
+
+def has_adaptive_sampling() -> bool:
+    return hasattr(bpy.data.scenes[SCENE].cycles, 'adaptive_threshold')
+
+def has_time_limit() -> bool:
+    return hasattr(bpy.data.scenes[SCENE].cycles, 'time_limit')
+
+def has_tile_size() -> bool:
+    """Returns if tiles are square with cycles.tile_size (blender 3.0+)
+    instead of render.tile_x and tile_y."""
+    return hasattr(bpy.data.scenes[SCENE].cycles, 'tile_size')
+
 def render(path: Optional[str] = None,
            file_id: Optional[int]=None,
            include_bbox2d: Optional[bool]=False,
            save_bbox2d_to_txt: Optional[bool]=False,
            plot_bbox2d: Optional[bool]=False,
            bbox2d_quick: Optional[bool]=False,
-           bbox2d_clip_to_frame: Optional[bool]=True) -> List:
+           bbox2d_clip_to_frame: Optional[bool]=True,
+           bbox2d_analytic: Optional[bool]=False,
+           cache: Optional[RenderCache]=None,
+           cache_scene_state: Optional[object]=None,
+           annotation_sink: Optional[AnnotationSink]=None,
+           roi: Optional[Sequence[float]]=None,
+           roi_margin: float=0,
+           metadata: Optional[MetadataDB]=None,
+           metadata_split: Optional[str]=None,
+           metadata_coverage: Optional[float]=None) -> List:
     """Renders the scene with the values previously configured.
 
     This is the only way to render the instance segmentation. To render
@@ -589,6 +1154,21 @@ def render(path: Optional[str] = None,
         plot_bbox2d (bool): Save image with bboxes plotted.
         bbox2d_quick (bool): Use approximations to calculate bbox.
         bbox2d_clip_to_frame (bool): Do not allow bbox coords outside of image frame.
+        bbox2d_analytic (bool): Compute bboxes from shape parameters and convex hulls.
+        cache (RenderCache): If passed, frames rendered before with the same state
+            are copied from the cache instead of being rendered.
+        cache_scene_state: json serializable description of the scene (e.g. shape
+            parameters). Camera, render and output configuration are added to it.
+            Default the content fingerprint of the scene, see get_scene_fingerprint.
+        annotation_sink (AnnotationSink): Adds the bboxes of the frame to the sink.
+        roi (list): [min_x, min_y, max_x, max_y] px box of the full image. If passed,
+            only this region plus roi_margin is rendered and every output, bbox
+            and the Intrinsic_<file_id>.txt saved with them refer to the crop.
+        roi_margin (float): px added to each side of roi.
+        metadata (MetadataDB): Adds the camera and bboxes of the frame to the database.
+        metadata_split (str): split of the frame in the database, e.g. 'train'.
+        metadata_coverage (float): fraction of the image covered by shapes, stored
+            with the frame in the database.
 
     Returns:
         if include_bbox2d or save_bbox2d_to_txt is True, returns list of all
@@ -598,45 +1178,307 @@ def render(path: Optional[str] = None,
     if path or isinstance(file_id, int):
         set_image_path(path, file_id)
 
-    # Render color and depth
-    bpy.ops.render.render()
+    scene = bpy.data.scenes[SCENE]
 
-    bboxes = None
-    # Call this just after rendering color
-    if include_bbox2d or save_bbox2d_to_txt or plot_bbox2d: 
-        # if path is None but color image has one, use that one
-        if path is None and has_color():
-            path = tree.nodes[OUTPUT_COLOR_NODE].base_path
+    # The region is unset even if rendering fails, else it would crop the
+    # next renders
+    try:
+        if roi is not None:
+            set_render_region(roi, roi_margin)
+            if has_color():
+                save_region_intrinsic_matrix(scene.node_tree.nodes[OUTPUT_COLOR_NODE].base_path,
+                                             scene.frame_current)
+
+        if has_instance_ids():
+            table = assign_instance_ids()
+            save_instance_id_table(table,
+                                   scene.node_tree.nodes[OUTPUT_INST_ID_NODE].base_path,
+                                   scene.frame_current)
+
+        cached = False
+        if cache is not None:
+            # Without a description of the scene its content is hashed
+            if cache_scene_state is None:
+                cache_scene_state = get_scene_fingerprint(content=True)
+            cache_key = cache.key(cache_scene_state, get_render_state())
+            cached = cache.restore(cache_key,
+                                   bpy.path.abspath(scene.render.filepath),
+                                   scene.frame_current)
+
+        # Render color and depth
+        if not cached:
+            bpy.ops.render.render()
 
-        bboxes = get_2d_bounding_boxes(save_txt=save_bbox2d_to_txt,
-                                       path=path,
-                                       file_id=file_id,
-                                       quick=bbox2d_quick,
-                                       clip_to_frame=bbox2d_clip_to_frame)
+        bboxes = None
+        # Call this just after rendering color
+        if include_bbox2d or save_bbox2d_to_txt or plot_bbox2d or annotation_sink is not None \
+                or metadata is not None:
+            # if path is None but color image has one, use that one
+            if path is None and has_color():
+                path = scene.node_tree.nodes[OUTPUT_COLOR_NODE].base_path
+
+            bboxes = get_2d_bounding_boxes(save_txt=save_bbox2d_to_txt,
+                                           path=path,
+                                           file_id=file_id,
+                                           quick=bbox2d_quick,
+                                           clip_to_frame=bbox2d_clip_to_frame,
+                                           analytic=bbox2d_analytic)
+
+            if plot_bbox2d:
+                plot_2d_bboxes(bboxes, path=path, file_id=file_id)
+
+            if annotation_sink is not None:
+                add_to_annotation_sink(annotation_sink, bboxes)
+
+            if metadata is not None:
+                add_to_metadata(metadata, bboxes, split=metadata_split,
+                                coverage=metadata_coverage)
+
+        if has_instance_segmentation_map() and not cached and has_persistent_data():
+            render_instance_segmentation_override()
+        elif has_instance_segmentation_map() and not cached:
+            # Render Segmentation 
+            with UndoChanges():
+                scene = bpy.data.scenes[SCENE]
+                scene.node_tree.nodes[OUTPUT_INST_SEG_NODE].mute = False
+                if has_depth_map():
+                    scene.node_tree.nodes[OUTPUT_Z_NODE].mute = True
+
+                    if has_norm_depth_map():
+                        scene.node_tree.nodes[OUTPUT_Z_NODE_PNG].mute = True
+
+                if has_color():
+                    scene.node_tree.nodes[OUTPUT_COLOR_NODE].mute = True
+
+                if has_instance_ids():
+                    scene.node_tree.nodes[OUTPUT_INST_ID_NODE].mute = True
+
+                # For all objects unlink material
+                set_scene_into_instance_segmentation()
+
+                # Render again only instance segmentation
+                bpy.ops.render.render()
+
+        if cache is not None and not cached:
+            cache.store(cache_key, get_output_files(), scene.frame_current)
+    finally:
+        if roi is not None:
+            unset_render_region()
 
-        plot_2d_bboxes(bboxes, path=path, file_id=file_id)
+    return bboxes
 
-    if has_instance_segmentation_map():
-        # Render Segmentation 
-        with UndoChanges():
-            scene = bpy.data.scenes[SCENE]
-            scene.node_tree.nodes[OUTPUT_INST_SEG_NODE].mute = False
-            if has_depth_map():
-                scene.node_tree.nodes[OUTPUT_Z_NODE].mute = True
+def render_instance_segmentation_override():
+    """Renders only the instance segmentation with a material override.
 
-                if has_norm_depth_map():
-                    scene.node_tree.nodes[OUTPUT_Z_NODE_PNG].mute = True
+    Materials of the objects are not touched, so the scene synced by a
+    persistent data render stays valid. The mute state of the outputs is
+    restored afterwards.
+    """
+    scene = bpy.data.scenes[SCENE]
+    view_layer = scene.view_layers[VIEW_LAYER]
+    nodes = scene.node_tree.nodes
+    muted = {node.name: node.mute for node in nodes if node.bl_idname == OUTPUT_NODE_TYPE}
+    for name in muted:
+        nodes[name].mute = name != OUTPUT_INST_SEG_NODE
+    view_layer.material_override = bpy.data.materials[SEGMENTATION_MAT]
+    try:
+        bpy.ops.render.render()
+    finally:
+        view_layer.material_override = None
+        for name, mute in muted.items():
+            nodes[name].mute = mute
 
-            if has_color():
-                scene.node_tree.nodes[OUTPUT_COLOR_NODE].mute = True
+def add_to_annotation_sink(sink: AnnotationSink, bboxes: List[List]):
+    """Adds bboxes of the current frame in YOLO_ABS format to sink.
 
-            # For all objects unlink material
-            set_scene_into_instance_segmentation()
+    Instance ids follow assign_instance_ids and class ids are the index of
+    the shape type in sink.class_names. Boxes of types not in them are skipped.
+    """
+    scene = bpy.data.scenes[SCENE]
+    im_width = scene.render.resolution_x
+    im_height = scene.render.resolution_y
+    region = get_render_region()
+    if region is not None:
+        im_width = region[2] - region[0]
+        im_height = region[3] - region[1]
+    frame = scene.frame_current
+
+    ids = {ob.name: i for i, ob in enumerate(_get_sorted_meshes(), 1)}
+    class_ids = {name: i for i, name in enumerate(sink.class_names)}
+    bboxes = [bbox for bbox in bboxes if get_shape_type(bbox[0]) in class_ids]
+    names = [bbox[0] for bbox in bboxes]
+    boxes = np.array([bbox[1:] for bbox in bboxes], dtype=np.float32).reshape(-1, 4)
+    boxes = np.column_stack([boxes[:, :2] - boxes[:, 2:]/2,
+                             boxes[:, :2] + boxes[:, 2:]/2])
+
+    if has_color():
+        node = scene.node_tree.nodes[OUTPUT_COLOR_NODE]
+        file_name = Path(bpy.path.abspath(node.base_path)) / "{:s}{:04d}.{:s}".format(
+            node.file_slots[0].path, frame, node.format.file_format.lower())
+    else:
+        file_name = "{:04d}".format(frame)
 
-            # Render again only instance segmentation
-            bpy.ops.render.render()
+    sink.add(file_name, (im_width, im_height),
+             instance_ids=[ids.get(name, 0) for name in names],
+             class_ids=[class_ids[get_shape_type(name)] for name in names],
+             boxes=boxes)
 
-    return bboxes
+def add_to_metadata(db: MetadataDB,
+                    bboxes: Optional[List[List]]=None,
+                    environment: Optional[str]=None,
+                    split: Optional[str]=None,
+                    coverage: Optional[float]=None):
+    """Adds the camera and bboxes of the current frame to db.
+
+    Call it inside the render region, if any, after rendering: the visible
+    fraction of each object is read from the instance id map if rendered.
+
+    Args:
+        db (MetadataDB): database
+        bboxes (list): bboxes in YOLO_ABS format. Default computed for the current camera
+        environment (str): Default name of the folder of the color images
+        split (str): split of the frame, e.g. 'train'
+        coverage (float): fraction of the image covered by shapes
+    """
+    scene = bpy.data.scenes[SCENE]
+    if bboxes is None:
+        bboxes = get_2d_bounding_boxes(analytic=True)
+    if environment is None:
+        environment = Path(bpy.path.abspath(scene.node_tree.nodes[OUTPUT_COLOR_NODE].base_path)).name
+
+    im_width = scene.render.resolution_x
+    im_height = scene.render.resolution_y
+    region = get_render_region()
+    if region is not None:
+        im_width = region[2] - region[0]
+        im_height = region[3] - region[1]
+
+    frame = scene.frame_current
+    location, rotation, _ = bpy.data.objects[CAMERA].matrix_world.decompose()
+    db.add_frame(environment, frame, im_width, im_height, get_region_intrinsic_matrix(),
+                 tuple(location), tuple(rotation.to_euler('XYZ')),
+                 split=split, coverage=coverage)
+
+    ids = {ob.name: i for i, ob in enumerate(_get_sorted_meshes(), 1)}
+    names = [bbox[0] for bbox in bboxes]
+    boxes = np.array([bbox[1:] for bbox in bboxes], dtype=np.float64).reshape(-1, 4)
+    boxes = np.column_stack([boxes[:, :2] - boxes[:, 2:]/2,
+                             boxes[:, :2] + boxes[:, 2:]/2])
+    visible = get_object_visible_fractions()
+    db.add_boxes(environment, frame, names,
+                 [get_shape_type(name) for name in names],
+                 boxes, im_width, im_height,
+                 instance_ids=[ids.get(name, 0) for name in names],
+                 visible_fractions=None if visible is None else
+                 [visible.get(name, 0.0) for name in names])
+
+def get_object_visible_fractions() -> Optional[Dict[str, float]]:
+    """Returns object name -> fraction of the image covered by its visible
+    pixels in the instance id map of the current frame, or None if instance
+    ids are not rendered."""
+    if not has_instance_ids():
+        return None
+    scene = bpy.data.scenes[SCENE]
+    path = bpy.path.abspath(scene.node_tree.nodes[OUTPUT_INST_ID_NODE].base_path)
+    try:
+        return get_visible_fractions(*read_instance_ids(path, scene.frame_current))
+    except FileNotFoundError:
+        return None
+
+def get_render_state() -> dict:
+    """Returns the camera, render and output configuration that change the output."""
+    scene = bpy.data.scenes[SCENE]
+    cam = bpy.data.objects[CAMERA]
+    state = {
+        "camera": {
+            "matrix_world": [list(row) for row in cam.matrix_world],
+            "lens": cam.data.lens,
+            "sensor_width": cam.data.sensor_width,
+            "clip": (cam.data.clip_start, cam.data.clip_end),
+        },
+        "render": {
+            "engine": scene.render.engine,
+            "resolution": (scene.render.resolution_x,
+                           scene.render.resolution_y,
+                           scene.render.resolution_percentage),
+            "film_transparent": scene.render.film_transparent,
+            "samples": scene.cycles.samples,
+            "max_bounces": scene.cycles.max_bounces,
+            # Not in every blender version
+            "adaptive_threshold": (scene.cycles.adaptive_threshold
+                                   if has_adaptive_sampling() and scene.cycles.use_adaptive_sampling
+                                   else 0),
+            "time_limit": scene.cycles.time_limit if has_time_limit() else 0,
+            "region": get_render_region(),
+        },
+        "outputs": {},
+    }
+    if scene.use_nodes:
+        for node in scene.node_tree.nodes:
+            if node.bl_idname != OUTPUT_NODE_TYPE:
+                continue
+            state["outputs"][node.name] = {
+                "path": node.file_slots[0].path,
+                "file_format": node.format.file_format,
+                "color_mode": node.format.color_mode,
+                "color_depth": node.format.color_depth,
+                "compression": node.format.compression,
+                "quality": node.format.quality,
+                "exr_codec": node.format.exr_codec,
+                "mute": node.mute,
+            }
+    state["segmentation"] = has_instance_segmentation_map()
+    if scene.render.use_multiview:
+        state["views"] = {view.name: view.camera_suffix
+                          for view in scene.render.views if view.use}
+        state["rig"] = {name: [list(row) for row in cam.matrix_world]
+                        for name, cam in get_rig_cameras().items()}
+    return state
+
+def get_output_files(file_id: Optional[int]=None) -> List[str]:
+    """Returns the files written by the output nodes for file_id.
+
+    Args:
+        file_id (int): frame of the files. Default current frame
+    """
+    scene = bpy.data.scenes[SCENE]
+    if file_id is None:
+        file_id = scene.frame_current
+
+    files = set()
+    if scene.use_nodes:
+        for node in scene.node_tree.nodes:
+            if node.bl_idname != OUTPUT_NODE_TYPE:
+                continue
+            folder = Path(bpy.path.abspath(node.base_path))
+            name = "{}{:04d}".format(node.file_slots[0].path, file_id)
+            # Multi-view renders add the suffix of the view
+            for pattern in (name + ".*", name + "_*.*"):
+                files.update(str(f) for f in folder.glob(pattern))
+    return sorted(files)
+
+def get_output_paths(file_id: Optional[int]=None, view_suffix: str="") -> List[Path]:
+    """Returns the files the output nodes write for file_id, whether they
+    exist or not.
+
+    Args:
+        file_id (int): frame of the files. Default current frame
+        view_suffix (str): file suffix of a view of a camera rig, e.g. '_left'
+    """
+    scene = bpy.data.scenes[SCENE]
+    if file_id is None:
+        file_id = scene.frame_current
+
+    paths = []
+    if scene.use_nodes:
+        for node in scene.node_tree.nodes:
+            if node.bl_idname != OUTPUT_NODE_TYPE:
+                continue
+            file_format = node.format.file_format
+            ext = FILE_EXTENSIONS.get(file_format, "." + file_format.lower())
+            paths.append(Path(bpy.path.abspath(node.base_path)) / "{}{:04d}{}{}".format(
+                node.file_slots[0].path, file_id, view_suffix, ext))
+    return paths
 
 def set_scene_into_instance_segmentation(scene_name: str = SCENE):
     if not has_instance_segmentation_map():
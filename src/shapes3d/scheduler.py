@@ -0,0 +1,147 @@
+"""Implements a scheduler of the Cycles sampling budget to render datasets
+at a target throughput.
+
+Frames use adaptive sampling, pixels stop sampling once their noise is
+under a threshold, and a time limit per frame. The scheduler measures the
+time of each frame and moves both so the mean frame time meets the target
+frames per hour. The noise of a pixel falls with the square root of its
+samples, so the render time scales with the inverse square of the
+threshold and the threshold is corrected by the square root of the ratio
+between measured and target times. The time limit is scaled by the
+inverse of the ratio, it tightens while frames are slow and relaxes back
+when they are fast.
+
+Adaptive sampling needs blender 2.83+ and the time limit blender 3.0+,
+older versions only adapt what they support.
+
+Example:
+    scheduler = SamplingScheduler(frames_per_hour=3600, log_path="out/sampling.jsonl")
+    for file_id, (location, rotation) in enumerate(poses, 1):
+        with scheduler.frame(file_id):
+            env.render(folder, file_id, location, rotation)
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+import bpy
+import numpy as np
+
+from shapes3d.render import has_adaptive_sampling
+from shapes3d.render import has_time_limit
+from shapes3d.render import set_render_config
+
+SCENE = 'Scene'
+INITIAL_THRESHOLD = 0.01
+MIN_THRESHOLD = 0.001
+MAX_THRESHOLD = 0.5
+# Frames of the moving mean of frame times
+WINDOW = 8
+# Range of the time limit of the path tracing as multiples of the target
+# frame time
+TIME_LIMIT_FACTOR = 1.5
+MIN_TIME_LIMIT_FACTOR = 0.25
+
+
+class SamplingScheduler:
+    """Adjusts the adaptive sampling threshold to meet a target throughput.
+
+    Args:
+        frames_per_hour (float): target throughput
+        threshold (float): initial noise threshold
+        min_threshold (float): lowest threshold, the best quality allowed
+        max_threshold (float): highest threshold, the worst quality allowed
+        window (int): frames averaged to adjust the threshold
+        time_limit_factor (float): initial and max time limit of the path
+            tracing of a frame, as a multiple of the target frame time. 0 for
+            no limit
+        min_time_limit_factor (float): min time limit, as a multiple of the
+            target frame time
+        log_path (str): jsonl file where the settings and time of each frame
+            are appended
+    """
+    def __init__(self,
+                 frames_per_hour: float,
+                 threshold: float = INITIAL_THRESHOLD,
+                 min_threshold: float = MIN_THRESHOLD,
+                 max_threshold: float = MAX_THRESHOLD,
+                 window: int = WINDOW,
+                 time_limit_factor: float = TIME_LIMIT_FACTOR,
+                 min_time_limit_factor: float = MIN_TIME_LIMIT_FACTOR,
+                 log_path: Optional[Union[str, Path]] = None):
+        self._target = 3600 / frames_per_hour
+        self._threshold = threshold
+        self._min_threshold = min_threshold
+        self._max_threshold = max_threshold
+        self._window = window
+        self._time_limit = self._target * time_limit_factor
+        self._min_time_limit = self._target * min(min_time_limit_factor, time_limit_factor)
+        self._max_time_limit = self._time_limit
+        self._times = []
+        self._log_path = Path(log_path) if log_path else None
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    @property
+    def time_limit(self) -> float:
+        return self._time_limit
+
+    def apply(self):
+        """Sets the current threshold and time limit in blender."""
+        set_render_config(
+            adaptive_threshold=self._threshold if has_adaptive_sampling() else None,
+            time_limit=self._time_limit if has_time_limit() else None)
+
+    def update(self, seconds: float, file_id: Optional[int] = None, frames: int = 1):
+        """Records the time of a render and adjusts the threshold and time limit.
+
+        Args:
+            seconds (float): time of the render
+            file_id (int): id of the first frame, for the log
+            frames (int): frames rendered, e.g. the views of a camera rig
+        """
+        self._log(seconds, file_id, frames)
+        self._times.append(seconds / frames)
+        self._times = self._times[-self._window:]
+
+        ratio = np.mean(self._times) / self._target
+        self._threshold = float(np.clip(self._threshold * np.sqrt(ratio),
+                                        self._min_threshold, self._max_threshold))
+        if self._max_time_limit > 0:
+            self._time_limit = float(np.clip(self._time_limit / ratio,
+                                             self._min_time_limit, self._max_time_limit))
+
+    @contextmanager
+    def frame(self, file_id: Optional[int] = None, frames: int = 1):
+        """Applies the settings before rendering and updates them with the time
+        of the block."""
+        self.apply()
+        start = time.perf_counter()
+        yield self
+        self.update(time.perf_counter() - start, file_id, frames)
+
+    def _log(self, seconds: float, file_id: Optional[int], frames: int):
+        if self._log_path is None:
+            return
+        scene = bpy.data.scenes[SCENE]
+        entry = {"file_id": file_id,
+                 "frames": frames,
+                 "seconds": seconds,
+                 "adaptive_threshold": self._threshold if has_adaptive_sampling() else None,
+                 "time_limit": self._time_limit if has_time_limit() else None,
+                 "samples": scene.cycles.samples,
+                 "min_samples": getattr(scene.cycles, "adaptive_min_samples", None)}
+        self._log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._log_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def get_throughput(self) -> float:
+        """Returns the frames per hour of the last window of frames."""
+        if not self._times:
+            return 0.0
+        return 3600 / float(np.mean(self._times))
@@ -0,0 +1,175 @@
+"""Implements a long lived render server running inside blender.
+
+Blender, shapes3d and the world are set up once and jobs are received
+over a local TCP socket, so many small jobs do not pay the start up of a
+new blender process each. Jobs and replies are json objects, one per line.
+
+Start a server:
+    blender --background --python-expr "import shapes3d.server as s; s.main()" -- --port 5555
+
+Jobs:
+    {"id": 1, "op": "ping"}
+    {"id": 2, "op": "render", "specs": "specs.npz", "index": 0, "folder": "out/0",
+     "poses": [[[x, y, z], [rx, ry, rz]], ...], "first_file_id": 1}
+    {"id": 3, "op": "close"}
+
+"poses" is optional, by default the poses of the scene spec are rendered.
+A render job replies {"id", "file_id", "files"} for every frame as soon as
+it is written and {"id", "done": true} at the end. Errors reply
+{"id", "error"} and the server keeps serving.
+"""
+
+import argparse
+import json
+import socket
+import sys
+import traceback
+
+import shapes3d as shps
+from shapes3d.worlds import SimpleWorld
+
+HOST = "127.0.0.1"
+PORT = 5555
+PING = "ping"
+RENDER = "render"
+CLOSE = "close"
+
+
+class ClientDisconnected(Exception):
+    """Raised when a reply can not be written to the client."""
+
+
+class RenderServer:
+    """Serves render jobs over a socket with a single warm world.
+
+    Args:
+        host (str): address to listen to. Local by default
+        port (int): port to listen to
+        world_kwargs (dict): arguments of SimpleWorld
+        renderer_kwargs (dict): arguments of SimpleWorld.set_renderer
+    """
+    def __init__(self,
+                 host: str = HOST,
+                 port: int = PORT,
+                 world_kwargs: dict = None,
+                 renderer_kwargs: dict = None):
+        self._address = (host, port)
+        self._world_kwargs = world_kwargs or {}
+        self._world = None
+        self._world_dims = None
+        self._renderer_kwargs = renderer_kwargs
+        self._specs = {}
+        self._running = False
+
+    def serve_forever(self):
+        """Accepts clients one after the other until a close job is received."""
+        self._running = True
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(self._address)
+            sock.listen()
+            print("shapes3d render server listening on %s:%d" % self._address, flush=True)
+            while self._running:
+                conn, address = sock.accept()
+                try:
+                    with conn, conn.makefile("rwb") as stream:
+                        self._serve_client(stream)
+                except (ClientDisconnected, OSError) as e:
+                    # Client gone, e.g. it disconnected during a job
+                    print("Dropped client %s:%d: %r" % (address[0], address[1], e), flush=True)
+
+        if self._world is not None:
+            self._world.close()
+
+    def _serve_client(self, stream):
+        for line in stream:
+            if not line.strip():
+                continue
+            job = {}
+            try:
+                job = json.loads(line)
+                op = job.get("op", RENDER)
+                if op == PING:
+                    self._reply(stream, {"id": job.get("id"), "ok": True})
+                elif op == RENDER:
+                    self._render(job, stream)
+                elif op == CLOSE:
+                    self._running = False
+                    self._reply(stream, {"id": job.get("id"), "ok": True})
+                    return
+                else:
+                    raise AttributeError("Unknown op %s" % op)
+            except ClientDisconnected:
+                # Replying would fail again
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                self._reply(stream, {"id": job.get("id"), "error": repr(e)})
+
+    @staticmethod
+    def _reply(stream, message: dict):
+        try:
+            stream.write((json.dumps(message) + "\n").encode())
+            stream.flush()
+        except OSError as e:
+            raise ClientDisconnected(repr(e)) from e
+
+    def _get_specs(self, path: str) -> dict:
+        if path not in self._specs:
+            self._specs[path] = shps.specs.load_scene_specs(path)
+        return self._specs[path]
+
+    def _get_world(self, dims: tuple) -> SimpleWorld:
+        """Returns the world, it is only built again if the dims change."""
+        if self._world is None or self._world_dims != dims:
+            kwargs = dict(self._world_kwargs, dims=list(dims))
+            self._world = SimpleWorld(**kwargs)
+            if self._renderer_kwargs:
+                self._world.set_renderer(**self._renderer_kwargs)
+            self._world_dims = dims
+        return self._world
+
+    def _render(self, job: dict, stream):
+        specs = self._get_specs(job["specs"])
+        index = int(job["index"])
+        dims = tuple(float(v) for v in specs["scenes"][index]["world_dims"])
+        world = self._get_world(dims)
+        poses = world.load_scene_spec(specs, index)
+        if job.get("poses") is not None:
+            poses = [(tuple(loc), tuple(rot)) for loc, rot in job["poses"]]
+
+        folder = job["folder"]
+        first_file_id = int(job.get("first_file_id", 1))
+        for file_id, (location, rotation) in enumerate(poses, first_file_id):
+            world.render(folder, file_id,
+                         camera_location=location,
+                         camera_rotation=rotation)
+            self._reply(stream, {"id": job.get("id"),
+                                 "file_id": file_id,
+                                 "files": shps.render.get_output_files(file_id)})
+        self._reply(stream, {"id": job.get("id"), "done": True})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a shapes3d render server inside blender")
+    parser.add_argument("--host", type=str, default=HOST, help="Address to listen to")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen to")
+    parser.add_argument("--walls", action="store_true", help="Use walls in the world")
+    parser.add_argument("--gpu", action="store_true", help="Render with the gpu")
+    parser.add_argument("--template", type=str, default=None,
+                        help="Template .blend of the empty world, see SimpleWorld")
+    parser.add_argument("--samples", type=int, default=256, help="Samples per pixel")
+    parser.add_argument("--width", type=int, default=600, help="Width of the images in px")
+    parser.add_argument("--height", type=int, default=600, help="Height of the images in px")
+
+    argv = sys.argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv)
+
+    server = RenderServer(args.host, args.port,
+                          world_kwargs={"use_walls": args.walls, "use_gpu": args.gpu,
+                                        "template": args.template, "deferred": True},
+                          renderer_kwargs={"gpu": args.gpu,
+                                           "samples": args.samples,
+                                           "image_resolution": (args.width, args.height)})
+    server.serve_forever()
@@ -1,18 +1,40 @@
 """Implements simple classes to add geometric 3d shapes into blender scene conveniently."""
 
+import math
 import bpy
 from typing import Optional, Tuple
 
 SUBDIVS = 5
+SEGMENTS = 32
+MIN_SUBDIVS = 1
+MIN_SEGMENTS = 8
+# Angle between neighbouring vertices of an icosahedron
+ICOSAHEDRON_EDGE_ANGLE = math.atan(2)
 SPHERE = "Shapes3D_SPHERE_"
 CYLINDER = "Shapes3D_CYLINDER_"
 CONE = "Shapes3D_CONE_"
 PLANE = "Shapes3D-PLANE_"
 CUBOID = "Shapes3D-CUBOID_"
 
+SHAPE_TYPES = {
+    SPHERE: "SPHERE",
+    CYLINDER: "CYLINDER",
+    CONE: "CONE",
+    PLANE: "PLANE",
+    CUBOID: "CUBOID",
+}
+UNKNOWN_TYPE = "MESH"
+
+# Attributes of shapes that can change without building the object again
+UPDATABLE_ATTRIBUTES = ("_location", "_color")
+
+# Custom property of blender objects with the analytic description of the
+# shape in object coordinates. Used to compute exact 2d bounding boxes.
+PRIMITIVE_PROPERTY = "shapes3d_primitive"
+
 
 class Shape:
-    def __init__(self, id, name, location, color):
+    def __init__(self, id, name, location, color, build=True):
         self._id = id
         self._name = name + str(id)
 
@@ -20,53 +42,180 @@ class Shape:
 
         self._color = tuple(color) + (1,)
         self._location = location
+        if build:
+            self._render()
+
+    def build(self):
+        """Creates the blender object of a shape constructed with build=False."""
         self._render()
 
+    def remove(self):
+        """Removes the blender object with its mesh and material if unused."""
+        obj = bpy.data.objects.get(self._name, None)
+        if obj is None:
+            return
+        mesh = obj.data
+        materials = [mat for mat in mesh.materials if mat is not None]
+        bpy.data.objects.remove(obj, do_unlink=True)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+        for mat in materials:
+            if mat.users == 0:
+                bpy.data.materials.remove(mat)
+
+    def update(self, previous: dict) -> bool:
+        """Applies the changes of location and color since a previous state,
+        vars(shape), to the object in place.
+
+        Returns:
+            bool: False if anything else changed or there is no object, then
+                it has to be built again
+        """
+        state = vars(self)
+        if set(state) != set(previous) or any(
+                state[key] != previous[key] for key in state if key not in UPDATABLE_ATTRIBUTES):
+            return False
+        obj = bpy.data.objects.get(self._name, None)
+        if obj is None:
+            return False
+        obj.location = tuple(self._location)[:3]
+        if obj.active_material is not None:
+            obj.active_material.diffuse_color = self._color
+        return True
+
     def _render(self):
         bpy.context.object.name = self._name
+        primitive = self._primitive()
+        if primitive:
+            bpy.context.object[PRIMITIVE_PROPERTY] = primitive
         mat = bpy.data.materials.new(name='Material_%s' % self._name)
         mat.diffuse_color = self._color
         bpy.context.object.data.materials.append(mat)
 
+    def _primitive(self) -> dict:
+        """Returns the shape in object coordinates as a dict of floats.
+        Empty for shapes without one, their boxes use the convex hull."""
+        return {}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Shape":
+        """Returns a shape whose object is already in the scene, e.g. loaded
+        from a .blend file, from the attributes returned by vars(shape)."""
+        shape = cls.__new__(cls)
+        shape.__dict__.update(state)
+        return shape
+
+
+def get_shape_type(name: str) -> str:
+    """Returns the type of shape from the name of its object, e.g. 'SPHERE'.
+
+    Objects not created by shapes3d are of type UNKNOWN_TYPE.
+    """
+    for prefix, shape_type in SHAPE_TYPES.items():
+        if name.startswith(prefix):
+            return shape_type
+    return UNKNOWN_TYPE
+
+
+def lod_subdivisions(radius: float, distance: float, focal_px: float,
+                     max_error_px: float = 0.5) -> int:
+    """Returns the ico sphere subdivisions needed for an error under max_error_px.
+
+    The error is the distance between the sphere and the centre of the
+    faces, which is not larger than r*(1 - cos(a)) where a is the angle
+    between a vertex and the centre of its faces.
+
+    Args:
+        radius (float): radius of the sphere in meters
+        distance (float): minimum distance from the camera to the surface in meters
+        focal_px (float): focal length in pixels
+        max_error_px (float): maximum error of the silhouette in pixels
+
+    Returns:
+        int: subdivisions between MIN_SUBDIVS and SUBDIVS
+    """
+    if distance <= 0:
+        return SUBDIVS
+    for subdivs in range(MIN_SUBDIVS, SUBDIVS):
+        angle = ICOSAHEDRON_EDGE_ANGLE / 2**(subdivs - 1) / math.sqrt(3)
+        error = radius * (1 - math.cos(angle))
+        if focal_px * error / distance <= max_error_px:
+            return subdivs
+    return SUBDIVS
+
+
+def lod_segments(radius: float, distance: float, focal_px: float,
+                 max_error_px: float = 0.5) -> int:
+    """Returns the vertices of a circle needed for an error under max_error_px.
+
+    The error is the sagitta of each segment, r*(1 - cos(pi/n)).
+    See lod_subdivisions for the arguments.
+
+    Returns:
+        int: number of vertices between MIN_SEGMENTS and SEGMENTS
+    """
+    if distance <= 0:
+        return SEGMENTS
+    for segments in range(MIN_SEGMENTS, SEGMENTS):
+        error = radius * (1 - math.cos(math.pi / segments))
+        if focal_px * error / distance <= max_error_px:
+            return segments
+    return SEGMENTS
+
 
 class Sphere(Shape):
-    def __init__(self, id=None, radius=1, location=(0, 0, 0), color=(1,1,1)):
+    def __init__(self, id=None, radius=1, location=(0, 0, 0), color=(1,1,1),
+                 subdivisions=SUBDIVS, build=True):
         self._radius = radius
-        super(Sphere, self).__init__(id, SPHERE, location, color)
+        self._subdivisions = subdivisions
+        super(Sphere, self).__init__(id, SPHERE, location, color, build)
 
     def _render(self):
         bpy.ops.mesh.primitive_ico_sphere_add(
-            subdivisions=SUBDIVS,
+            subdivisions=self._subdivisions,
             radius=self._radius,
             location=self._location,
         )
         super(Sphere, self)._render()
 
+    def _primitive(self):
+        return {"type": "SPHERE", "radius": self._radius}
+
 
 class Cylinder(Shape):
-    def __init__(self, id=None, radius=1, height=1, location=(0,0,0), color=(1,1,1)):
+    def __init__(self, id=None, radius=1, height=1, location=(0,0,0), color=(1,1,1),
+                 segments=SEGMENTS, build=True):
         self._radius = radius
         self._height = height
-        super(Cylinder, self).__init__(id, CYLINDER, location, color)
+        self._segments = segments
+        super(Cylinder, self).__init__(id, CYLINDER, location, color, build)
 
     def _render(self):
         bpy.ops.mesh.primitive_cylinder_add(
+            vertices=self._segments,
             depth=self._height,
             radius=self._radius,
             location=self._location,
         )
         super(Cylinder, self)._render()
 
+    def _primitive(self):
+        return {"type": "FRUSTUM", "radius1": self._radius,
+                "radius2": self._radius, "height": self._height}
+
 
 class Cone(Shape):
-    def __init__(self, id=None, radius1=1, radius2=0, height=1, location=(0,0,0), color=(1,1,1)):
+    def __init__(self, id=None, radius1=1, radius2=0, height=1, location=(0,0,0), color=(1,1,1),
+                 segments=SEGMENTS, build=True):
         self._radius1 = radius1
         self._radius2 = radius2
         self._height = height
-        super(Cone, self).__init__(id, CONE, location, color)
+        self._segments = segments
+        super(Cone, self).__init__(id, CONE, location, color, build)
 
     def _render(self):
         bpy.ops.mesh.primitive_cone_add(
+            vertices=self._segments,
             depth=self._height,
             radius1=self._radius1,
             radius2=self._radius2,
@@ -74,15 +223,19 @@ class Cone(Shape):
         )
         super(Cone, self)._render()
 
+    def _primitive(self):
+        return {"type": "FRUSTUM", "radius1": self._radius1,
+                "radius2": self._radius2, "height": self._height}
+
 
 class Cuboid(Shape):
     """ Only Rectangular cubioids """
     def __init__(self, id=None, dims=(1, 1, 1), location=(0, 0, 0),
-                 rotation=(0, 0, 0), color=(1, 1, 1)):
+                 rotation=(0, 0, 0), color=(1, 1, 1), build=True):
         self._dims = dims
         self._rotation = rotation
 
-        super(Cuboid, self).__init__(id, CUBOID, location, color)
+        super(Cuboid, self).__init__(id, CUBOID, location, color, build)
 
     def _render(self):
         bpy.ops.mesh.primitive_cube_add(
@@ -92,6 +245,10 @@ class Cuboid(Shape):
             bpy.ops.transform.rotate(value=rad, orient_axis=axis)
         super(Cuboid, self)._render()
 
+    def _primitive(self):
+        # Unit cube, dims and rotation are in the object transform
+        return {"type": "BOX", "size_z": 1.0}
+
 
 class Plane(Shape):
     def __init__(self,
@@ -116,6 +273,9 @@ class Plane(Shape):
             bpy.ops.transform.rotate(value=rad, orient_axis=axis)
         super(Plane, self)._render()
 
+    def _primitive(self):
+        return {"type": "BOX", "size_z": 0.0}
+
     @property
     def dims(self):
         return self._dims
@@ -0,0 +1,363 @@
+"""Implements a vectorized sampler of scene specs that does not depend on blender.
+
+A scene spec describes everything SimpleWorld randomizes: shapes, light and
+camera poses. Specs of many scenes are stored as three structured arrays,
+so scenes can be sampled, deduplicated and distributed without blender and
+built later with SimpleWorld.load_scene_spec.
+
+    scenes:  one row per scene, with the range of its objects and poses
+    objects: one row per shape, sorted by scene
+    poses:   one row per camera pose, sorted by scene
+
+Shape parameters are stored in dims:
+    sphere:   (radius, 0, 0)
+    cuboid:   (width, length, height)
+    cylinder: (radius, height, 0)
+    cone:     (radius1, radius2, height)
+"""
+
+import math
+from pathlib import Path
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+SPHERE = 0
+CUBOID = 1
+CYLINDER = 2
+CONE = 3
+TYPES = ("sphere", "cuboid", "cylinder", "cone")
+
+SCENE_DTYPE = np.dtype([
+    ("world_dims", np.float32, 3),
+    ("light", np.float32, 3),
+    ("first_object", np.uint32),
+    ("num_objects", np.uint16),
+    ("first_pose", np.uint32),
+    ("num_poses", np.uint16),
+])
+
+OBJECT_DTYPE = np.dtype([
+    ("scene", np.uint32),
+    ("type", np.uint8),
+    ("dims", np.float32, 3),
+    ("location", np.float32, 3),
+    ("rotation", np.float32, 3),
+    ("color", np.float32, 3),
+])
+
+POSE_DTYPE = np.dtype([
+    ("scene", np.uint32),
+    ("location", np.float32, 3),
+    ("rotation", np.float32, 3),
+])
+
+# Same margins as SimpleWorld
+COLLISION_EPS = 0.2
+PLACEMENT_EPS = 2e-1
+MIN_DIM = 0.5
+
+DEFAULT_LIGHT = (4, 1, 6)
+
+
+def _place_objects(rng: np.random.Generator,
+                   num_objects: np.ndarray,
+                   world_dims: Tuple[float, float, float],
+                   tries: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Places objects of every scene at once, one slot at a time.
+
+    Returns:
+        centres (np.ndarray): (N, M, 2) xy, NaN if the slot could not be placed
+        radii (np.ndarray): (N, M) collision radii, NaN if not placed
+        placed (np.ndarray): (N, M) bool
+    """
+    n, max_objects = len(num_objects), int(num_objects.max(initial=0))
+    centres = np.full((n, max_objects, 2), np.nan)
+    radii = np.full((n, max_objects), np.nan)
+    half = np.array(world_dims[:2]) / 2
+
+    for slot in range(max_objects):
+        active = np.nonzero(num_objects > slot)[0]
+        r = rng.uniform(PLACEMENT_EPS, 1, (len(active), tries)) * world_dims[2] / 2
+        lim = (half - PLACEMENT_EPS/2) - r[..., None]
+        xy = rng.uniform(-1, 1, (len(active), tries, 2)) * lim
+
+        # (A, T, S) distances to the objects already placed
+        placed_xy = centres[active, None, :slot]
+        d2 = ((xy[:, :, None, 0] - placed_xy[..., 0])**2 +
+              (xy[:, :, None, 1] - placed_xy[..., 1])**2)
+        min_d = (r[..., None] + radii[active, None, :slot] + COLLISION_EPS)**2
+        free = ~np.any(d2 <= min_d, axis=2) & np.all(lim > 0, axis=2)
+
+        ok = free.any(axis=1)
+        first = free.argmax(axis=1)
+        rows = active[ok]
+        centres[rows, slot] = xy[ok, first[ok]]
+        radii[rows, slot] = r[ok, first[ok]]
+
+    return centres, radii, ~np.isnan(radii)
+
+
+def _is_free(xy: np.ndarray,
+             centres: np.ndarray,
+             radii: np.ndarray,
+             half: np.ndarray,
+             clearance: float) -> np.ndarray:
+    """Returns (N, ...) True for (N, ..., 2) xy inside the world and off every footprint.
+
+    centres (N, M, 2) and radii (N, M) are the shapes of each of the N scenes.
+    """
+    extra = (1,) * (xy.ndim - 2)
+    cx = centres[..., 0].reshape((len(centres),) + extra + (-1,))
+    cy = centres[..., 1].reshape((len(centres),) + extra + (-1,))
+    r = radii.reshape((len(radii),) + extra + (-1,))
+    d2 = (xy[..., None, 0] - cx)**2 + (xy[..., None, 1] - cy)**2
+    collides = np.any(d2 <= (r + clearance + COLLISION_EPS)**2, axis=-1)
+    inside = np.all(np.abs(xy) <= half - clearance, axis=-1)
+    return inside & ~collides
+
+
+def sample_camera_poses(rng: np.random.Generator,
+                        centres: np.ndarray,
+                        radii: np.ndarray,
+                        world_dims: Tuple[float, float, float],
+                        num_poses: int,
+                        height: float = 1,
+                        distance: Tuple[float, float] = (4, np.inf),
+                        clearance: float = 1,
+                        jitter: float = 1,
+                        tries: int = 8,
+                        targets: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Samples camera poses looking at a random object of each scene.
+
+    The camera is placed at a random angle and distance from a random
+    object, looking at it, as in examples/dataset_generator.py. Candidates
+    are rejected if they are outside the world or closer than clearance to
+    any shape footprint.
+
+    Args:
+        rng (np.random.Generator): random generator
+        centres (np.ndarray): (N, M, 2) xy of the shapes, NaN for no shape
+        radii (np.ndarray): (N, M) collision radii, NaN for no shape
+        world_dims (tuple): (width, length, height) of the world
+        num_poses (int): poses per scene
+        height (float): z of the camera
+        distance (tuple): min and max distance to the object looked at
+        clearance (float): collision radius of the camera
+        jitter (float): max random xy displacement after aiming
+        tries (int): candidates per pose
+        targets (np.ndarray): (N, K, 2) xy looked at, NaN for none. Default
+            the centres. E.g. a single shape per scene whose neighbours are
+            the centres
+
+    Returns:
+        locations (np.ndarray): (N, P, 3)
+        rotations (np.ndarray): (N, P, 3) XYZ euler angles
+        valid (np.ndarray): (N, P) bool, False if no candidate was valid
+    """
+    centres = np.asarray(centres, dtype=np.float64)
+    radii = np.asarray(radii, dtype=np.float64)
+    n = centres.shape[0]
+    if centres.shape[1] == 0:
+        # A slot without shape, so the world centre is targeted
+        centres = np.full((n, 1, 2), np.nan)
+        radii = np.full((n, 1), np.nan)
+    targets = centres if targets is None else np.asarray(targets, dtype=np.float64)
+    shape = (n, num_poses, tries)
+    half = np.array(world_dims[:2]) / 2
+    placed = ~np.isnan(targets[..., 0])
+    num_placed = placed.sum(axis=1)
+
+    # Random placed object, or the centre of the world if there are none
+    order = np.argsort(~placed, axis=1, kind="stable")
+    pick = (rng.uniform(0, 1, shape) * np.maximum(num_placed, 1)[:, None, None]).astype(int)
+    target_idx = np.take_along_axis(order, pick.reshape(n, -1), axis=1).reshape(shape)
+    target = np.take_along_axis(targets, target_idx.reshape(n, -1, 1), axis=1).reshape(shape + (2,))
+    target[num_placed == 0] = 0
+    target = np.nan_to_num(target)
+
+    angle = rng.uniform(0, 2*math.pi, shape)
+    max_dist = np.minimum(distance[1],
+                          half.min() - np.abs(target).max(axis=-1) - PLACEMENT_EPS/2)
+    dist = rng.uniform(0, 1, shape) * (max_dist - distance[0]) + distance[0]
+    xy = target + dist[..., None] * np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+    xy += rng.uniform(-jitter, jitter, shape + (2,))
+
+    free = _is_free(xy, centres, radii, half, clearance) & (max_dist > distance[0])
+
+    valid = free.any(axis=2)
+    first = free.argmax(axis=2)[..., None]
+    xy = np.take_along_axis(xy, first[..., None], axis=2)[:, :, 0]
+    yaw = math.pi/2 + np.take_along_axis(angle, first, axis=2)[..., 0]
+
+    locations = np.concatenate([xy, np.full(xy.shape[:2] + (1,), height)], axis=-1)
+    rotations = np.stack([np.full(yaw.shape, math.pi/2), np.zeros(yaw.shape), yaw], axis=-1)
+    return locations, rotations, valid
+
+
+def sample_camera_pairs(rng: np.random.Generator,
+                        centres: np.ndarray,
+                        radii: np.ndarray,
+                        world_dims: Tuple[float, float, float],
+                        num_pairs: int,
+                        baseline: Optional[float] = None,
+                        max_yaw_offset: float = math.pi/8,
+                        clearance: float = 1,
+                        tries: int = 8,
+                        **kwargs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Samples pairs of nearby camera poses, e.g. for view synthesis.
+
+    The first pose of each pair follows sample_camera_poses. The second one
+    is displaced baseline meters in a random xy direction, or uniformly in
+    [-1, 1] in x and y if baseline is None as in examples/dataset_generator.py,
+    and rotated a random yaw in [-max_yaw_offset, max_yaw_offset].
+
+    Args:
+        kwargs: passed to sample_camera_poses for the first pose
+        For the rest see sample_camera_poses.
+
+    Returns:
+        locations (np.ndarray): (N, P, 2, 3)
+        rotations (np.ndarray): (N, P, 2, 3) XYZ euler angles
+        valid (np.ndarray): (N, P) bool, False if no valid pair was found
+    """
+    locations, rotations, valid = sample_camera_poses(
+        rng, centres, radii, world_dims, num_pairs, clearance=clearance,
+        tries=tries, **kwargs)
+
+    shape = locations.shape[:2] + (tries,)
+    if baseline is None:
+        offset = rng.uniform(-1, 1, shape + (2,))
+    else:
+        angle = rng.uniform(0, 2*math.pi, shape)
+        offset = baseline * np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+    xy = locations[:, :, None, :2] + offset
+    half = np.array(world_dims[:2]) / 2
+    free = _is_free(xy, np.asarray(centres, dtype=np.float64),
+                    np.asarray(radii, dtype=np.float64), half, clearance)
+
+    first = free.argmax(axis=2)[..., None]
+    second = locations.copy()
+    second[..., :2] = np.take_along_axis(xy, first[..., None], axis=2)[:, :, 0]
+    second_rotations = rotations.copy()
+    second_rotations[..., 2] += rng.uniform(-max_yaw_offset, max_yaw_offset, shape[:2])
+
+    return (np.stack([locations, second], axis=2),
+            np.stack([rotations, second_rotations], axis=2),
+            valid & free.any(axis=2))
+
+
+def sample_scenes(num_scenes: int,
+                  world_dims: Tuple[float, float, float] = (20, 20, 2),
+                  num_objects: Tuple[int, int] = (7, 15),
+                  types: Sequence[str] = ("sphere", "cuboid", "cylinder"),
+                  num_poses: int = 0,
+                  light_jitter: float = 0,
+                  rotate_cuboids: bool = False,
+                  tries: int = 20,
+                  seed: Optional[int] = None,
+                  chunk_size: int = 16384) -> dict:
+    """Samples collision free scene specs.
+
+    Shapes follow the same distributions as SimpleWorld.add_*: collision
+    radii are uniform in (0.2, 1)*height/2 and locations uniform in the
+    world. Slots that do not find a free location in tries attempts are
+    dropped, as SimpleWorld does.
+
+    Args:
+        num_scenes (int): number of scenes
+        world_dims (tuple): (width, length, height) of the world in meters
+        num_objects (tuple): min and max (inclusive) objects per scene
+        types (list): shape types to sample from TYPES
+        num_poses (int): camera poses per scene, see sample_camera_poses
+        light_jitter (float): max xy displacement of the light from DEFAULT_LIGHT
+        rotate_cuboids (bool): random yaw for cuboids
+        tries (int): attempts to place each object
+        seed (int): seed of the random generator
+        chunk_size (int): scenes sampled at once, bounds memory
+
+    Returns:
+        dict: with 'scenes', 'objects' and 'poses' structured arrays
+    """
+    rng = np.random.default_rng(seed)
+    type_codes = np.array([TYPES.index(t) for t in types], dtype=np.uint8)
+    scenes = np.zeros(num_scenes, dtype=SCENE_DTYPE)
+    objects, poses = [], []
+
+    for start in range(0, num_scenes, chunk_size):
+        n = min(chunk_size, num_scenes - start)
+        counts = rng.integers(num_objects[0], num_objects[1] + 1, n)
+        centres, radii, placed = _place_objects(rng, counts, world_dims, tries)
+
+        scene_idx, _ = np.nonzero(placed)
+        r = radii[placed]
+        m = len(r)
+        obj = np.zeros(m, dtype=OBJECT_DTYPE)
+        obj["scene"] = start + scene_idx
+        obj["type"] = rng.choice(type_codes, m)
+        obj["color"] = rng.uniform(0, 1, (m, 3))
+        obj["location"][:, :2] = centres[placed]
+
+        default_height = rng.uniform(MIN_DIM, world_dims[2]/2, m)
+        low = np.minimum(r, MIN_DIM)[:, None]
+        box = rng.uniform(0, 1, (m, 3)) * (r[:, None] - low) + low
+        dims = np.zeros((m, 3))
+        z = np.zeros(m)
+        for code, d, zz in ((SPHERE, np.column_stack([r, 0*r, 0*r]), r),
+                            (CUBOID, box, box[:, 2]/2),
+                            (CYLINDER, np.column_stack([r, default_height, 0*r]), default_height/2),
+                            (CONE, np.column_stack([r, 0*r, default_height]), default_height/2)):
+            sel = obj["type"] == code
+            dims[sel] = d[sel]
+            z[sel] = zz[sel]
+        obj["dims"] = dims
+        obj["location"][:, 2] = z
+        if rotate_cuboids:
+            sel = obj["type"] == CUBOID
+            obj["rotation"][sel, 2] = rng.uniform(0, 2*math.pi, sel.sum())
+        objects.append(obj)
+
+        chunk = scenes[start:start + n]
+        chunk["world_dims"] = world_dims
+        chunk["light"] = DEFAULT_LIGHT
+        chunk["light"][:, :2] += rng.uniform(-light_jitter, light_jitter, (n, 2))
+        chunk["num_objects"] = placed.sum(axis=1)
+
+        if num_poses:
+            locations, rotations, valid = sample_camera_poses(
+                rng, centres, radii, world_dims, num_poses)
+            scene_idx, _ = np.nonzero(valid)
+            pose = np.zeros(len(scene_idx), dtype=POSE_DTYPE)
+            pose["scene"] = start + scene_idx
+            pose["location"] = locations[valid]
+            pose["rotation"] = rotations[valid]
+            poses.append(pose)
+            chunk["num_poses"] = valid.sum(axis=1)
+
+    scenes["first_object"] = np.cumsum(scenes["num_objects"]) - scenes["num_objects"]
+    scenes["first_pose"] = np.cumsum(scenes["num_poses"]) - scenes["num_poses"]
+    return {
+        "scenes": scenes,
+        "objects": np.concatenate(objects) if objects else np.zeros(0, OBJECT_DTYPE),
+        "poses": np.concatenate(poses) if poses else np.zeros(0, POSE_DTYPE),
+    }
+
+
+def get_scene(specs: dict, index: int) -> Tuple[np.void, np.ndarray, np.ndarray]:
+    """Returns the scene row, its objects and its poses."""
+    scene = specs["scenes"][index]
+    first_object, first_pose = int(scene["first_object"]), int(scene["first_pose"])
+    objects = specs["objects"][first_object:first_object + int(scene["num_objects"])]
+    poses = specs["poses"][first_pose:first_pose + int(scene["num_poses"])]
+    return scene, objects, poses
+
+
+def save_scene_specs(path: Union[str, Path], specs: dict, compressed: bool = False):
+    """Saves specs as a .npz file."""
+    save = np.savez_compressed if compressed else np.savez
+    save(path, **specs)
+
+
+def load_scene_specs(path: Union[str, Path]) -> dict:
+    with np.load(path) as data:
+        return {key: data[key] for key in ("scenes", "objects", "poses")}
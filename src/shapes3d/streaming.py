@@ -0,0 +1,167 @@
+"""Implements a tile index of the shapes of large worlds, it does not depend
+on blender.
+
+Shapes are assigned to square tiles of the floor by their centre and each
+tile keeps the bounds of its shapes. The tiles seen by a camera are found
+by culling the bounds of the tiles against its frustum, so only their
+shapes need to be in blender. Loaded tiles are kept in LRU order and the
+least recently seen ones are evicted past a budget.
+
+Example:
+    index = TileIndex(tile_size=50, max_tiles=64)
+    index.add("Shapes3D_SPHERE_0", (120, 40, 1), 1)
+    tiles = index.get_visible_tiles(K, camera_to_world, 600, 600, near=0.1, far=200)
+    loaded, evicted = index.load(tiles)
+    names = index.get_names()
+"""
+
+import math
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from shapes3d.geometry import boxes_in_frustum
+
+TILE_SIZE = 50
+MAX_TILES = 64
+
+
+class TileIndex:
+    """Square tiles of the xy plane with the shapes whose centre is inside.
+
+    Args:
+        tile_size (float): side of the tiles in meters
+        max_tiles (int): tiles kept loaded. Tiles needed by the last load are
+            always kept, even past the budget
+    """
+    def __init__(self, tile_size: float = TILE_SIZE, max_tiles: int = MAX_TILES):
+        self._tile_size = tile_size
+        self._max_tiles = max_tiles
+        # Tile -> shape name -> (centre, radius)
+        self._tiles = {}
+        # Tile -> [min xyz, max xyz] of its shapes. Not shrunk when removing
+        self._bounds = {}
+        self._tile_of = {}
+        self._max_radius = 0.0
+        self._loaded = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tile_of)
+
+    def get_tile(self, x: float, y: float) -> Tuple[int, int]:
+        return (math.floor(x / self._tile_size), math.floor(y / self._tile_size))
+
+    def add(self, name: str, centre: Sequence[float], radius: float):
+        """Adds a shape by the centre and radius of its bounding sphere."""
+        if name in self._tile_of:
+            self.remove(name)
+        centre = np.asarray(centre, dtype=np.float64)[:3]
+        tile = self.get_tile(centre[0], centre[1])
+        self._tiles.setdefault(tile, {})[name] = (centre, radius)
+        self._tile_of[name] = tile
+        self._max_radius = max(self._max_radius, radius)
+
+        mins, maxs = centre - radius, centre + radius
+        if tile in self._bounds:
+            mins = np.minimum(self._bounds[tile][0], mins)
+            maxs = np.maximum(self._bounds[tile][1], maxs)
+        self._bounds[tile] = (mins, maxs)
+
+    def remove(self, name: str):
+        tile = self._tile_of.pop(name)
+        del self._tiles[tile][name]
+        if not self._tiles[tile]:
+            del self._tiles[tile]
+            del self._bounds[tile]
+
+    def clear(self):
+        """Removes all shapes. Loaded tiles are forgotten too."""
+        self._tiles = {}
+        self._bounds = {}
+        self._tile_of = {}
+        self._max_radius = 0.0
+        self._loaded = OrderedDict()
+
+    def get_near(self, x: float, y: float, radius: float) -> List[str]:
+        """Returns the names of the shapes whose bounding circle may be closer
+        than radius to (x, y). Only the tiles around it are visited."""
+        reach = radius + self._max_radius
+        min_tile = self.get_tile(x - reach, y - reach)
+        max_tile = self.get_tile(x + reach, y + reach)
+        names = []
+        for i in range(min_tile[0], max_tile[0] + 1):
+            for j in range(min_tile[1], max_tile[1] + 1):
+                names.extend(self._tiles.get((i, j), ()))
+        return names
+
+    def get_visible_tiles(self,
+                          K: np.ndarray,
+                          camera_to_world: np.ndarray,
+                          width: int,
+                          height: int,
+                          near: float,
+                          far: float,
+                          margin: float = 0) -> List[Tuple[int, int]]:
+        """Returns the tiles whose shapes may be seen by any of the cameras.
+
+        Args:
+            K (np.ndarray): 3x3 intrinsic matrix
+            camera_to_world (np.ndarray): (P, 4, 4) camera poses
+            width (int): image width in px
+            height (int): image height in px
+            near (float): near clip distance in meters
+            far (float): far clip distance in meters
+            margin (float): meters added to each side of the bounds of the tiles,
+                e.g. to load the tiles of the next camera poses in advance
+        """
+        tiles = list(self._bounds)
+        if not tiles:
+            return []
+        mins = np.array([self._bounds[tile][0] for tile in tiles]) - margin
+        maxs = np.array([self._bounds[tile][1] for tile in tiles]) + margin
+        visible = np.any(boxes_in_frustum(K, camera_to_world, width, height,
+                                          near, far, mins, maxs), axis=0)
+        return [tile for tile, v in zip(tiles, visible) if v]
+
+    def load(self, tiles: Sequence[Tuple[int, int]]) -> Tuple[List, List]:
+        """Marks tiles as loaded and most recently used, and evicts the least
+        recently used ones past max_tiles.
+
+        Returns:
+            list: tiles not loaded before
+            list: evicted tiles
+        """
+        needed = set(tiles)
+        loaded = [tile for tile in tiles if tile not in self._loaded]
+        for tile in tiles:
+            self._loaded[tile] = True
+            self._loaded.move_to_end(tile)
+
+        evicted = []
+        for tile in list(self._loaded):
+            if len(self._loaded) <= self._max_tiles:
+                break
+            if tile not in needed:
+                del self._loaded[tile]
+                evicted.append(tile)
+        return loaded, evicted
+
+    @property
+    def loaded(self) -> List[Tuple[int, int]]:
+        """Loaded tiles, from least to most recently used."""
+        return list(self._loaded)
+
+    def get_names(self, tiles: Sequence[Tuple[int, int]] = None) -> List[str]:
+        """Returns the names of the shapes of the tiles. Default loaded tiles."""
+        tiles = self._loaded if tiles is None else tiles
+        names = []
+        for tile in tiles:
+            names.extend(self._tiles.get(tile, ()))
+        return names
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"shapes": len(self._tile_of),
+                "tiles": len(self._tiles),
+                "loaded_tiles": len(self._loaded),
+                "loaded_shapes": len(self.get_names())}
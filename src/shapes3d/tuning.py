@@ -0,0 +1,170 @@
+"""Implements an auto-tuner of the CPU render configuration.
+
+Short calibration renders of the current scene are timed over a grid of
+thread counts and tile dimensions, each at two sample counts to extrapolate
+the time at the configured samples. The best configuration is cached per
+resolution, engine, device, host and blender version so later runs can
+apply it without calibrating again.
+"""
+
+import itertools
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import bpy
+import numpy as np
+
+from shapes3d.render import OUTPUT_NODE_TYPE
+from shapes3d.render import has_tile_size
+from shapes3d.render import set_render_config
+
+SCENE = 'Scene'
+
+TUNING_CACHE = Path.home() / ".cache" / "shapes3d" / "render_tuning.json"
+TILE_DIMS = [(16, 16), (32, 32), (64, 64), (128, 128), (256, 256)]
+# Square tiles of blender 3.0+, whose default is 2048
+TILE_SIZES = [(256, 256), (512, 512), (1024, 1024), (2048, 2048)]
+CALIBRATION_SAMPLES = (4, 16)
+
+
+def get_tuning_key() -> str:
+    """Returns the key of the current configuration: resolution, engine,
+    device, host and blender version, whose tiles differ from 3.0."""
+    scene = bpy.data.scenes[SCENE]
+    return "{}x{}|{}|{}|{}|{}".format(scene.render.resolution_x,
+                                      scene.render.resolution_y,
+                                      scene.render.engine,
+                                      scene.cycles.device,
+                                      socket.gethostname(),
+                                      bpy.app.version_string)
+
+
+def _default_threads() -> List[int]:
+    cpus = os.cpu_count() or 1
+    return sorted({max(1, cpus // 4), max(1, cpus // 2), cpus})
+
+
+def _load_cache(cache_path: Path) -> dict:
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return {}
+    # A corrupt cache, e.g. of a killed run, is ignored and overwritten
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def load_tuned_config(cache_path: Path = TUNING_CACHE) -> Optional[dict]:
+    """Returns the cached config for the current configuration or None."""
+    return _load_cache(cache_path).get(get_tuning_key(), None)
+
+
+def apply_tuned_config(cache_path: Path = TUNING_CACHE) -> bool:
+    """Applies the cached config if there is one.
+
+    Returns:
+        bool: True if a cached config was found and applied
+    """
+    config = load_tuned_config(cache_path)
+    if config is None:
+        return False
+    set_render_config(threads=config["threads"],
+                      tile_dim=tuple(config["tile_dim"]))
+    return True
+
+
+def _time_render(repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        bpy.ops.render.render()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def auto_tune(threads: Optional[List[int]] = None,
+              tile_dims: Optional[List[Tuple[int, int]]] = None,
+              samples: Tuple[int, ...] = CALIBRATION_SAMPLES,
+              repeats: int = 1,
+              cache_path: Path = TUNING_CACHE,
+              apply: bool = True) -> dict:
+    """Finds the fastest thread count and tile dimensions for the current scene.
+
+    Each configuration is rendered with every sample count in samples and
+    the time per frame at the configured number of samples is extrapolated
+    with a linear fit. Samples are not tuned, they set the quality of the
+    images. Output file nodes are muted while calibrating.
+
+    Args:
+        threads (list): thread counts to try. Default: a quarter, half and all cpus
+        tile_dims (list): (x,y) tile dimensions to try. Default TILE_DIMS, or
+            TILE_SIZES in blender 3.0+ where only x is used, see
+            shps.render.set_render_config
+        samples (tuple): sample counts of the calibration renders, at least two
+        repeats (int): renders per measurement, the fastest one is used
+        cache_path (Path): json file where the best config is stored
+        apply (bool): set the best config in blender
+
+    Returns:
+        dict: best config with threads, tile_dim and seconds_per_frame
+    """
+    assert len(samples) >= 2, "At least two sample counts are needed to extrapolate"
+    threads = threads or _default_threads()
+    tile_dims = tile_dims or (TILE_SIZES if has_tile_size() else TILE_DIMS)
+
+    scene = bpy.data.scenes[SCENE]
+    target_samples = scene.cycles.samples
+    previous = (scene.render.threads_mode, scene.render.threads)
+    if has_tile_size():
+        previous_tiles = scene.cycles.tile_size
+    else:
+        previous_tiles = (scene.render.tile_x, scene.render.tile_y)
+
+    output_nodes = []
+    if scene.use_nodes:
+        output_nodes = [n for n in scene.node_tree.nodes
+                        if n.bl_idname == OUTPUT_NODE_TYPE and not n.mute]
+    for node in output_nodes:
+        node.mute = True
+
+    results = []
+    try:
+        for num_threads, tile_dim in itertools.product(threads, tile_dims):
+            set_render_config(threads=num_threads, tile_dim=tile_dim)
+            times = []
+            for num_samples in samples:
+                scene.cycles.samples = num_samples
+                times.append(_time_render(repeats))
+            slope, intercept = np.polyfit(samples, times, 1)
+            results.append({"threads": num_threads,
+                            "tile_dim": list(tile_dim),
+                            "seconds_per_frame": float(intercept + slope*target_samples)})
+    finally:
+        scene.cycles.samples = target_samples
+        for node in output_nodes:
+            node.mute = False
+        scene.render.threads_mode, scene.render.threads = previous
+        if has_tile_size():
+            scene.cycles.tile_size = previous_tiles
+        else:
+            scene.render.tile_x, scene.render.tile_y = previous_tiles
+
+    best = min(results, key=lambda r: r["seconds_per_frame"])
+
+    cache = _load_cache(cache_path)
+    cache[get_tuning_key()] = best
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=2)
+
+    if apply:
+        set_render_config(threads=best["threads"], tile_dim=tuple(best["tile_dim"]))
+
+    return best
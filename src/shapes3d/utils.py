@@ -1,9 +1,28 @@
 import bpy
 
 class UndoChanges:
+    # Undo steps pushed and undone by all instances, see shapes3d.metrics
+    pushes = 0
+    undos = 0
+
     def __enter__(self):
         bpy.ops.ed.undo_push(message="before")
+        UndoChanges.pushes += 1
 
     def __exit__(self, exc_type, exc_value, traceback):
         bpy.ops.ed.undo_push(message="after")
         bpy.ops.ed.undo()
+        UndoChanges.pushes += 1
+        UndoChanges.undos += 1
+
+    @staticmethod
+    def get_undo_steps_estimate() -> int:
+        """Estimates the undo steps left by UndoChanges from its own pushes and
+        undos, capped by the undo steps kept by blender.
+
+        It is not the size of blender's undo stack, which is not exposed to
+        python: steps pushed by other code are not counted.
+        """
+        steps = UndoChanges.pushes - UndoChanges.undos
+        limit = bpy.context.preferences.edit.undo_steps
+        return min(steps, limit) if limit > 0 else steps
@@ -0,0 +1,197 @@
+"""Estimates the visibility of objects without rendering by casting rays
+against a BVH of the world meshes.
+
+The BVH is built once from the world space geometry cached by render and
+only built again when an object moves, is added or is removed, so poses of
+a static scene only pay the ray casts.
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import bpy
+import numpy as np
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+
+from shapes3d.camera import get_intrinsic_matrix
+from shapes3d.geometry import pose_to_matrix
+from shapes3d.render import get_world_vertices
+
+SCENE = 'Scene'
+GRID = 32
+# Max objects found along each ray to compute occlusions
+MAX_LAYERS = 4
+# Distance moved past a hit before casting again
+EPSILON = 1e-4
+NO_HIT = -1
+
+
+class RayCaster:
+    """Casts a sparse grid of camera rays against the meshes of the scene.
+
+    Args:
+        grid (int or tuple): rays per (width, height) of the image
+        max_layers (int): objects found along each ray, the first one is
+            visible and the rest occluded by it
+        exclude (list): prefixes of object names ignored as targets but
+            still occluding, e.g. the floor and walls. Their hits count as
+            background in the results
+    """
+    def __init__(self,
+                 grid=GRID,
+                 max_layers: int = MAX_LAYERS,
+                 exclude: Sequence[str] = ()):
+        self._grid = (grid, grid) if isinstance(grid, int) else tuple(grid)
+        self._max_layers = max_layers
+        self._exclude = tuple(exclude)
+        self._bvh = None
+        self._state = None
+        self._names = []
+        self._owners = None
+
+    def _get_meshes(self) -> list:
+        return sorted((ob for ob in bpy.data.scenes[SCENE].objects if ob.type == 'MESH'),
+                      key=lambda ob: ob.name)
+
+    def update(self) -> bool:
+        """Builds the BVH again if the meshes changed.
+
+        Returns:
+            bool: True if the BVH was built
+        """
+        meshes = self._get_meshes()
+        state = [(ob.name, ob.data.as_pointer(), len(ob.data.vertices),
+                  tuple(tuple(row) for row in ob.matrix_world)) for ob in meshes]
+        if self._bvh is not None and state == self._state:
+            return False
+
+        verts, polys, owners = [], [], []
+        offset = 0
+        for i, ob in enumerate(meshes):
+            mesh = ob.data
+            mesh.calc_loop_triangles()
+            tris = np.empty(len(mesh.loop_triangles)*3, dtype=np.int32)
+            mesh.loop_triangles.foreach_get("vertices", tris)
+            verts.append(get_world_vertices(ob))
+            polys.append(tris.reshape(-1, 3) + offset)
+            owners.append(np.full(len(tris)//3, i, dtype=np.int32))
+            offset += len(mesh.vertices)
+
+        verts = np.concatenate(verts) if verts else np.zeros((0, 3), dtype=np.float32)
+        polys = np.concatenate(polys) if polys else np.zeros((0, 3), dtype=np.int32)
+        self._bvh = BVHTree.FromPolygons(verts.tolist(), polys.tolist(), all_triangles=True)
+        self._owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int32)
+        self._names = [ob.name for ob in meshes]
+        self._state = state
+        return True
+
+    def _get_rays(self, camera_to_world: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (N, 3) world directions at depth 1 along the camera axis
+        and the camera location."""
+        scene = bpy.data.scenes[SCENE]
+        width, height = scene.render.resolution_x, scene.render.resolution_y
+        K = get_intrinsic_matrix()
+        cols, rows = self._grid
+        u = (np.arange(cols) + 0.5) * width / cols
+        v = (np.arange(rows) + 0.5) * height / rows
+        u, v = np.meshgrid(u, v)
+        # Inverse of u = K00 x/z + K02 and v = K11 y/z + K12 with z = -1
+        rays = np.stack([-(u - K[0, 2]) / K[0, 0],
+                         -(v - K[1, 2]) / K[1, 1],
+                         -np.ones_like(u)], axis=-1).reshape(-1, 3)
+        return rays @ camera_to_world[:3, :3].T, camera_to_world[:3, 3]
+
+    def cast(self,
+             location: Sequence[float],
+             rotation: Sequence[float],
+             max_layers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Casts the grid of rays of a camera pose.
+
+        Args:
+            location (tuple): (tx, ty, tz) of the camera in meters
+            rotation (tuple): (rx, ry, rz) XYZ euler angles in radians
+            max_layers (int): objects found along each ray. Default the one of
+                the ray caster, 1 casts a single ray per pixel of the grid
+
+        Returns:
+            np.ndarray: (H, W, max_layers) index of the objects hit along each
+                ray, sorted by distance, NO_HIT if none. See names
+            np.ndarray: (H, W) depth along the camera axis of the first hit, inf if none
+        """
+        max_layers = self._max_layers if max_layers is None else max_layers
+        self.update()
+        directions, origin = self._get_rays(pose_to_matrix(location, rotation))
+        lengths = np.linalg.norm(directions, axis=1)
+        hits = np.full((len(directions), max_layers), NO_HIT, dtype=np.int32)
+        depth = np.full(len(directions), np.inf)
+        ray_cast = self._bvh.ray_cast
+        for i, (direction, length) in enumerate(zip(directions, lengths)):
+            direction = Vector(direction / length)
+            start = Vector(origin)
+            travelled = 0.0
+            found = 0
+            # Rays also hit the back faces of the objects they go through
+            for _ in range(2*max_layers):
+                co, normal, index, distance = ray_cast(start, direction)
+                if co is None:
+                    break
+                travelled += distance
+                obj = self._owners[index]
+                if found == 0:
+                    depth[i] = travelled / length
+                # Objects going through each other may be hit again
+                if obj not in hits[i, :found]:
+                    hits[i, found] = obj
+                    found += 1
+                    if found == max_layers:
+                        break
+                start = co + direction * EPSILON
+                travelled += EPSILON
+        rows, cols = self._grid[1], self._grid[0]
+        return hits.reshape(rows, cols, -1), depth.reshape(rows, cols)
+
+    @property
+    def names(self):
+        """Names of the objects indexed by the hits of cast."""
+        return self._names
+
+    def get_visibility(self,
+                       location: Sequence[float],
+                       rotation: Sequence[float]) -> Dict[str, dict]:
+        """Returns per object visibility of a camera pose.
+
+        Returns:
+            dict: object name -> {"fraction": fraction of the rays where it is
+                the first hit, "visible": fraction of its hits not occluded,
+                "depth": depth of its nearest visible hit or None}. Excluded
+                objects are not reported
+        """
+        hits, depth = self.cast(location, rotation)
+        first = hits[..., 0]
+        num_rays = first.size
+        results = {}
+        for i, name in enumerate(self._names):
+            if name.startswith(self._exclude):
+                continue
+            hit = np.any(hits == i, axis=-1)
+            total = int(hit.sum())
+            if total == 0:
+                continue
+            seen = first == i
+            results[name] = {
+                "fraction": float(seen.sum()) / num_rays,
+                "visible": float(seen.sum()) / total,
+                "depth": float(depth[seen].min()) if seen.any() else None,
+            }
+        return results
+
+    def get_coverage(self,
+                     location: Sequence[float],
+                     rotation: Sequence[float]) -> float:
+        """Returns the fraction of the rays whose first hit is not excluded.
+        Only the first hit of each ray is cast."""
+        hits, _ = self.cast(location, rotation, max_layers=1)
+        first = hits[..., 0]
+        # The last element is indexed by NO_HIT
+        targets = np.array([not name.startswith(self._exclude) for name in self._names] + [False])
+        return float(targets[first].mean())
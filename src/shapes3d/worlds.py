@@ -1,13 +1,26 @@
+import copy
+import hashlib
+import json
 import math
+import os
+from pathlib import Path
 from pdb import set_trace
 import random
-from typing import Tuple, List, Optional, Union
+import shutil
+from typing import Dict, Tuple, List, Optional, Union
 
 import bpy
 import numpy as np
+from mathutils import Euler, Matrix, Vector
 
 import shapes3d as shps
 from shapes3d.shapes import Plane, Sphere, Cuboid, Cylinder, Cone
+from shapes3d.shapes import SUBDIVS, SEGMENTS, lod_subdivisions, lod_segments
+
+# Scene custom property with the configuration key of a template .blend
+TEMPLATE_PROPERTY = "shapes3d_template"
+# Modules whose code builds the state saved in templates
+TEMPLATE_MODULES = ("worlds", "render", "scene", "shapes", "camera")
 
 class SimpleWorld:
     """Simple World class using shapes3d.
@@ -20,23 +33,52 @@ class SimpleWorld:
                 the dimensions of the base/floor and height of the walls
         use_walls (bool): Whether create wall or not
         use_gpu (bool): Use gpu or not
+        deferred (bool): keep added and removed shapes only in python and apply
+                the net changes to blender in a single sync before rendering
+        template (str): .blend file of the configured empty world. It is loaded
+                instead of building the world if it was saved with the same
+                configuration, blender version and shapes3d code. Else the
+                world is built and saved there
     """
     def __init__(self,
                  use_walls: bool=False,
                  dims: tuple=(10, 10, 2),
-                 use_gpu: bool=False
+                 use_gpu: bool=False,
+                 template: Optional[str]=None,
+                 deferred: bool=False
                  ):
-        self._clean_scene()
         self._close_blender_when_done = True
+        self._deferred = deferred
+        # Shape name -> (shape, state) of the shapes with a blender object
+        self._synced = {}
 
         self._floor = None
         self._walls = []
         self._shapes = []
+        self._lod_cameras = None
+        self._lod_max_error_px = None
+        self._raycaster = None
+        # Fingerprint of the scene while in static mode
+        self._static_fingerprint = None
+        self._metrics = None
+        # (database, environment) whose scene was added by the last render
+        self._metadata_scene = None
+        # Tile index and shape name -> shape of the streaming mode
+        self._streaming = None
+        self._streamed = {}
+        self._stream_margin = 0
+        self._stream_max_distance = None
+        self._stream_stats = None
 
         self._use_walls = use_walls
         self._dims = dims
         self._use_gpu = use_gpu
 
+        if template and self.load_template(template):
+            return
+
+        self._clean_scene()
+
         # Create plane
         self._floor = Plane(id=0, dims=self._dims[:2])
 
@@ -56,6 +98,78 @@ class SimpleWorld:
         # Set background color
         shps.scene.set_background_color((0,0,0,0))
 
+        if template:
+            self.save_template(template)
+
+    def get_template_key(self) -> str:
+        """Returns the key of the configuration of the empty world."""
+        sha = hashlib.sha1()
+        config = {"use_walls": self._use_walls,
+                  "dims": [float(v) for v in self._dims],
+                  "use_gpu": self._use_gpu,
+                  "blender": bpy.app.version_string}
+        sha.update(json.dumps(config, sort_keys=True).encode())
+        for name in TEMPLATE_MODULES:
+            with open(getattr(shps, name).__file__, "rb") as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    def save_template(self, path: str):
+        """Saves the empty world into a .blend file to start later worlds faster.
+
+        The key of the configuration is saved in the file and in a <path>.json
+        side file, with the state of the floor and walls.
+        """
+        if self._shapes:
+            raise RuntimeError("Templates are saved before adding shapes")
+
+        key = self.get_template_key()
+        bpy.data.scenes['Scene'][TEMPLATE_PROPERTY] = key
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # copy keeps the current file of blender untouched
+        bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+
+        info = {"key": key,
+                "floor": vars(self._floor),
+                "walls": [vars(wall) for wall in self._walls]}
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(path + ".json.tmp", path + ".json")
+
+    def load_template(self, path: str) -> bool:
+        """Loads the empty world from a template saved with save_template.
+
+        The threads and tiles tuned for this host are applied if cached, see
+        auto_tune_renderer.
+
+        Returns:
+            bool: False if the template does not exist or was saved with another
+                configuration. The scene is not modified then
+        """
+        path = os.path.abspath(path)
+        if not os.path.exists(path) or not os.path.exists(path + ".json"):
+            return False
+
+        key = self.get_template_key()
+        with open(path + ".json") as f:
+            info = json.load(f)
+        if info.get("key") != key:
+            return False
+
+        bpy.ops.wm.open_mainfile(filepath=path, load_ui=False)
+        shps.render.clear_geometry_caches()
+        if bpy.data.scenes['Scene'].get(TEMPLATE_PROPERTY, None) != key:
+            raise RuntimeError("Template %s does not match its side file" % path)
+
+        self._floor = Plane.from_state(info["floor"])
+        self._walls = [Plane.from_state(wall) for wall in info["walls"]]
+        # Threads of the host that saved the template are not kept, the ones
+        # tuned for this host are used if cached, see set_renderer(auto_tune)
+        bpy.data.scenes['Scene'].render.threads_mode = 'AUTO'
+        shps.tuning.apply_tuned_config()
+        return True
+
     def _create_walls(self):
         bit_a = 0 # width or height, x or y
         bit_b = 0 # positive or negative
@@ -76,6 +190,17 @@ class SimpleWorld:
             bit_b, bit_a = bit_a, 1 ^ bit_b
 
     def reset(self):
+        self._metadata_scene = None
+        if self._deferred:
+            # Objects are removed by the next sync unless added again
+            self._shapes = []
+            if self._streaming is not None:
+                self._streaming.clear()
+                self._streamed = {}
+            if self._metrics is not None:
+                self._metrics.record_environment()
+            return
+
         bpy.ops.object.select_all(action='DESELECT')
         for shp in self._shapes:
             obj = bpy.data.objects.get(shp._name, None)
@@ -83,6 +208,154 @@ class SimpleWorld:
                 obj.select_set(True)
         bpy.ops.object.delete()
         self._shapes = []
+        self._synced = {}
+        # Pointers of deleted objects may be reused by new ones
+        shps.render.clear_geometry_caches()
+        if self._metrics is not None:
+            self._metrics.record_environment()
+
+    def set_metrics(self, metrics: Optional[shps.metrics.MetricsRecorder]):
+        """Records datablock counts, memory and undo steps after every frame
+        and reset into metrics. None to stop recording."""
+        self._metrics = metrics
+
+    def sync(self) -> Tuple[int, int]:
+        """Applies the changes of the shapes to blender.
+
+        Shapes are compared by name and state with the objects in blender, so
+        shapes added again with the same parameters, e.g. after reset or by
+        load_scene_spec, keep their objects. Shapes whose location or color
+        changed are updated in place, see Shape.update. Objects of removed or
+        otherwise changed shapes are deleted and then missing ones created.
+        Only needed in deferred mode, render calls it. In streaming mode only
+        the shapes of the loaded tiles are kept in blender, see stream.
+
+        Returns:
+            int: number of created objects
+            int: number of deleted objects
+        """
+        if self._streaming is not None:
+            shapes = {name: self._streamed[name] for name in self._streaming.get_names()}
+        else:
+            shapes = {shp._name: shp for shp in self._shapes}
+        deleted = 0
+        for name, (synced, state) in list(self._synced.items()):
+            shp = shapes.get(name, None)
+            if shp is not None and vars(shp) == state:
+                self._synced[name] = (shp, state)
+            elif shp is not None and shp.update(state):
+                self._synced[name] = (shp, copy.deepcopy(vars(shp)))
+            else:
+                synced.remove()
+                del self._synced[name]
+                deleted += 1
+
+        created = 0
+        for name, shp in shapes.items():
+            if name not in self._synced:
+                shp.build()
+                self._synced[name] = (shp, copy.deepcopy(vars(shp)))
+                created += 1
+
+        if deleted:
+            # Pointers of deleted objects may be reused by new ones
+            shps.render.clear_geometry_caches()
+        return created, deleted
+
+    def _add(self, shp):
+        """Adds a shape constructed with build=not self._deferred to the world."""
+        self._shapes.append(shp)
+        self._metadata_scene = None
+        if not self._deferred:
+            self._synced[shp._name] = (shp, copy.deepcopy(vars(shp)))
+        if self._streaming is not None:
+            self._streaming.add(shp._name, shp._location[:3], self._get_bounding_radius(shp))
+            self._streamed[shp._name] = shp
+
+    def set_streaming(self,
+                      tile_size: float=shps.streaming.TILE_SIZE,
+                      max_tiles: int=shps.streaming.MAX_TILES,
+                      margin: float=0,
+                      max_distance: Optional[float]=None):
+        """Keeps in blender only the shapes near the camera, for large worlds.
+
+        Shapes are indexed in square tiles of the floor. Before each render
+        the tiles intersecting the frustum of the camera plus margin are
+        loaded and the least recently used ones evicted past max_tiles, see
+        shps.streaming.TileIndex. Render cost then depends on the density of
+        shapes around the camera instead of the size of the world. Collision
+        checks of new shapes also only visit nearby tiles. Needs deferred mode.
+
+        Ray casts of get_raycaster and sample_camera_poses(min_visible) only
+        see the loaded tiles.
+
+        Args:
+            tile_size (float): side of the tiles in meters
+            max_tiles (int): tiles kept in blender
+            margin (float): meters added around the tiles when culling them, e.g.
+                the distance the camera moves between frames
+            max_distance (float): farthest distance to load tiles from. Default
+                the far clip distance of the camera
+        """
+        if not self._deferred:
+            raise RuntimeError("Streaming needs a world created with deferred=True")
+
+        self._streaming = shps.streaming.TileIndex(tile_size, max_tiles)
+        self._streamed = {}
+        self._stream_margin = margin
+        self._stream_max_distance = max_distance
+        for shp in self._shapes:
+            self._streaming.add(shp._name, shp._location[:3], self._get_bounding_radius(shp))
+            self._streamed[shp._name] = shp
+
+    def unset_streaming(self):
+        """Keeps every shape in blender again from the next sync."""
+        self._streaming = None
+        self._streamed = {}
+
+    def stream(self, camera_to_world: Optional[np.ndarray]=None) -> dict:
+        """Loads the tiles seen by the cameras and evicts the least recently
+        used ones. Their objects are created and deleted by the next sync.
+
+        Args:
+            camera_to_world (np.ndarray): (P, 4, 4) camera poses. Default the
+                camera and the views of the camera rig
+
+        Returns:
+            dict: number of loaded and evicted tiles and the stats of the index
+        """
+        if self._streaming is None:
+            raise RuntimeError("Call set_streaming before streaming")
+
+        camera = bpy.data.objects[shps.camera.CAMERA]
+        if camera_to_world is None:
+            bpy.context.view_layer.update()
+            cameras = [camera] + list(shps.camera.get_rig_cameras().values())
+            camera_to_world = np.array([np.array(cam.matrix_world) for cam in cameras])
+
+        scene = bpy.data.scenes['Scene']
+        tiles = self._streaming.get_visible_tiles(shps.camera.get_intrinsic_matrix(),
+                                                  camera_to_world,
+                                                  scene.render.resolution_x,
+                                                  scene.render.resolution_y,
+                                                  camera.data.clip_start,
+                                                  self._get_stream_far(),
+                                                  margin=self._stream_margin)
+        loaded, evicted = self._streaming.load(tiles)
+        self._stream_stats = dict(self._streaming.get_stats(),
+                                  new_tiles=len(loaded), evicted_tiles=len(evicted))
+        return self._stream_stats
+
+    def _get_stream_far(self) -> float:
+        """Farthest distance tiles are loaded from."""
+        far = bpy.data.objects[shps.camera.CAMERA].data.clip_end
+        if self._stream_max_distance is not None:
+            far = min(far, self._stream_max_distance)
+        return far
+
+    def get_stream_stats(self) -> Optional[dict]:
+        """Returns the stats of the last stream, e.g. of the last render."""
+        return self._stream_stats
 
     def generate_intrinsic_parameters(self):
         """Returns intrinsic parameters.
@@ -103,6 +376,7 @@ class SimpleWorld:
     
     def set_light(self, location=(4,1,6)):
         shps.scene.set_light(location=location)
+        self._metadata_scene = None
 
     def _clean_scene(self):
         shps.scene.clean_scene()
@@ -140,12 +414,33 @@ class SimpleWorld:
                folder_path: str,
                file_id: int=1,
                camera_location: tuple=None,
-               camera_rotation: tuple=None):
+               camera_rotation: tuple=None,
+               cache: Optional[shps.cache.RenderCache]=None,
+               annotation_sink: Optional[shps.annotations.AnnotationSink]=None,
+               min_content: Optional[float]=None,
+               roi: Optional[List[float]]=None,
+               roi_margin: float=0,
+               metadata: Optional[shps.metadata.MetadataDB]=None,
+               split: Optional[str]=None) -> bool:
         """Renders the environment.
 
         Args:
             camera_location (tuple): (tx, ty, tx) tuple of floats in meters
             camera_rotation (tuple): (yaw, pitch, roll) tuple of floats in radians
+            cache (RenderCache): serve frames already rendered with the same world,
+                camera and render configuration from the cache
+            annotation_sink (AnnotationSink): add the 2d bboxes of the frame to the sink
+            min_content (float): skip the frame if shapes cover less than this
+                fraction of the image, see get_visibility
+            roi (list): render only this [min_x, min_y, max_x, max_y] px box plus
+                roi_margin, see shps.render.render
+            roi_margin (float): px added to each side of roi
+            metadata (MetadataDB): add the camera and bboxes of the frame to the
+                database. The scene is added once, until shapes or the light change
+            split (str): split of the frame in the database, e.g. 'train'
+
+        Returns:
+            bool: False if the frame was skipped
         """
         if camera_location:
             shps.camera.set_location(*camera_location)
@@ -153,8 +448,238 @@ class SimpleWorld:
         if camera_rotation:
             shps.camera.set_rotation(*camera_rotation)
 
+        coverage = None
+        if min_content is not None:
+            camera = bpy.data.objects[shps.camera.CAMERA]
+            _, coverage = self.get_visibility(np.array(camera.location),
+                                              np.array(camera.rotation_euler))
+            if coverage[0] < min_content:
+                return False
+
+        if self._streaming is not None:
+            self.stream()
+        self.sync()
+        self._check_static_scene()
+        if metadata is not None:
+            self._add_metadata_scene(metadata, folder_path)
         shps.render.set_image_path(folder_path, file_id)
-        shps.render.render()
+        # Frames are added to the metadata inside the render region, if any
+        shps.render.render(cache=cache,
+                           cache_scene_state=self.get_state() if cache else None,
+                           annotation_sink=annotation_sink,
+                           roi=roi,
+                           roi_margin=roi_margin,
+                           metadata=metadata,
+                           metadata_split=split,
+                           metadata_coverage=None if coverage is None else float(coverage[0]))
+        if self._metrics is not None:
+            self._metrics.record_frame(file_id)
+        return True
+
+    def _add_metadata_scene(self, metadata: shps.metadata.MetadataDB, folder_path: str):
+        """Adds the scene to metadata unless added since shapes or light changed."""
+        environment = os.path.basename(os.path.normpath(folder_path))
+        if self._metadata_scene is None or self._metadata_scene[0] is not metadata \
+                or self._metadata_scene[1] != environment:
+            metadata.add_scene(environment, self.get_state())
+            self._metadata_scene = (metadata, environment)
+
+    def render_crops(self,
+                     folder_path: str,
+                     first_file_id: int=1,
+                     margin: float=16,
+                     camera_location: tuple=None,
+                     camera_rotation: tuple=None) -> List[Tuple[int, str]]:
+        """Renders a crop around each visible shape instead of the full image.
+
+        Render time is proportional to the area of the crops. Each crop saves
+        its intrinsic matrix into Intrinsic_<file id>.txt.
+
+        Args:
+            folder_path (str): folder of the outputs
+            first_file_id (int): file id of the first crop
+            margin (float): px added to each side of the box of the shape
+
+        Returns:
+            list: (file id, shape name) of each crop
+        """
+        if camera_location:
+            shps.camera.set_location(*camera_location)
+
+        if camera_rotation:
+            shps.camera.set_rotation(*camera_rotation)
+
+        if self._streaming is not None:
+            self.stream()
+        self.sync()
+        crops = []
+        # Boxes are computed once, before any region is set
+        rois = shps.render.get_object_rois()
+        # Only shapes in blender, all but the evicted ones when streaming
+        for shp in [shp for shp in self._shapes if shp._name in self._synced]:
+            roi = rois.get(shp._name)
+            if roi is None:
+                continue
+            file_id = first_file_id + len(crops)
+            self.render(folder_path, file_id, roi=roi, roi_margin=margin)
+            crops.append((file_id, shp._name))
+        return crops
+
+    def set_static_scene(self):
+        """Renders the next frames of the current scene moving only the camera.
+
+        Cycles keeps the synced scene, BVH and shaders between renders (see
+        shps.render.set_persistent_data) and each render checks that nothing
+        but the cameras changed. Call unset_static_scene before changing the
+        world again.
+        """
+        self.sync()
+        if shps.render.has_instance_ids():
+            shps.render.assign_instance_ids()
+        shps.render.set_persistent_data()
+        self._static_fingerprint = shps.render.get_scene_fingerprint()
+
+    def unset_static_scene(self):
+        shps.render.unset_persistent_data()
+        self._static_fingerprint = None
+
+    @property
+    def static_scene(self) -> bool:
+        return self._static_fingerprint is not None
+
+    def _check_static_scene(self):
+        if self._static_fingerprint is None:
+            return
+        if shps.render.get_scene_fingerprint() != self._static_fingerprint:
+            raise RuntimeError("The scene changed in static mode, call unset_static_scene "
+                               "before changing the world")
+
+    def set_camera_rig(self, views: Dict[str, Tuple[tuple, tuple]]):
+        """Renders several views per render call, e.g. a stereo pair.
+
+        For more information see shps.camera.set_rig
+
+        Args:
+            views (dict): name -> (location, rotation) relative to the camera
+        """
+        shps.camera.set_rig(views)
+
+    def unset_camera_rig(self):
+        shps.camera.unset_rig()
+
+    def render_views(self,
+                     folder_path: str,
+                     file_ids: List[int],
+                     camera_locations: List[tuple],
+                     camera_rotations: List[tuple],
+                     cache: Optional[shps.cache.RenderCache]=None,
+                     annotation_sink: Optional[shps.annotations.AnnotationSink]=None,
+                     metadata: Optional[shps.metadata.MetadataDB]=None,
+                     split: Optional[str]=None) -> List[List[float]]:
+        """Renders several camera poses of the world in a single render call.
+
+        The poses are rendered as views of a camera rig anchored at the first
+        pose, which is removed afterwards. Outputs are then renamed so each pose
+        gets the files of a normal render with its file id, RuntimeError is
+        raised if any is missing. Saves Extrinsic_<file id>.txt of each pose.
+
+        Args:
+            folder_path (str): folder of the outputs
+            file_ids (list): file id of each pose
+            camera_locations (list): (tx, ty, tz) of each pose in meters
+            camera_rotations (list): (rx, ry, rz) of each pose in radians
+            cache (RenderCache): see render
+            annotation_sink (AnnotationSink): add the 2d bboxes of each pose to the sink
+            metadata (MetadataDB): add the scene, and the camera and bboxes of
+                each pose to the database
+            split (str): split of the frames in the database, e.g. 'train'
+
+        Returns:
+            list: [tx, ty, tz, rx, ry, rz] of each pose
+        """
+        anchor = Matrix.Translation(Vector(camera_locations[0])) @ \
+            Euler(camera_rotations[0], 'XYZ').to_matrix().to_4x4()
+        anchor_inv = anchor.inverted()
+
+        views = {}
+        for i, (location, rotation) in enumerate(zip(camera_locations, camera_rotations)):
+            pose = Matrix.Translation(Vector(location)) @ \
+                Euler(rotation, 'XYZ').to_matrix().to_4x4()
+            loc, rot, _ = (anchor_inv @ pose).decompose()
+            views[str(i)] = (tuple(loc), tuple(rot.to_euler('XYZ')))
+
+        self.set_camera_rig(views)
+        self.render(folder_path, file_ids[0],
+                    camera_location=tuple(camera_locations[0]),
+                    camera_rotation=tuple(camera_rotations[0]),
+                    cache=cache)
+        extrinsics = shps.camera.get_rig_extrinsic_parameters()
+        self.unset_camera_rig()
+
+        # Image_color_0001_2.png -> Image_color_0003.png, suffixes as in
+        # shps.camera.set_rig
+        renames = []
+        for i, file_id in enumerate(file_ids):
+            renames.extend(zip(shps.render.get_output_paths(file_ids[0], "_" + str(i)),
+                               shps.render.get_output_paths(file_id)))
+        missing = [str(source) for source, _ in renames if not source.exists()]
+        if missing:
+            raise RuntimeError("The render of the views did not write %s" % missing)
+        for source, target in renames:
+            os.replace(source, target)
+
+        frame = "{:04d}".format(file_ids[0])
+
+        table = Path(folder_path) / "{}{}.json".format(
+            shps.annotations.INST_ID_TABLE_FILE_NAME, frame)
+        poses = []
+        for i, file_id in enumerate(file_ids):
+            extrinsic = [float(v) for v in extrinsics[str(i)]]
+            poses.append(extrinsic)
+            with open(os.path.join(folder_path, "Extrinsic_{:04d}.txt".format(file_id)), "w") as f:
+                f.write(" ".join(str(v) for v in extrinsic) + "\ntx ty tz rx ry rz")
+            if i > 0 and table.exists():
+                shutil.copyfile(table, table.with_name("{}{:04d}.json".format(
+                    shps.annotations.INST_ID_TABLE_FILE_NAME, file_id)))
+
+        if annotation_sink is not None or metadata is not None:
+            self._add_view_annotations(folder_path, file_ids, camera_locations,
+                                       camera_rotations, annotation_sink, metadata, split)
+        return poses
+
+    def _add_view_annotations(self,
+                              folder_path: str,
+                              file_ids: List[int],
+                              camera_locations: List[tuple],
+                              camera_rotations: List[tuple],
+                              annotation_sink: Optional[shps.annotations.AnnotationSink],
+                              metadata: Optional[shps.metadata.MetadataDB],
+                              split: Optional[str]):
+        """Adds the bboxes of each pose of render_views, moving the camera to
+        it. The camera is moved back to the first pose."""
+        if metadata is not None:
+            self._add_metadata_scene(metadata, folder_path)
+        for file_id, location, rotation in zip(file_ids, camera_locations, camera_rotations):
+            shps.camera.set_location(*location)
+            shps.camera.set_rotation(*rotation)
+            bpy.context.view_layer.update()
+            bpy.data.scenes['Scene'].frame_set(file_id)
+            bboxes = shps.render.get_2d_bounding_boxes()
+            if annotation_sink is not None:
+                shps.render.add_to_annotation_sink(annotation_sink, bboxes)
+            if metadata is not None:
+                shps.render.add_to_metadata(metadata, bboxes, split=split)
+        shps.camera.set_location(*camera_locations[0])
+        shps.camera.set_rotation(*camera_rotations[0])
+
+    def get_state(self) -> dict:
+        """Returns the parameters of the shapes, walls, floor and light."""
+        shapes = [self._floor] + self._walls + self._shapes
+        light = shps.scene.get_light()
+        return {
+            "shapes": [vars(shp) for shp in shapes],
+            "light": (list(light.location), light.data.type, light.data.energy) if light else None,
+        }
 
     def _get_collision_radius(self, shape):
         if 'SPHERE' in shape._name:
@@ -182,7 +707,11 @@ class SimpleWorld:
             True if there are no collisions, else False
         """
         eps = 0.2
-        for shp in self._shapes:
+        shapes = self._shapes
+        if self._streaming is not None:
+            shapes = [self._streamed[name]
+                      for name in self._streaming.get_near(x, y, collision_radius + eps)]
+        for shp in shapes:
             shp_collision_radius = self._get_collision_radius(shp)
             if (shp._location[0] - x)**2 + (shp._location[1] - y)**2 <= \
                     (shp_collision_radius + collision_radius + eps)**2:
@@ -190,6 +719,210 @@ class SimpleWorld:
         else:
             return True
 
+    def _get_footprints(self, shapes: Optional[list]=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (1, M, 2) xy centres and (1, M) collision radii of the shapes.
+        Default all shapes of the world."""
+        shapes = self._shapes if shapes is None else shapes
+        centres = np.array([shp._location[:2] for shp in shapes],
+                           dtype=float).reshape(1, -1, 2)
+        radii = np.array([self._get_collision_radius(shp) for shp in shapes],
+                         dtype=float).reshape(1, -1)
+        return centres, radii
+
+    def _get_bounding_radius(self, shape) -> float:
+        """Radius of the sphere around the location bounding the shape."""
+        if 'SPHERE' in shape._name:
+            return shape._radius
+        elif 'CYLINDER' in shape._name:
+            return math.hypot(shape._radius, shape._height/2)
+        elif 'CONE' in shape._name:
+            return math.hypot(max(shape._radius1, shape._radius2), shape._height/2)
+        else:
+            return float(np.linalg.norm(shape._dims)/2)
+
+    def _get_bounding_spheres(self, shapes: Optional[list]=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (M, 3) world centres and (M,) radii bounding the shapes.
+        Default all shapes of the world."""
+        shapes = self._shapes if shapes is None else shapes
+        centres = [shp._location[:3] for shp in shapes]
+        radii = [self._get_bounding_radius(shp) for shp in shapes]
+        return (np.array(centres, dtype=float).reshape(-1, 3),
+                np.array(radii, dtype=float))
+
+    def get_visibility(self,
+                       camera_locations: np.ndarray,
+                       camera_rotations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Estimates which shapes each camera pose sees without rendering.
+
+        Uses the bounding spheres of the shapes and the current intrinsic
+        parameters, see shps.geometry.sphere_visibility. In streaming mode
+        only the shapes of the tiles seen by any of the poses are projected.
+
+        Args:
+            camera_locations (np.ndarray): (P, 3) locations in meters
+            camera_rotations (np.ndarray): (P, 3) XYZ euler angles in radians
+
+        Returns:
+            visible (np.ndarray): (P, M) bool, shape inside the view frustum.
+                In streaming mode M are only the shapes of the seen tiles
+            coverage (np.ndarray): (P,) fraction of the image covered by shapes
+        """
+        scene = bpy.data.scenes['Scene']
+        K = shps.camera.get_intrinsic_matrix()
+        poses = shps.geometry.pose_to_matrix(np.reshape(camera_locations, (-1, 3)),
+                                             np.reshape(camera_rotations, (-1, 3)))
+        shapes = None
+        if self._streaming is not None:
+            camera = bpy.data.objects[shps.camera.CAMERA]
+            tiles = self._streaming.get_visible_tiles(K, poses,
+                                                      scene.render.resolution_x,
+                                                      scene.render.resolution_y,
+                                                      camera.data.clip_start,
+                                                      self._get_stream_far())
+            shapes = [self._streamed[name] for name in self._streaming.get_names(tiles)]
+        centres, radii = self._get_bounding_spheres(shapes)
+        visible, _, coverage = shps.geometry.sphere_visibility(
+            K, poses, centres, radii,
+            scene.render.resolution_x, scene.render.resolution_y)
+        return visible, coverage
+
+    def get_raycaster(self) -> shps.visibility.RayCaster:
+        """Returns the ray caster of the world, the floor and walls occlude but
+        are not targets. Its BVH is reused while the shapes do not change."""
+        if self._raycaster is None:
+            self._raycaster = shps.visibility.RayCaster(exclude=(shps.shapes.PLANE,))
+        return self._raycaster
+
+    def get_occlusion(self,
+                      camera_location: tuple,
+                      camera_rotation: tuple) -> dict:
+        """Returns per shape visibility of a camera pose by ray casting, see
+        shps.visibility.RayCaster.get_visibility."""
+        if self._streaming is not None:
+            self.stream(shps.geometry.pose_to_matrix(camera_location, camera_rotation))
+        self.sync()
+        return self.get_raycaster().get_visibility(camera_location, camera_rotation)
+
+    def sample_camera_poses(self,
+                            num_poses: int,
+                            baseline: Optional[float]=None,
+                            pairs: bool=False,
+                            max_rounds: int=10,
+                            min_content: Optional[float]=None,
+                            min_visible: Optional[float]=None,
+                            **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        """Samples valid camera poses looking at the shapes of the world.
+
+        Thousands of candidates are drawn and filtered at once against the
+        world bounds and the footprints of all shapes. See
+        shps.specs.sample_camera_poses for the sampling. In streaming mode
+        each candidate looks at a random shape from at most the distance
+        tiles are loaded from, and is only checked against the footprints
+        near that shape.
+
+        Args:
+            num_poses (int): number of poses or pairs of poses
+            baseline (float): if pairs, distance in meters between the poses of a
+                pair. If None, the second pose is displaced up to 1m in x and y
+            pairs (bool): sample pairs of nearby poses
+            max_rounds (int): max batches of candidates before giving up
+            min_content (float): reject poses whose image is covered by shapes less
+                than this fraction, see get_visibility
+            min_visible (float): reject poses where unoccluded shapes cover less
+                than this fraction of the image, see get_occlusion. Only poses
+                passing the other checks are ray cast, until enough are found
+            kwargs: passed to shps.specs.sample_camera_poses (e.g. height,
+                distance, clearance)
+
+        Returns:
+            locations (np.ndarray): (N, 3) or (N, 2, 3) if pairs
+            rotations (np.ndarray): (N, 3) or (N, 2, 3) XYZ euler angles
+            N may be smaller than num_poses if there are not enough valid poses.
+            Without shapes the poses look at the centre of the world, or none
+            are returned if min_content or min_visible are passed.
+        """
+        if not self._shapes and (min_content is not None or min_visible is not None):
+            # No pose can see enough shapes, e.g. just after reset
+            shape = (0, 2, 3) if pairs else (0, 3)
+            return np.zeros(shape), np.zeros(shape)
+
+        rng = np.random.default_rng(random.getrandbits(32))
+        if self._streaming is None:
+            centres, radii = self._get_footprints()
+        locations, rotations = [], []
+        found = 0
+        for _ in range(max_rounds):
+            if self._streaming is not None:
+                loc, rot, valid = self._sample_streamed_candidates(
+                    rng, 2*num_poses, pairs, baseline, **kwargs)
+            elif pairs:
+                loc, rot, valid = shps.specs.sample_camera_pairs(
+                    rng, centres, radii, self._dims, 2*num_poses, baseline=baseline, **kwargs)
+            else:
+                loc, rot, valid = shps.specs.sample_camera_poses(
+                    rng, centres, radii, self._dims, 2*num_poses, **kwargs)
+            loc, rot = loc[valid], rot[valid]
+            if min_content is not None and len(loc):
+                _, coverage = self.get_visibility(loc.reshape(-1, 3), rot.reshape(-1, 3))
+                enough = np.all(coverage.reshape(len(loc), -1) >= min_content, axis=1)
+                loc, rot = loc[enough], rot[enough]
+            if min_visible is not None and len(loc):
+                self.sync()
+                enough = np.zeros(len(loc), dtype=bool)
+                for i in range(len(loc)):
+                    enough[i] = all(self.get_raycaster().get_coverage(l, r) >= min_visible
+                                    for l, r in zip(loc[i].reshape(-1, 3), rot[i].reshape(-1, 3)))
+                    if found + enough.sum() >= num_poses:
+                        break
+                loc, rot = loc[enough], rot[enough]
+            locations.append(loc)
+            rotations.append(rot)
+            found += len(loc)
+            if found >= num_poses:
+                break
+        return (np.concatenate(locations)[:num_poses],
+                np.concatenate(rotations)[:num_poses])
+
+    def _sample_streamed_candidates(self,
+                                    rng: np.random.Generator,
+                                    num_candidates: int,
+                                    pairs: bool,
+                                    baseline: Optional[float],
+                                    distance: Tuple[float, float]=(4, np.inf),
+                                    **kwargs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Samples a candidate around each of num_candidates random shapes,
+        each one a scene of shps.specs.sample_camera_poses with the footprints
+        of the tile index near the shape.
+
+        Returns:
+            locations (np.ndarray): (N, 1, 3) or (N, 1, 2, 3) if pairs
+            rotations (np.ndarray): same shape as locations
+            valid (np.ndarray): (N, 1) bool
+        """
+        names = list(self._streamed)
+        targets = [self._streamed[names[i]]
+                   for i in rng.integers(len(names), size=num_candidates)]
+        distance = (distance[0], min(distance[1], self._get_stream_far()))
+        reach = distance[1] + math.sqrt(2)*kwargs.get("jitter", 1) + kwargs.get("clearance", 1)
+        if pairs:
+            reach += math.sqrt(2) if baseline is None else baseline
+
+        near = [self._streaming.get_near(shp._location[0], shp._location[1], reach)
+                for shp in targets]
+        centres = np.full((num_candidates, max(map(len, near)), 2), np.nan)
+        radii = np.full(centres.shape[:2], np.nan)
+        for i, neighbours in enumerate(near):
+            footprints = self._get_footprints([self._streamed[name] for name in neighbours])
+            centres[i, :len(neighbours)], radii[i, :len(neighbours)] = [v[0] for v in footprints]
+        targets = np.array([shp._location[:2] for shp in targets], dtype=float).reshape(-1, 1, 2)
+
+        if pairs:
+            return shps.specs.sample_camera_pairs(rng, centres, radii, self._dims, 1,
+                                                  baseline=baseline, distance=distance,
+                                                  targets=targets, **kwargs)
+        return shps.specs.sample_camera_poses(rng, centres, radii, self._dims, 1,
+                                              distance=distance, targets=targets, **kwargs)
+
     def add_sphere(self,
                    radius: Optional[float] = None,
                    location: Optional[Tuple[float, float]] = None,
@@ -217,8 +950,10 @@ class SimpleWorld:
             if len(location) == 2:
                 location.append(radius)
 
-            s = Sphere(self._next_id(),radius=radius, location=location, color=color)
-            self._shapes.append(s)
+            s = Sphere(self._next_id(),radius=radius, location=location, color=color,
+                       subdivisions=self._get_subdivisions(radius, location),
+                       build=not self._deferred)
+            self._add(s)
 
             return True
 
@@ -264,8 +999,9 @@ class SimpleWorld:
                        dims=dims,
                        location=location,
                        rotation=rotation,
-                       color=color)
-            self._shapes.append(c)
+                       color=color,
+                       build=not self._deferred)
+            self._add(c)
 
             return True
 
@@ -289,8 +1025,10 @@ class SimpleWorld:
                          radius=radius,
                          height=height,
                          location=location,
-                         color=color)
-            self._shapes.append(c)
+                         color=color,
+                         segments=self._get_segments(radius, height, location),
+                         build=not self._deferred)
+            self._add(c)
             return True
 
     def add_cone(self,
@@ -330,10 +1068,100 @@ class SimpleWorld:
                      radius2=radius2,
                      height=height,
                      location=location,
-                     color=color)
-            self._shapes.append(c)
+                     color=color,
+                     segments=self._get_segments(max(radius1, radius2), height, location),
+                     build=not self._deferred)
+            self._add(c)
             return True
 
+    def set_level_of_detail(self,
+                            camera_locations: Optional[List[Tuple[float, float, float]]],
+                            max_error_px: float=0.5):
+        """Tessellates shapes added afterwards according to the planned camera poses.
+
+        Subdivisions of spheres and segments of cylinders and cones are the
+        lowest ones whose silhouette error is below max_error_px from the
+        closest camera location. It uses the current focal length and image
+        resolution, so set them first.
+
+        Args:
+            camera_locations (list): (x,y,z) locations the world will be rendered
+                from. None disables the level of detail.
+            max_error_px (float): max distance in pixels between tessellated and
+                exact silhouette.
+        """
+        if camera_locations is None:
+            self._lod_cameras = None
+        else:
+            self._lod_cameras = np.array(camera_locations, dtype=float).reshape(-1, 3)
+        self._lod_max_error_px = max_error_px
+
+    def _get_lod_distance(self, location, bounding_radius):
+        """Min distance from the planned cameras to the bounding sphere."""
+        location = list(location)[:3]
+        distances = np.linalg.norm(self._lod_cameras - np.array(location), axis=1)
+        return distances.min() - bounding_radius
+
+    def _get_focal_px(self):
+        return abs(shps.camera.get_intrinsic_matrix()[0, 0])
+
+    def _get_subdivisions(self, radius, location):
+        if self._lod_cameras is None:
+            return SUBDIVS
+        return lod_subdivisions(radius,
+                                self._get_lod_distance(location, radius),
+                                self._get_focal_px(),
+                                self._lod_max_error_px)
+
+    def _get_segments(self, radius, height, location):
+        if self._lod_cameras is None:
+            return SEGMENTS
+        bounding_radius = math.sqrt(radius**2 + (height/2)**2)
+        return lod_segments(radius,
+                            self._get_lod_distance(location, bounding_radius),
+                            self._get_focal_px(),
+                            self._lod_max_error_px)
+
+    def load_scene_spec(self, specs: dict, index: int) -> List[Tuple[tuple, tuple]]:
+        """Replaces the shapes and light of the world with a scene spec.
+
+        Specs are sampled without blender with shps.specs.sample_scenes.
+
+        Args:
+            specs (dict): scene specs as returned by shps.specs.load_scene_specs
+            index (int): index of the scene
+
+        Returns:
+            list: (location, rotation) camera poses of the scene
+        """
+        scene, objects, poses = shps.specs.get_scene(specs, index)
+        if not np.allclose(scene["world_dims"], self._dims):
+            raise AttributeError("Scene spec dims %s do not match world dims %s" %
+                                 (tuple(scene["world_dims"]), tuple(self._dims)))
+
+        self.reset()
+        self.set_light(location=tuple(float(v) for v in scene["light"]))
+
+        for obj in objects:
+            dims = [float(v) for v in obj["dims"]]
+            location = [float(v) for v in obj["location"]]
+            color = tuple(float(v) for v in obj["color"])
+            if obj["type"] == shps.specs.SPHERE:
+                self.add_sphere(radius=dims[0], location=location, color=color)
+            elif obj["type"] == shps.specs.CUBOID:
+                self.add_cuboid(dims=tuple(dims), location=location,
+                                rotation=tuple(float(v) for v in obj["rotation"]),
+                                color=color)
+            elif obj["type"] == shps.specs.CYLINDER:
+                self.add_cylinder(radius=dims[0], height=dims[1],
+                                  location=location, color=color)
+            elif obj["type"] == shps.specs.CONE:
+                self.add_cone(radius1=dims[0], radius2=dims[1], height=dims[2],
+                              location=location, color=color)
+
+        return [(tuple(float(v) for v in pose["location"]),
+                 tuple(float(v) for v in pose["rotation"])) for pose in poses]
+
     def add_capsule(self):
         raise NotImplementedError
 
@@ -399,7 +1227,10 @@ class SimpleWorld:
                      image_resolution: tuple=(600, 600),
                      samples: Optional[int]=256,
                      max_bouces: Optional[int]=4,
-                     tile_dim: Optional[Tuple[int, int]]=(256, 256)):
+                     tile_dim: Optional[Tuple[int, int]]=(256, 256),
+                     auto_tune: bool=True,
+                     adaptive_threshold: Optional[float]=None,
+                     time_limit: Optional[float]=None):
         """Sets the render in blender.
 
         For more information see shps.render.set_config
@@ -410,14 +1241,37 @@ class SimpleWorld:
             image_resolution (tuple): tuple of ints for resolution for width and height
             samples (int): Number of samples per image per pixel
             max_bouces (int): number or bouces per ray
-            tile_dim (tuple): Dimensions of tiles when rendering
+            tile_dim (tuple): Dimensions of tiles when rendering. In blender 3.0+
+                tiles are square with side tile_dim[0]
+            auto_tune (bool): Use the threads and tile dimensions cached by
+                auto_tune_renderer for this resolution, engine and host if any.
+                They overwrite tile_dim. False to always use tile_dim
+            adaptive_threshold (float): noise threshold of adaptive sampling,
+                samples is then the max. See shps.scheduler to set it per frame.
+                Needs blender 2.83+
+            time_limit (float): max seconds of path tracing per frame. Needs
+                blender 3.0+
         """
         shps.render.set_render_config(render=render_type,
                                       image_resolution=image_resolution,
                                       gpu=gpu,
                                       samples=samples,
                                       max_bounces=max_bouces,
-                                      tile_dim=tile_dim)
+                                      tile_dim=tile_dim,
+                                      adaptive_threshold=adaptive_threshold,
+                                      time_limit=time_limit)
+        if auto_tune:
+            shps.tuning.apply_tuned_config()
+
+    def auto_tune_renderer(self, **kwargs) -> dict:
+        """Calibrates threads and tile dimensions rendering the current world.
+
+        Call it once the world is populated. The result is cached and applied,
+        later runs use it in set_renderer unless auto_tune=False.
+        For the arguments see shps.tuning.auto_tune
+        """
+        self.sync()
+        return shps.tuning.auto_tune(**kwargs)
 
     def _next_id(self):
         return len(self._shapes)